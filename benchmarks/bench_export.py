@@ -0,0 +1,85 @@
+"""
+The benchmark of export() with sliced scrolls in worker processes against the local stub server.
+It prints the throughput of each number of workers. Documents and their references are built in workers,
+then they are sent to this process.
+`--delay` simulates the work of elasticsearch for each request, workers scale on one core with it.
+$ python3 benchmarks/bench_export.py
+$ python3 benchmarks/bench_export.py --total 20000 --workers 1 2 4 --delay 0.005
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from django.conf import settings
+
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+
+
+def serve(total, delay, connection):
+    """
+    Run the stub server in its own process, so it doesn't share the GIL with the exporting process.
+    """
+    from stub_server import StubElasticsearch
+    server = StubElasticsearch(total=total, delay=delay)
+    connection.send(server.start())
+    connection.recv()
+    server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure export() with worker processes.')
+    parser.add_argument('--total', type=int, default=100000, help='The number of documents.')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='The numbers of workers.')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds of the server work of each request.')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(BENCHMARKS, os.pardir))
+    sys.path.insert(0, BENCHMARKS)
+    connection, child_connection = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=serve, args=(args.total, args.delay, child_connection), daemon=True)
+    server.start()
+    settings.configure(
+        TINA_ELASTICSEARCH_URL=connection.recv(),
+    )
+    from bench_models import BenchmarkModel
+
+    def export(slices, workers, fetch_reference=False):
+        count = sum(1 for _ in BenchmarkModel.all().export(slices, workers, args.batch_size, fetch_reference))
+        assert count == args.total, count
+
+    def export_references(slices, workers):
+        # each batch refers to 100 accounts, they are fetched with one mget in the worker
+        export(slices, workers, True)
+
+    def export_jsonl(slices, workers):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'benchmark-{slice}.jsonl')
+        result = BenchmarkModel.all().export_jsonl(path, slices, workers, args.batch_size)
+        assert sum(x['documents'] for x in result) == args.total, result
+        for x in result:
+            os.remove(x['path'])
+        os.rmdir(directory)
+
+    try:
+        # warm up the hits of the stub server
+        export(1, 0)
+        for name, function in [('export', export), ('references', export_references), ('export_jsonl', export_jsonl)]:
+            cases = [('in process', 1, 0)] + [('%d workers' % x, x, x) for x in args.workers]
+            baseline = None
+            for label, slices, workers in cases:
+                started_at = time.perf_counter()
+                function(slices, workers)
+                elapsed = time.perf_counter() - started_at
+                baseline = baseline or elapsed
+                print('%-12s %-12s %10.0f docs/s %6.2fx' % (name, label, args.total / elapsed, baseline / elapsed))
+    finally:
+        connection.send(None)
+        server.join()
+
+
+if __name__ == '__main__':
+    main()
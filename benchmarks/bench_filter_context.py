@@ -0,0 +1,58 @@
+"""
+The benchmark of the filter context against the elasticsearch server.
+It creates the index `tina_benchmark_filter` and runs the same filter query again and again.
+$ TINA_ELASTICSEARCH_URL=http://localhost:9200 python3 benchmarks/bench_filter_context.py
+"""
+import os
+import random
+import sys
+import time
+from django.conf import settings
+
+
+def main():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    settings.configure(
+        TINA_ELASTICSEARCH_URL=os.environ.get('TINA_ELASTICSEARCH_URL', 'http://localhost:9200'),
+    )
+    from tina import db
+
+    class BenchmarkFilterModel(db.Document):
+        _index = 'tina_benchmark_filter'
+        category = db.StringProperty(analyzer='keyword')
+        quota = db.IntegerProperty()
+        created_at = db.DateTimeProperty()
+
+    BenchmarkFilterModel.update_mapping()
+    if BenchmarkFilterModel.all().count() < 100000:
+        documents = [BenchmarkFilterModel(
+            category=random.choice(['a', 'b', 'c', 'd']),
+            quota=random.randint(0, 1000),
+        ) for x in range(100000)]
+        BenchmarkFilterModel.save_many(documents, synchronized=True)
+
+    def build_query(filter_context):
+        return BenchmarkFilterModel.where('category', contains=['a', 'b'])\
+            .where('quota', greater_equal=100)\
+            .where('quota', less=900)\
+            .filter_context(filter_context)\
+            .order_by('created_at')
+
+    for filter_context in [False, True]:
+        query = build_query(filter_context)
+        query.fetch(20)  # warm up
+        durations = []
+        for x in range(200):
+            start = time.time()
+            query.fetch(20)
+            durations.append(time.time() - start)
+        durations.sort()
+        print('filter_context=%s: mean %.2f ms, p95 %.2f ms' % (
+            filter_context,
+            sum(durations) / len(durations) * 1000,
+            durations[int(len(durations) * 0.95)] * 1000,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+The micro-benchmark of building documents from search hits.
+$ python3 benchmarks/bench_hydration.py
+"""
+import os
+import sys
+import timeit
+from django.conf import settings
+
+
+def main():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    settings.configure(
+        TINA_ELASTICSEARCH_URL='http://localhost:9200',
+    )
+    from tina import db
+
+    class BenchmarkModel(db.Document):
+        name = db.StringProperty()
+        email = db.StringProperty()
+        is_vip = db.BooleanProperty(default=False)
+        quota = db.FloatProperty(default=0.0)
+        count = db.IntegerProperty(default=0)
+        tags = db.ListProperty(item_type=str, default=[])
+        extra = db.DictProperty(default={})
+        created_at = db.DateTimeProperty()
+        updated_at = db.DateTimeProperty()
+
+    hits = [{
+        '_id': 'id-%s' % index,
+        '_version': 1,
+        '_source': {
+            'name': 'tina',
+            'email': 'kelp@phate.org',
+            'is_vip': True,
+            'quota': 1.5,
+            'count': index,
+            'tags': ['a', 'b'],
+            'extra': {'key': 'value'},
+            'created_at': '2015-09-01T10:20:30Z',
+            'updated_at': '2015-09-01T10:20:30Z',
+        },
+    } for index in range(1000)]
+
+    def hydrate():
+        for hit in hits:
+            BenchmarkModel(_id=hit['_id'], _version=hit['_version'], **hit['_source'])
+
+    def hydrate_from_storage():
+        # _from_storage adopts `_source`, so copy it like a new response
+        for hit in hits:
+            BenchmarkModel._from_storage({'_id': hit['_id'], '_version': hit['_version'], '_source': dict(hit['_source'])})
+
+    times = timeit.repeat(hydrate, number=10, repeat=5)
+    print('hydrate 1000 hits with the constructor: %.2f ms' % (min(times) / 10 * 1000))
+    times = timeit.repeat(hydrate_from_storage, number=10, repeat=5)
+    print('hydrate 1000 hits from storage: %.2f ms' % (min(times) / 10 * 1000))
+
+
+if __name__ == '__main__':
+    main()
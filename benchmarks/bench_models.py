@@ -0,0 +1,24 @@
+"""
+Document classes of benchmarks which worker processes pickle by reference.
+Configure settings before importing it.
+"""
+from tina import db
+
+
+class BenchmarkAccount(db.Document):
+    _index_name = 'benchmark_account'
+    name = db.StringProperty()
+
+
+class BenchmarkModel(db.Document):
+    _index_name = 'benchmark'
+    name = db.StringProperty()
+    email = db.StringProperty()
+    is_vip = db.BooleanProperty(default=False)
+    quota = db.FloatProperty(default=0.0)
+    count = db.IntegerProperty(default=0)
+    tags = db.ListProperty(item_type=str, default=[])
+    extra = db.DictProperty(default={})
+    created_at = db.DateTimeProperty()
+    account = db.ReferenceProperty(BenchmarkAccount)
+    product = db.StringProperty()
@@ -0,0 +1,47 @@
+"""
+The micro-benchmark of reading properties.
+$ python3 benchmarks/bench_properties.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+from django.conf import settings
+
+
+def main():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    settings.configure(
+        TINA_ELASTICSEARCH_URL='http://localhost:9200',
+    )
+    from tina import db
+
+    class BenchmarkModel(db.Document):
+        name = db.StringProperty()
+        created_at = db.DateTimeProperty()
+
+    document = BenchmarkModel(name='tina', created_at=datetime.utcnow())
+
+    def read_string():
+        document.name
+
+    def read_datetime():
+        document.created_at
+
+    def parse_datetime():
+        db.DateTimeProperty._to_python('2015-09-01T10:20:30Z')
+
+    def parse_datetime_with_strptime():
+        datetime.strptime('2015-09-01T10:20:30', '%Y-%m-%dT%H:%M:%S')
+
+    for name, function in [
+            ('read StringProperty', read_string),
+            ('read DateTimeProperty', read_datetime),
+            ('parse the datetime', parse_datetime),
+            ('parse the datetime with strptime', parse_datetime_with_strptime)]:
+        times = timeit.repeat(function, number=100000, repeat=5)
+        print('%s: %.3f us' % (name, min(times) / 100000 * 1000000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+The micro-benchmark of compiling queries.
+$ python3 benchmarks/bench_query.py
+"""
+import os
+import sys
+import timeit
+from django.conf import settings
+
+
+def main():
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+    settings.configure(
+        TINA_ELASTICSEARCH_URL='http://localhost:9200',
+    )
+    from tina import db
+    from tina.query import QueryParameter, compiled_query_cache
+
+    class BenchmarkModel(db.Document):
+        name = db.StringProperty()
+        age = db.IntegerProperty()
+        tags = db.ListProperty(item_type=str)
+        created_at = db.DateTimeProperty()
+
+    def build_query(name, age, tags):
+        return BenchmarkModel.where('name', equal=name)\
+            .where('age', greater_equal=age)\
+            .where('tags', contains=tags)\
+            .where(lambda x: x.where('name', like=name).union('age', less=age))\
+            .order_by('created_at')
+
+    template = build_query(QueryParameter('name'), QueryParameter('age'), QueryParameter('tags'))
+    query = build_query('tina', 10, ['a', 'b'])
+
+    def compile_new_query():
+        query = build_query('tina', 10, ['a', 'b'])
+        query._Query__compile_queries(query.items)
+
+    def compile_without_cache():
+        query._Query__compile_template_queries(query.items)
+
+    def compile_again():
+        query._Query__compile_queries(query.items)
+
+    def compile_bound_template():
+        query = template.bind(name='tina', age=10, tags=['a', 'b'])
+        query._Query__compile_queries(query.items)
+
+    for name, function in [
+            ('build and compile the query', compile_new_query),
+            ('compile without the cache', compile_without_cache),
+            ('compile the same query again', compile_again),
+            ('bind and compile the template', compile_bound_template)]:
+        times = timeit.repeat(function, number=10000, repeat=5)
+        print('%s: %.2f us' % (name, min(times) / 10000 * 1000000))
+    print(compiled_query_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
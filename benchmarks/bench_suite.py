@@ -0,0 +1,189 @@
+"""
+The benchmark suite against the local stand-in elasticsearch server (benchmarks/stub_server.py).
+It measures queries through the public api: compilation, hydration, reference resolution, bulk saving and allocations of tina and the client.
+Results are written as json, compare them between commits with benchmarks/compare.py.
+$ python3 benchmarks/bench_suite.py --output before.json
+$ git checkout other-branch
+$ python3 benchmarks/bench_suite.py --output after.json
+$ python3 benchmarks/compare.py before.json after.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from django.conf import settings
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+def measure(function, number=1, repeat=5, setup=None):
+    """
+    Measure the function.
+    :param function: {function} The function of one operation.
+    :param number: {int} The number of calls in one repetition.
+    :param repeat: {int} The number of repetitions. The fastest one is the result.
+    :param setup: {function} () -> {tuple} Arguments of the function. It is called before each call and isn't timed.
+    :return: {dict} {'seconds': {float} per call, 'peak_kb': {float} The peak memory of one call.}
+    """
+    best = None
+    for _ in range(repeat):
+        elapsed = 0.0
+        # the same as timeit, the garbage collection isn't timed
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(number):
+                arguments = setup() if setup else ()
+                started_at = time.perf_counter()
+                function(*arguments)
+                elapsed += time.perf_counter() - started_at
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+
+    arguments = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'seconds': best / number,
+        'peak_kb': peak / 1024,
+    }
+
+
+def measure_hydration(function, repeat=5):
+    """
+    Measure the hydration of the fetch with `hydration_time` of the query_finished signal.
+    The request and parsing the response in the client aren't included.
+    :param function: {function} The function which fetches once.
+    :param repeat: {int} The number of repetitions. The fastest one is the result.
+    :return: {dict} {'seconds': {float} per fetch, 'peak_kb': {float} The peak memory of one fetch.}
+    """
+    from tina.instrumentation import query_finished
+    times = []
+    def receiver(sender, operation, hydration_time, **kwargs):
+        if operation == 'fetch':
+            times.append(hydration_time)
+    query_finished.connect(receiver)
+    try:
+        result = measure(function, repeat=repeat)
+    finally:
+        query_finished.disconnect(receiver)
+    result['seconds'] = min(times)
+    return result
+
+
+def get_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL,
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmark suite against the local stub server.')
+    parser.add_argument('--output', help='Write results to the json file.')
+    parser.add_argument('--quick', action='store_true', help='Skip 100k hits and repeat less.')
+    args = parser.parse_args()
+    repeat = 3 if args.quick else 5
+    sizes = [1000, 10000] if args.quick else [1000, 10000, 100000]
+
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from stub_server import StubElasticsearch
+
+    server = StubElasticsearch(total=max(sizes))
+    settings.configure(
+        TINA_ELASTICSEARCH_URL=server.start(),
+    )
+    from tina import db
+    from tina.query import QueryParameter
+
+    class BenchmarkAccount(db.Document):
+        name = db.StringProperty()
+
+    class BenchmarkProduct(db.Document):
+        name = db.StringProperty()
+
+    class BenchmarkModel(db.Document):
+        name = db.StringProperty()
+        email = db.StringProperty()
+        is_vip = db.BooleanProperty(default=False)
+        quota = db.FloatProperty(default=0.0)
+        count = db.IntegerProperty(default=0)
+        tags = db.ListProperty(item_type=str, default=[])
+        extra = db.DictProperty(default={})
+        created_at = db.DateTimeProperty()
+        account = db.ReferenceProperty(BenchmarkAccount)
+        product = db.ReferenceProperty(BenchmarkProduct)
+
+    def build_query(name, count, tags):
+        return BenchmarkModel.where('name', equal=name)\
+            .where('count', greater_equal=count)\
+            .where('tags', contains=tags)\
+            .where(lambda x: x.where('name', like=name).union('count', less=count))\
+            .order_by('created_at')
+    template = build_query(QueryParameter('name'), QueryParameter('count'), QueryParameter('tags'))
+
+    def count_query():
+        build_query('tina', 10, ['a', 'b']).count()
+
+    def count_template():
+        template.bind(name='tina', count=10, tags=['a', 'b']).count()
+
+    def fetch(size, fetch_reference=False):
+        return lambda: BenchmarkModel.all().fetch(size, fetch_reference=fetch_reference)
+
+    # the compiled query is sent to the stub server, the round trip of count is small
+    cases = [
+        ('count_query', lambda: measure(count_query, number=1000, repeat=repeat)),
+        ('count_template', lambda: measure(count_template, number=1000, repeat=repeat)),
+    ]
+    for size in sizes:
+        cases.append(('hydrate_%sk' % (size // 1000), lambda size=size: measure_hydration(fetch(size), repeat)))
+        cases.append(('fetch_%sk' % (size // 1000), lambda size=size: measure(fetch(size), repeat=repeat)))
+    cases.extend([
+        # 1000 hits refer to 100 accounts and 500 products: two mget requests at the same time
+        ('fetch_references_1k', lambda: measure(fetch(1000, True), repeat=repeat)),
+        ('get', lambda: measure(lambda: BenchmarkAccount.get('account-1'), number=100, repeat=repeat)),
+        ('save', lambda: measure(
+            lambda: BenchmarkAccount(_id='account-1', name='tina').save(), number=100, repeat=repeat,
+        )),
+        ('save_many_10k', lambda: measure(lambda: BenchmarkModel.save_many([
+            BenchmarkModel(name='tina-%s' % x, count=x, tags=['a']) for x in range(10000)
+        ]), repeat=repeat)),
+    ])
+
+    results = {}
+    try:
+        for name, run in cases:
+            result = run()
+            results[name] = result
+            print('%-22s %12.3f ms %12.1f KB peak' % (name, result['seconds'] * 1000, result['peak_kb']))
+    finally:
+        server.stop()
+    print('requests of the stub server: %s' % server.requests)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': get_commit(),
+                'python': platform.python_version(),
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Compare two results of benchmarks/bench_suite.py.
+It exits with 1 when any benchmark is slower than the threshold.
+$ python3 benchmarks/compare.py before.json after.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+
+def compare(before, after, threshold=0.1):
+    """
+    Compare results.
+    :param before: {dict} The result json of bench_suite.py.
+    :param after: {dict} The result json of bench_suite.py.
+    :param threshold: {float} 0.1: it is a regression when it is 10% slower.
+    :returns: {tuple} ({list}[{tuple}], {list}[{string}])
+        [(name, {float}before seconds, {float}after seconds, {float}change)] The benchmarks in both results.
+        [name] The regressions.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(before['results']) & set(after['results'])):
+        old = before['results'][name]['seconds']
+        new = after['results'][name]['seconds']
+        change = (new - old) / old if old else 0.0
+        rows.append((name, old, new, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two results of the benchmark suite.')
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.1, help='The allowed slowdown. Default is 0.1 (10%%).')
+    args = parser.parse_args()
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    rows, regressions = compare(before, after, args.threshold)
+    print('%-22s %12s %12s %9s' % ('benchmark', before.get('commit') or 'before', after.get('commit') or 'after', 'change'))
+    for name, old, new, change in rows:
+        print('%-22s %9.3f ms %9.3f ms %+8.1f%%%s' % (
+            name, old * 1000, new * 1000, change * 100, '  <- regression' if name in regressions else '',
+        ))
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
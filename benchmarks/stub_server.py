@@ -0,0 +1,238 @@
+"""
+The local stand-in elasticsearch server of benchmarks.
+It serves canned responses of search, (sliced) scroll, count, get, mget, index and bulk, so benchmarks measure the overhead of
+tina and the client without the work of elasticsearch.
+```
+server = StubElasticsearch(total=10000)
+url = server.start()
+...
+server.stop()
+```
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+def make_source(index):
+    """
+    The `_source` of the hit.
+    :param index: {int} The position of the hit.
+    :return: {dict}
+    """
+    return {
+        'name': 'tina-%s' % index,
+        'email': 'kelp@phate.org',
+        'is_vip': index % 2 == 0,
+        'quota': index * 1.5,
+        'count': index,
+        'tags': ['a', 'b'],
+        'extra': {'key': 'value'},
+        'created_at': '2015-09-01T10:20:30Z',
+        'account': 'account-%s' % (index % 100),
+        'product': 'product-%s' % (index % 500),
+    }
+
+
+class StubElasticsearch(object):
+    """
+    The stub server. Requests are counted by the api name in `requests`.
+    """
+    def __init__(self, total=1000, source=make_source, host='127.0.0.1', port=0, delay=0.0):
+        """
+        :param total: {int} The number of documents of search and count.
+        :param source: {function} (index) -> {dict} The source of the search hit.
+        :param delay: {float} Seconds of the server work of each request.
+        :param host: {string}
+        :param port: {int} 0: pick a free port.
+        """
+        self.total = total
+        self.source = source
+        self.delay = delay
+        self.requests = {}
+        self.__hits = []
+        self.__hits_lock = threading.Lock()
+        self.__server = _ThreadingHTTPServer((host, port), _Handler)
+        self.__server.stub = self
+        self.__thread = None
+
+    @property
+    def url(self):
+        host, port = self.__server.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def start(self):
+        """
+        Serve in the background thread.
+        :return: {string} The url of the server.
+        """
+        self.__thread = threading.Thread(target=self.__server.serve_forever, daemon=True)
+        self.__thread.start()
+        return self.url
+
+    def stop(self):
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
+
+    def count_request(self, api):
+        self.requests[api] = self.requests.get(api, 0) + 1
+
+    def get_hits(self, skip, size):
+        """
+        Get serialized hits. They are generated once.
+        :param skip: {int}
+        :param size: {int}
+        :return: {list} [{string}]
+        """
+        stop = min(skip + size, self.total)
+        if len(self.__hits) < stop:
+            with self.__hits_lock:
+                for index in range(len(self.__hits), stop):
+                    self.__hits.append(json.dumps({
+                        '_index': 'benchmark',
+                        '_type': 'BenchmarkModel',
+                        '_id': 'id-%s' % index,
+                        '_version': 1,
+                        '_score': 1.0,
+                        '_source': self.source(index),
+                    }))
+        return self.__hits[skip:stop]
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and the body are written separately, don't wait for the delayed ack of keep-alive connections
+    disable_nagle_algorithm = True
+    # /index/type/_search, /index/_search, /_search
+    search_pattern = re.compile(r'^(?:/[^/_][^/]*){0,2}/_search$')
+    count_pattern = re.compile(r'^(?:/[^/_][^/]*){0,2}/_count$')
+    mget_pattern = re.compile(r'^(?:/[^/_][^/]*){0,2}/_mget$')
+    bulk_pattern = re.compile(r'^(?:/[^/_][^/]*){0,2}/_bulk$')
+    document_pattern = re.compile(r'^/[^/_][^/]*/[^/_][^/]*/([^/_][^/]*)$')
+    # /_search/scroll, /_search/scroll/<scroll id>
+    scroll_pattern = re.compile(r'^/_search/scroll(?:/([^/]+))?$')
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.__reply(200, '')
+
+    def do_GET(self):
+        self.__dispatch()
+
+    def do_POST(self):
+        self.__dispatch()
+
+    def do_PUT(self):
+        self.__dispatch()
+
+    def do_DELETE(self):
+        self.__dispatch()
+
+    def __dispatch(self):
+        stub = self.server.stub
+        url = urlparse(self.path)
+        path = url.path.rstrip('/')
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8') if length else ''
+        if stub.delay:
+            time.sleep(stub.delay)
+
+        parameters = parse_qs(url.query)
+        match = self.scroll_pattern.match(path)
+        if match:
+            if self.command == 'DELETE':
+                stub.count_request('clear_scroll')
+                return self.__reply(200, json.dumps({'succeeded': True}))
+            stub.count_request('scroll')
+            scroll_id = match.group(1) or parameters.get('scroll_id', [None])[0]
+            if scroll_id is None:
+                scroll_id = json.loads(body)['scroll_id'] if body.startswith('{') else body
+            # the scroll id is `{next}:{stop}:{size}`
+            skip, stop, size = [int(x) for x in scroll_id.split(':')]
+            return self.__reply_scroll(skip, stop, size)
+        if self.search_pattern.match(path):
+            stub.count_request('search')
+            query = json.loads(body) if body else {}
+            size = int(query.get('size', parameters.get('size', [10])[0]))
+            if 'scroll' in parameters:
+                # each slice scrolls a continuous range of hits
+                start, stop = 0, stub.total
+                if 'slice' in query:
+                    start = stub.total * query['slice']['id'] // query['slice']['max']
+                    stop = stub.total * (query['slice']['id'] + 1) // query['slice']['max']
+                return self.__reply_scroll(start, stop, size)
+            skip = int(query.get('from', parameters.get('from', [0])[0]))
+            hits = stub.get_hits(skip, size)
+            return self.__reply(200, '{"took":1,"timed_out":false,"hits":{"total":%d,"max_score":1.0,"hits":[%s]}}' % (
+                stub.total, ','.join(hits),
+            ))
+        if self.count_pattern.match(path):
+            stub.count_request('count')
+            return self.__reply(200, json.dumps({'count': stub.total}))
+        if self.mget_pattern.match(path):
+            stub.count_request('mget')
+            ids = json.loads(body).get('ids', [])
+            return self.__reply(200, json.dumps({'docs': [
+                {'_id': x, '_version': 1, 'found': True, '_source': {'name': x}} for x in ids
+            ]}))
+        if self.bulk_pattern.match(path):
+            stub.count_request('bulk')
+            items = []
+            for line in body.splitlines():
+                action = json.loads(line) if line.strip() else None
+                if action and ('index' in action or 'delete' in action):
+                    operation = 'index' if 'index' in action else 'delete'
+                    items.append({operation: {
+                        '_index': action[operation].get('_index'),
+                        '_type': action[operation].get('_type'),
+                        '_id': action[operation].get('_id') or 'id-%s' % len(items),
+                        '_version': (action[operation].get('_version') or 0) + 1,
+                        'status': 201 if operation == 'index' else 200,
+                    }})
+            return self.__reply(200, json.dumps({'took': 1, 'errors': False, 'items': items}))
+        match = self.document_pattern.match(path)
+        if match:
+            document_id = match.group(1)
+            if self.command == 'GET':
+                stub.count_request('get')
+                return self.__reply(200, json.dumps({
+                    '_id': document_id, '_version': 1, 'found': True, '_source': {'name': document_id},
+                }))
+            stub.count_request('delete' if self.command == 'DELETE' else 'index')
+            return self.__reply(200, json.dumps({'_id': document_id, '_version': 2, 'created': True, 'found': True}))
+        if path == '':
+            return self.__reply(200, json.dumps({'version': {'number': '1.7.0'}}))
+        if self.command in ('POST', 'PUT'):
+            # index without id
+            stub.count_request('index')
+            return self.__reply(201, json.dumps({'_id': 'id-new', '_version': 1, 'created': True}))
+        self.__reply(404, json.dumps({'error': 'not found: %s' % path, 'status': 404}))
+
+    def __reply_scroll(self, skip, stop, size):
+        hits = self.server.stub.get_hits(skip, max(0, min(size, stop - skip)))
+        return self.__reply(
+            200,
+            '{"_scroll_id":"%d:%d:%d","took":1,"timed_out":false,"hits":{"total":%d,"max_score":1.0,"hits":[%s]}}' % (
+                skip + len(hits), stop, size, stop, ','.join(hits),
+            ),
+        )
+
+    def __reply(self, status, content):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
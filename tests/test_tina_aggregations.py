@@ -0,0 +1,130 @@
+import unittest
+from datetime import datetime
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty, IntegerProperty, DateTimeProperty
+from tina.aggregations import Aggregation, Sum, Avg, Min, Max, Stats, Cardinality, Percentiles, Terms, Histogram, \
+    DateHistogram, StatsResult, Bucket
+from tina.exceptions import PropertyNotExist, QuerySyntaxError
+
+
+class FakeOrder(Document):
+    state = StringProperty()
+    country = StringProperty()
+    price = IntegerProperty()
+    created_at = DateTimeProperty()
+
+
+class TestTinaAggregations(unittest.TestCase):
+    def test_tina_aggregations_to_dict(self):
+        self.assertDictEqual(Sum('price').to_dict(FakeOrder), {'sum': {'field': 'price'}})
+        self.assertDictEqual(Cardinality('state', 100).to_dict(FakeOrder), {
+            'cardinality': {'field': 'state', 'precision_threshold': 100},
+        })
+        self.assertDictEqual(Percentiles('price', [50, 99]).to_dict(FakeOrder), {
+            'percentiles': {'field': 'price', 'percents': [50, 99]},
+        })
+        self.assertDictEqual(Terms('state', size=5, countries=Terms('country', total=Sum('price'))).to_dict(FakeOrder), {
+            'terms': {'field': 'state', 'size': 5, 'order': {'_count': 'desc'}},
+            'aggs': {
+                'countries': {
+                    'terms': {'field': 'country', 'size': 10, 'order': {'_count': 'desc'}},
+                    'aggs': {'total': {'sum': {'field': 'price'}}},
+                },
+            },
+        })
+        self.assertDictEqual(DateHistogram('created_at', 'month').to_dict(FakeOrder), {
+            'date_histogram': {'field': 'created_at', 'interval': 'month', 'min_doc_count': 0},
+        })
+
+    def test_tina_aggregations_check_member(self):
+        self.assertRaises(PropertyNotExist, Sum('nothing').to_dict, FakeOrder)
+        self.assertRaises(QuerySyntaxError, DateHistogram('price').to_dict, FakeOrder)
+
+    def test_tina_aggregations_parse(self):
+        self.assertEqual(Stats('price').parse({'count': 2, 'min': 1.0, 'max': 3.0, 'avg': 2.0, 'sum': 4.0}),
+                         StatsResult(count=2, min=1.0, max=3.0, avg=2.0, sum=4.0))
+        self.assertDictEqual(Percentiles('price').parse({'values': {'50.0': 2.0, '99.0': 3.0}}), {50.0: 2.0, 99.0: 3.0})
+        self.assertEqual(DateHistogram('created_at').parse({'buckets': [
+            {'key_as_string': '2015-09-01T00:00:00.000Z', 'key': 1441065600000, 'doc_count': 3},
+        ]}), [Bucket(datetime(2015, 9, 1), 3)])
+
+    def test_tina_aggregations_parse_default(self):
+        class ValueCount(Aggregation):
+            aggregation_type = 'value_count'
+        self.assertDictEqual(ValueCount('price').to_dict(FakeOrder), {'value_count': {'field': 'price'}})
+        self.assertDictEqual(ValueCount('price').parse({'value': 2}), {'value': 2})
+
+    def test_tina_aggregations_query_aggregate(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            'hits': {'total': 3, 'hits': []},
+            'aggregations': {
+                'total': {'value': 12.0},
+                'average': {'value': 4.0},
+                'cheapest': {'value': 1.0},
+                'highest': {'value': 8.0},
+                'states': {'buckets': [
+                    {'key': 'paid', 'doc_count': 2, 'total': {'value': 9.0}},
+                ]},
+                'prices': {'buckets': [
+                    {'key': 0, 'doc_count': 2},
+                    {'key': 5, 'doc_count': 1},
+                ]},
+            },
+        }
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch.object(FakeOrder, 'get_index_name', new=MagicMock(return_value='order')):
+            result = FakeOrder.where('state', exclude=['canceled']).aggregate(
+                total=Sum('price'),
+                average=Avg('price'),
+                cheapest=Min('price'),
+                highest=Max('price'),
+                states=Terms('state', total=Sum('price')),
+                prices=Histogram('price', 5),
+            )
+        self.assertEqual(fake_es.search.call_count, 1)
+        request = fake_es.search.call_args[1]
+        self.assertEqual(request['index'], 'order')
+        self.assertEqual(request['body']['size'], 0)
+        self.assertIn('query', request['body'])
+        self.assertEqual(len(request['body']['aggs']), 6)
+        self.assertEqual(result['total'], 12.0)
+        self.assertEqual(result['average'], 4.0)
+        self.assertEqual(result['cheapest'], 1.0)
+        self.assertEqual(result['highest'], 8.0)
+        self.assertEqual(result['states'], [Bucket('paid', 2, {'total': 9.0})])
+        self.assertEqual(result['states'][0]['total'], 9.0)
+        self.assertEqual([x.key for x in result['prices']], [0, 5])
+
+    def test_tina_aggregations_query_aggregate_empty(self):
+        self.assertRaises(QuerySyntaxError, FakeOrder.all().aggregate)
+
+    def test_tina_aggregations_query_fetch_with_facets(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            'hits': {'total': 3, 'hits': [
+                {'_id': 'id-A', '_version': 1, '_source': {'state': 'paid', 'country': 'TW', 'price': 4}},
+            ]},
+            'aggregations': {
+                'states': {'buckets': [{'key': 'paid', 'doc_count': 3}]},
+                'countries': {'buckets': [{'key': 'TW', 'doc_count': 2}, {'key': 'JP', 'doc_count': 1}]},
+            },
+        }
+        with patch('tina.document.Document._es', new=fake_es):
+            documents, total, facets = FakeOrder.where('state', equal='paid').fetch_with_facets(
+                {'states': Terms('state'), 'countries': Terms('country')},
+                limit=20,
+            )
+        self.assertEqual(fake_es.search.call_count, 1)
+        body = fake_es.search.call_args[1]['body']
+        self.assertEqual(body['size'], 20)
+        self.assertEqual(set(body['aggs'].keys()), {'states', 'countries'})
+        self.assertEqual(total, 3)
+        self.assertEqual([x._id for x in documents], ['id-A'])
+        self.assertEqual(documents[0].country, 'TW')
+        self.assertEqual(facets['states'], [Bucket('paid', 3)])
+        self.assertEqual([x.key for x in facets['countries']], ['TW', 'JP'])
+
+    def test_tina_aggregations_query_fetch_with_facets_empty(self):
+        self.assertRaises(QuerySyntaxError, FakeOrder.all().fetch_with_facets, {})
@@ -0,0 +1,107 @@
+import unittest
+from datetime import datetime
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty, DateTimeProperty
+from tina.identity_map import IdentityMap
+from tina.exceptions import PropertyNotExist, QuerySyntaxError, TransportError
+
+
+class FakeOrder(Document):
+    _index_name = 'order'
+    state = StringProperty()
+    expired_at = DateTimeProperty()
+
+
+def fake_elasticsearch(*task_responses):
+    """
+    The fake client which starts the task `node:1`, then responds polling requests in order.
+    """
+    es = MagicMock()
+    responses = list(task_responses)
+    def perform_request(method, url, params=None, body=None):
+        if method == 'POST':
+            return 200, {'task': 'node:1'}
+        return 200, responses.pop(0)
+    es.transport.perform_request.side_effect = perform_request
+    return es
+
+
+class TestTinaByQuery(unittest.TestCase):
+    def setUp(self):
+        index_name_patcher = patch.object(FakeOrder, 'get_index_name', new=MagicMock(return_value='order'))
+        index_name_patcher.start()
+        self.addCleanup(index_name_patcher.stop)
+        sleep_patcher = patch('tina.by_query.time.sleep')
+        self.sleep = sleep_patcher.start()
+        self.addCleanup(sleep_patcher.stop)
+
+    def test_tina_by_query_delete(self):
+        es = fake_elasticsearch(
+            {'completed': False, 'task': {'status': {'total': 10, 'deleted': 4}}},
+            {'completed': True, 'response': {'total': 10, 'deleted': 9, 'version_conflicts': 1, 'batches': 1, 'failures': []}},
+        )
+        with patch.object(FakeOrder, '_es', new=es), IdentityMap() as identity_map:
+            identity_map.add(FakeOrder(_id='id-A'))
+            result = FakeOrder.where('state', equal='expired').delete(slices=4, requests_per_second=500)
+            self.assertEqual(identity_map.documents, {})
+        self.assertEqual(result['task'], 'node:1')
+        self.assertTrue(result['completed'])
+        self.assertEqual(result['deleted'], 9)
+        self.assertEqual(result['version_conflicts'], 1)
+        method, url = es.transport.perform_request.call_args_list[0][0]
+        self.assertEqual((method, url), ('POST', '/order/_delete_by_query'))
+        self.assertEqual(es.transport.perform_request.call_args_list[0][1]['params'], {
+            'conflicts': 'proceed',
+            'wait_for_completion': 'false',
+            'slices': 4,
+            'requests_per_second': 500,
+        })
+        self.assertIn('query', es.transport.perform_request.call_args_list[0][1]['body'])
+        self.assertEqual(es.transport.perform_request.call_args_list[1][0], ('GET', '/_tasks/node:1'))
+        self.assertEqual(self.sleep.call_count, 1)
+
+    def test_tina_by_query_update(self):
+        es = fake_elasticsearch({'completed': True, 'response': {'total': 2, 'updated': 2}})
+        with patch.object(FakeOrder, '_es', new=es):
+            result = FakeOrder.all().update(
+                set={'state': 'expired', 'expired_at': datetime(2016, 1, 1)},
+                script='ctx._source.version_note = params.note',
+                params={'note': 'expired'},
+                synchronized=True,
+            )
+            self.assertRaises(PropertyNotExist, FakeOrder.all().update, set={'name': 'kelp'})
+            self.assertRaises(QuerySyntaxError, FakeOrder.all().update)
+        self.assertEqual(result['updated'], 2)
+        _, url = es.transport.perform_request.call_args_list[0][0]
+        self.assertEqual(url, '/order/_update_by_query')
+        self.assertEqual(es.transport.perform_request.call_args_list[0][1]['params']['refresh'], 'true')
+        self.assertEqual(es.transport.perform_request.call_args_list[0][1]['body'], {
+            'query': {'match_all': {}},
+            'script': {
+                'inline': 'ctx._source.putAll(params.tina_set); ctx._source.version_note = params.note',
+                'lang': 'painless',
+                'params': {
+                    'note': 'expired',
+                    'tina_set': {'state': 'expired', 'expired_at': '2016-01-01T00:00:00Z'},
+                },
+            },
+        })
+
+    def test_tina_by_query_without_waiting(self):
+        es = fake_elasticsearch({'completed': True, 'error': {'type': 'search_phase_execution_exception'}})
+        with patch.object(FakeOrder, '_es', new=es):
+            result = FakeOrder.all().delete(wait=False)
+            self.assertEqual(result['task'], 'node:1')
+            self.assertFalse(result['completed'])
+            self.assertEqual(es.transport.perform_request.call_count, 1)
+            from tina import by_query
+            self.assertRaises(TransportError, by_query.wait_for_task, FakeOrder, result['task'])
+
+    def test_tina_by_query_contains_empty(self):
+        es = MagicMock()
+        with patch.object(FakeOrder, '_es', new=es):
+            result = FakeOrder.where('state', contains=[]).delete()
+        self.assertTrue(result['completed'])
+        self.assertEqual(result['deleted'], 0)
+        es.transport.perform_request.assert_not_called()
@@ -0,0 +1,166 @@
+import unittest
+from mock import MagicMock, patch
+from tina import cache
+from tina.cache import LocMemDocumentCache, AggregationCache
+from tina.document import Document
+from tina.properties import StringProperty
+
+
+class FakeCachedDocument(Document):
+    _index_name = 'cached'
+    _cache = True
+    name = StringProperty()
+class FakeAggregationDocument(Document):
+    _index_name = 'aggregation'
+    _aggregation_cache = True
+    name = StringProperty()
+
+
+class TestTinaCache(unittest.TestCase):
+    def setUp(self):
+        cache.reset_document_cache()
+        cache.reset_aggregation_cache()
+
+    def tearDown(self):
+        cache.reset_document_cache()
+        cache.reset_aggregation_cache()
+
+    def test_tina_cache_lru(self):
+        document_cache = LocMemDocumentCache(max_size=2)
+        document_cache.set('A', 1, '{}')
+        document_cache.set('B', 1, '{}')
+        document_cache.get('A')
+        document_cache.set('C', 1, '{}')
+        self.assertIsNone(document_cache.get('B'))
+        self.assertEqual(document_cache.get('A'), (1, '{}'))
+        self.assertEqual(document_cache.stats(), {
+            'hits': 2,
+            'misses': 1,
+            'evictions': 1,
+            'hit_ratio': 2 / 3,
+            'size': 2,
+        })
+
+    def test_tina_cache_timeout(self):
+        document_cache = LocMemDocumentCache(timeout=10)
+        with patch('tina.cache.time.time', new=MagicMock(return_value=100)):
+            document_cache.set('A', 1, '{}')
+        with patch('tina.cache.time.time', new=MagicMock(return_value=111)):
+            self.assertIsNone(document_cache.get('A'))
+        self.assertEqual(document_cache.stats()['size'], 0)
+
+    def test_tina_cache_version(self):
+        document_cache = LocMemDocumentCache()
+        self.assertTrue(document_cache.set('A', 2, None))
+        self.assertFalse(document_cache.set('A', 1, '{"name": "old"}'))
+        self.assertEqual(document_cache.get('A'), (2, None))
+        self.assertTrue(document_cache.set('A', 2, '{"name": "new"}'))
+        self.assertEqual(document_cache.get('A'), (2, '{"name": "new"}'))
+
+    def test_tina_cache_invalidate_class(self):
+        document_cache = cache.get_document_cache()
+        cache.put_hit(FakeCachedDocument, {'_id': 'id-A', '_version': 1, '_source': {'name': 'kelp'}})
+        document_cache.set('other/FakeOtherDocument/id-A', 1, '{}')
+        document_cache.get('other/FakeOtherDocument/id-A')
+        document_cache.get('other/FakeOtherDocument/id-B')
+        cache.invalidate_class(FakeCachedDocument)
+        self.assertIsNone(cache.get_hit(FakeCachedDocument, 'id-A'))
+        self.assertEqual(document_cache.get('other/FakeOtherDocument/id-A'), (1, '{}'))
+        self.assertEqual(document_cache.stats(), {
+            'hits': 2,
+            'misses': 2,
+            'evictions': 0,
+            'hit_ratio': 0.5,
+            'size': 1,
+        })
+
+    def test_tina_cache_get(self):
+        fake_es = MagicMock()
+        fake_es.mget.return_value = {'docs': [
+            {'_id': 'id-A', '_version': 1, 'found': True, '_source': {'name': 'kelp'}},
+        ]}
+        with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            document_a = FakeCachedDocument.get(['id-A'])[0]
+            document_b = FakeCachedDocument.get('id-A')
+        self.assertEqual(fake_es.mget.call_count, 1)
+        fake_es.get.assert_not_called()
+        self.assertIsNot(document_a, document_b)
+        self.assertEqual(document_b.name, 'kelp')
+        self.assertEqual(document_b._version, 1)
+        self.assertEqual(cache.get_document_cache().stats()['hits'], 1)
+
+    def test_tina_cache_save(self):
+        fake_es = MagicMock()
+        fake_es.mget.return_value = {'docs': [
+            {'_id': 'id-A', '_version': 1, 'found': True, '_source': {'name': 'kelp'}},
+        ]}
+        fake_es.index.return_value = {'_id': 'id-A', '_version': 2}
+        with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            with patch('tina.document.Document._es', new=fake_es):
+                document = FakeCachedDocument.get(['id-A'])[0]
+                document.name = 'rinse'
+                document.save()
+                # the stale response of version 1 isn't cached again
+                FakeCachedDocument.get(['id-A'])
+                FakeCachedDocument.get(['id-A'])
+        self.assertEqual(fake_es.mget.call_count, 3)
+
+    def test_tina_cache_aggregation(self):
+        aggregation_cache = AggregationCache(max_size=1, timeout=10, stale_timeout=10)
+        key = aggregation_cache.make_key('count', {'index': 'index', 'body': {'query': {'match_all': {}}}})
+        with patch('tina.cache.time.time', new=MagicMock(return_value=100)):
+            aggregation_cache.set(key, 'index', 0, [{'key': 'A', 'doc_count': 1}])
+            value, is_stale = aggregation_cache.get(key)
+        self.assertEqual(value, [{'key': 'A', 'doc_count': 1}])
+        self.assertFalse(is_stale)
+        value[0]['key'] = 'B'
+        with patch('tina.cache.time.time', new=MagicMock(return_value=115)):
+            self.assertEqual(aggregation_cache.get(key), ([{'key': 'A', 'doc_count': 1}], True))
+        with patch('tina.cache.time.time', new=MagicMock(return_value=121)):
+            self.assertIsNone(aggregation_cache.get(key))
+
+    def test_tina_cache_aggregation_invalidate(self):
+        aggregation_cache = AggregationCache()
+        aggregation_cache.set('A', 'index', 0, 1)
+        aggregation_cache.invalidate('index')
+        self.assertIsNone(aggregation_cache.get('A'))
+        # the result of the request which was sent before writing
+        aggregation_cache.set('A', 'index', 0, 1)
+        self.assertIsNone(aggregation_cache.get('A'))
+        aggregation_cache.set('A', 'index', aggregation_cache.get_generation('index'), 2)
+        self.assertEqual(aggregation_cache.get('A'), (2, False))
+
+    def test_tina_cache_query_count(self):
+        fake_es = MagicMock()
+        fake_es.count.return_value = {'count': 3}
+        fake_es.index.return_value = {'_id': 'id-A', '_version': 1}
+        with patch('tina.document.Document._es', new=fake_es):
+            self.assertEqual(FakeAggregationDocument.where('name', equal='kelp').count(), 3)
+            self.assertEqual(FakeAggregationDocument.where('name', equal='kelp').count(), 3)
+            self.assertEqual(fake_es.count.call_count, 1)
+            FakeAggregationDocument.where('name', equal='rinse').count()
+            self.assertEqual(fake_es.count.call_count, 2)
+            FakeAggregationDocument(name='kelp').save()
+            FakeAggregationDocument.where('name', equal='kelp').count()
+            self.assertEqual(fake_es.count.call_count, 3)
+            FakeAggregationDocument.where('name', equal='kelp').cache_aggregations(False).count()
+            self.assertEqual(fake_es.count.call_count, 4)
+
+    def test_tina_cache_query_stale_while_revalidate(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {'aggregations': {'group': {'buckets': [{'key': 'kelp', 'doc_count': 1}]}}}
+        cache.get_aggregation_cache().stale_timeout = 10
+        with patch('tina.document.Document._es', new=fake_es):
+            with patch('tina.cache.time.time', new=MagicMock(return_value=100)):
+                FakeAggregationDocument.all().group_by('name')
+            fake_es.search.return_value = {'aggregations': {'group': {'buckets': []}}}
+            with patch('tina.cache.time.time', new=MagicMock(return_value=165)):
+                with patch('tina.cache.threading.Thread') as mock_thread:
+                    buckets = FakeAggregationDocument.all().group_by('name')
+                    FakeAggregationDocument.all().group_by('name')
+        self.assertEqual(buckets, [{'key': 'kelp', 'doc_count': 1}])
+        self.assertEqual(fake_es.search.call_count, 1)
+        self.assertEqual(mock_thread.call_count, 1)
+        mock_thread.call_args[1]['target'](*mock_thread.call_args[1]['args'])
+        self.assertEqual(fake_es.search.call_count, 2)
+        self.assertEqual(FakeAggregationDocument.all().group_by('name'), [])
@@ -1,5 +1,6 @@
+import asyncio
 import unittest
-from mock import MagicMock, patch
+from mock import MagicMock, patch, call
 
 
 class TestTinaDocument(unittest.TestCase):
@@ -27,6 +28,76 @@ class TestTinaDocument(unittest.TestCase):
             },
         )
 
+    def test_tina_document_aget_by_ids(self):
+        async def mget(**kwargs):
+            return {'docs': [{'_id': 'id-A', '_version': 1, 'found': True, '_source': {}}]}
+        fake_es = MagicMock()
+        fake_es.mget = MagicMock(side_effect=mget)
+        with patch('tina.document.utils.get_async_elasticsearch', new=MagicMock(return_value=fake_es)):
+            from tina.document import Document
+            Document.get_index_name = MagicMock(return_value='index_name')
+            loop = asyncio.new_event_loop()
+            documents = loop.run_until_complete(Document.aget(['id-A']))
+            loop.close()
+        fake_es.mget.assert_called_once_with(
+            index='index_name',
+            doc_type='Document',
+            body={
+                'ids': ['id-A']
+            },
+        )
+        self.assertEqual(documents[0]._id, 'id-A')
+
+    def test_tina_document_aget_prefetch(self):
+        from tina.document import Document
+        from tina.properties import StringProperty, ReferenceProperty
+        class FakeCompany(Document):
+            name = StringProperty()
+        class FakeAccount(Document):
+            company = ReferenceProperty(FakeCompany)
+        class FakeOrder(Document):
+            account = ReferenceProperty(FakeAccount)
+        sources = {
+            'FakeOrder': {'id-1': {'account': 'id-A'}},
+            'FakeAccount': {'id-A': {'company': 'id-C'}},
+            'FakeCompany': {'id-C': {'name': 'rinse'}},
+        }
+        async def mget(doc_type, body, **kwargs):
+            return {'docs': [
+                {'_id': x, '_version': 1, 'found': True, '_source': dict(sources[doc_type][x])} for x in body['ids']
+            ]}
+        fake_es = MagicMock()
+        fake_es.mget = MagicMock(side_effect=mget)
+        with patch('tina.document.utils.get_async_elasticsearch', new=MagicMock(return_value=fake_es)):
+            loop = asyncio.new_event_loop()
+            documents = loop.run_until_complete(FakeOrder.aget(['id-1'], prefetch=['account.company']))
+            loop.close()
+        self.assertEqual(documents[0].account.company.name, 'rinse')
+        self.assertEqual(fake_es.mget.call_count, 3)
+
+    def test_tina_document_get_only(self):
+        from tina.document import Document
+        from tina.properties import StringProperty, DictProperty
+        from tina.identity_map import IdentityMap
+        from tina.exceptions import PartialDocumentError
+        class FakeDocument(Document):
+            name = StringProperty()
+            payload = DictProperty()
+        fake_es = MagicMock()
+        fake_es.mget.return_value = {'docs': [
+            {'_id': 'id-A', '_version': 1, 'found': True, '_source': {'name': 'kelp'}},
+        ]}
+        with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            with IdentityMap() as identity_map:
+                documents = FakeDocument.get(['id-A'], only=['name'])
+                self.assertEqual(identity_map.documents, {})
+        self.assertEqual(fake_es.mget.call_args[1]['_source_include'], ['name'])
+        self.assertTrue(documents[0]._partial)
+        self.assertEqual(documents[0].name, 'kelp')
+        self.assertIsNone(documents[0].payload)
+        self.assertRaises(PartialDocumentError, documents[0].save)
+        self.assertRaises(PartialDocumentError, FakeDocument.save_many, documents)
+
     def test_tina_document_exists(self):
         with patch('tina.document.utils.get_elasticsearch', new=MagicMock()) as mock_es:
             from tina.document import Document
@@ -38,6 +109,82 @@ class TestTinaDocument(unittest.TestCase):
             id='id',
         )
 
+    def test_tina_document_properties(self):
+        from tina.document import Document
+        from tina.properties import StringProperty, IntegerProperty
+        class FakeDocument(Document):
+            name = StringProperty(default='tina')
+        class FakeSubDocument(FakeDocument):
+            age = IntegerProperty()
+        self.assertListEqual(sorted(FakeDocument.get_properties().keys()), ['_id', '_version', 'name'])
+        self.assertListEqual(sorted(FakeSubDocument.get_properties().keys()), ['_id', '_version', 'age', 'name'])
+        self.assertEqual(FakeDocument._property_defaults['name'], 'tina')
+        self.assertEqual(FakeSubDocument(age=10).name, 'tina')
+
+    def test_tina_document_get_index_name_of_subclass(self):
+        from tina.document import Document
+        class FakeDocument(Document):
+            pass
+        class FakeSubDocument(FakeDocument):
+            pass
+        FakeDocument._index_name = 'fakedocument'
+        self.assertIsNone(FakeSubDocument._index_name)
+
+    def test_tina_document_from_storage(self):
+        from tina.document import Document
+        from tina.properties import StringProperty, IntegerProperty
+        class FakeDocument(Document):
+            name = StringProperty()
+            age = IntegerProperty(default=18)
+        source = {'name': 'kelp', 'removed': True}
+        document = FakeDocument._from_storage({'_id': 'id-A', '_version': 2, '_source': source})
+        self.assertIs(document._document, source)
+        self.assertDictEqual(document._document, {
+            '_id': 'id-A',
+            '_version': 2,
+            'name': 'kelp',
+            'age': 18,
+        })
+        self.assertEqual(document.name, 'kelp')
+        self.assertEqual(document._version, 2)
+
+    def test_tina_document_update_mapping_substring_search(self):
+        from tina.document import Document
+        from tina.properties import StringProperty
+        class FakeDocument(Document):
+            _settings = {'number_of_replicas': 1}
+            email = StringProperty(substring_search=True)
+        FakeDocument._index_name = 'index_name'
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es:
+            with patch('tina.document.time.sleep'):
+                FakeDocument.update_mapping()
+        mock_es.indices.put_settings.assert_called_once_with({
+            'settings': {
+                'index': {
+                    'number_of_replicas': 1,
+                    'analysis': {
+                        'tokenizer': {
+                            'tina_substring': {'type': 'nGram', 'min_gram': 3, 'max_gram': 3},
+                        },
+                        'analyzer': {
+                            'tina_substring': {'type': 'custom', 'tokenizer': 'tina_substring', 'filter': ['lowercase']},
+                        },
+                    },
+                },
+            },
+        }, index='index_name')
+        mock_es.indices.put_mapping.assert_called_once_with('FakeDocument', {
+            'properties': {
+                'email': {
+                    'type': 'string',
+                    'fields': {
+                        'substring': {'type': 'string', 'analyzer': 'tina_substring'},
+                    },
+                },
+            },
+        }, index='index_name')
+        self.assertDictEqual(FakeDocument._settings, {'number_of_replicas': 1})
+
     def test_tina_document_where(self):
         from tina.document import Document
         with patch('tina.document.Query', new=MagicMock()) as mock_query:
@@ -68,6 +215,107 @@ class TestTinaDocument(unittest.TestCase):
             body={}
         )
 
+    def test_tina_document_save_unchanged(self):
+        from tina.document import Document
+        from tina.properties import StringProperty
+        class FakeDocument(Document):
+            name = StringProperty()
+        document = FakeDocument._from_storage({'_id': 'id-A', '_version': 2, '_source': {}})
+        self.assertFalse(document.is_changed())
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es:
+            document.save()
+            FakeDocument.save_many([document])
+            document.name = None
+            document.save()
+        mock_es.index.assert_not_called()
+        mock_es.bulk.assert_not_called()
+
+    def test_tina_document_save_unchanged_synchronized(self):
+        from tina.document import Document
+        from tina.properties import StringProperty
+        class FakeDocument(Document):
+            name = StringProperty()
+        document = FakeDocument._from_storage({'_id': 'id-A', '_version': 2, '_source': {'name': 'kelp'}})
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es, \
+                patch.object(FakeDocument, 'get_index_name', new=MagicMock(return_value='index_name')):
+            document.save(synchronized=True)
+            document.update(synchronized=True)
+            FakeDocument.save_many([document], synchronized=True)
+        mock_es.index.assert_not_called()
+        mock_es.update.assert_not_called()
+        mock_es.bulk.assert_not_called()
+        self.assertEqual(mock_es.indices.refresh.call_args_list, [call(index='index_name')] * 3)
+
+        async def refresh(**kwargs):
+            return {}
+        fake_es = MagicMock()
+        fake_es.indices.refresh = MagicMock(side_effect=refresh)
+        with patch('tina.document.utils.get_async_elasticsearch', new=MagicMock(return_value=fake_es)), \
+                patch.object(FakeDocument, 'get_index_name', new=MagicMock(return_value='index_name')):
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(document.asave(synchronized=True))
+            loop.run_until_complete(document.aupdate(synchronized=True))
+            loop.close()
+        fake_es.index.assert_not_called()
+        fake_es.update.assert_not_called()
+        self.assertEqual(fake_es.indices.refresh.call_args_list, [call(index='index_name')] * 2)
+
+    def test_tina_document_read_list(self):
+        from tina.document import Document
+        from tina.properties import StringProperty, ListProperty, DictProperty
+        class FakeDocument(Document):
+            name = StringProperty()
+            tags = ListProperty(str)
+            extra = DictProperty()
+        source = {'name': 'kelp', 'tags': ['a'], 'extra': {'key': 'value'}}
+        tags = source['tags']
+        document = FakeDocument._from_storage({'_id': 'id-A', '_version': 2, '_source': source})
+        self.assertIs(document.tags, tags)
+        self.assertIsNone(document.extra.get('other'))
+        # lists and dicts can be changed in place after reading
+        self.assertListEqual(document.get_dirty_fields(), ['extra', 'tags'])
+
+    def test_tina_document_update(self):
+        from tina.document import Document
+        from tina.properties import StringProperty, IntegerProperty, ListProperty
+        class FakeDocument(Document):
+            name = StringProperty()
+            views = IntegerProperty()
+            tags = ListProperty(str)
+        document = FakeDocument._from_storage({'_id': 'id-A', '_version': 2, '_source': {
+            'name': 'kelp', 'views': 1, 'tags': ['a'],
+        }})
+        document.views += 1
+        document.tags.append('b')
+        document.name = 'kelp'
+        self.assertListEqual(document.get_dirty_fields(), ['tags', 'views'])
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es, \
+                patch.object(FakeDocument, 'get_index_name', new=MagicMock(return_value='index_name')):
+            mock_es.update.return_value = {'_id': 'id-A', '_version': 3}
+            document.update()
+            document.update()
+            document.save()
+            document.name = 'rinse'
+            document.update(retry_on_conflict=3)
+        self.assertEqual(mock_es.update.call_count, 2)
+        self.assertEqual(mock_es.update.call_args_list[0], call(
+            index='index_name',
+            doc_type='FakeDocument',
+            id='id-A',
+            version=2,
+            body={'doc': {'tags': ['a', 'b'], 'views': 2}},
+        ))
+        self.assertEqual(mock_es.update.call_args_list[1], call(
+            index='index_name',
+            doc_type='FakeDocument',
+            id='id-A',
+            retry_on_conflict=3,
+            body={'doc': {'name': 'rinse'}},
+        ))
+        mock_es.index.assert_not_called()
+        self.assertEqual(document._version, 3)
+        self.assertFalse(document.is_changed())
+
     def test_tina_document_delete(self):
         from tina.document import Document
         document = Document(_id='byMQ-ULRSJ291RG_eEwSfQ', _version=1)
@@ -79,3 +327,52 @@ class TestTinaDocument(unittest.TestCase):
             id='byMQ-ULRSJ291RG_eEwSfQ',
             doc_type='Document'
         )
+
+    def test_tina_document_save_many(self):
+        from tina.document import Document
+        documents = [Document(), Document(_id='id-B', _version=2)]
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es:
+            mock_es.bulk.return_value = {
+                'items': [
+                    {'index': {'_index': 'document', '_id': 'id-A', '_version': 1, 'status': 201}},
+                    {'index': {'_index': 'document', '_id': 'id-B', 'status': 409, 'error': 'VersionConflictEngineException'}},
+                ]
+            }
+            with patch('tina.document.Document.get_index_name', new=MagicMock(return_value='index_name')):
+                failures = Document.save_many(documents)
+        mock_es.bulk.assert_called_once_with(body=(
+            '{"index":{"_index":"index_name","_type":"Document","_version":0}}\n{}\n'
+            '{"index":{"_index":"index_name","_type":"Document","_version":2,"_id":"id-B"}}\n{}\n'
+        ))
+        self.assertEqual(documents[0]._id, 'id-A')
+        self.assertEqual(documents[0]._version, 1)
+        self.assertListEqual(failures, [{
+            'document': documents[1],
+            'status': 409,
+            'error': 'VersionConflictEngineException',
+        }])
+
+    def test_tina_document_save_many_chunks(self):
+        from tina.document import Document
+        documents = [Document(), Document(), Document()]
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es:
+            mock_es.bulk.side_effect = lambda body: {
+                'items': [{'index': {'_id': 'id', '_version': 1, 'status': 201}}] * body.count('"index"')
+            }
+            Document.save_many(documents, chunk_size=2)
+        self.assertEqual(mock_es.bulk.call_count, 2)
+
+    def test_tina_document_delete_many(self):
+        from tina.document import Document
+        with patch('tina.document.Document._es', new=MagicMock()) as mock_es:
+            mock_es.bulk.return_value = {
+                'items': [
+                    {'delete': {'_index': 'index_name', '_id': 'id-A', 'status': 200, 'found': True}},
+                ]
+            }
+            with patch('tina.document.Document.get_index_name', new=MagicMock(return_value='index_name')):
+                failures = Document.delete_many(['id-A'])
+        mock_es.bulk.assert_called_once_with(
+            body='{"delete":{"_index":"index_name","_type":"Document","_id":"id-A"}}\n'
+        )
+        self.assertListEqual(failures, [])
@@ -0,0 +1,124 @@
+import json
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from mock import MagicMock, patch
+from tina import deep_query
+from tina.document import Document
+from tina.properties import StringProperty, ReferenceProperty
+
+
+class FakeAccount(Document):
+    _index_name = 'account'
+    name = StringProperty()
+class FakeProduct(Document):
+    _index_name = 'product'
+    name = StringProperty()
+class FakeOrder(Document):
+    _index_name = 'order'
+    state = StringProperty()
+class FakeOrderItem(Document):
+    _index_name = 'order_item'
+    account = ReferenceProperty(FakeAccount)
+    product = ReferenceProperty(FakeProduct)
+
+
+def fake_elasticsearch():
+    """
+    Each slice has two pages, each page has one hit.
+    """
+    es = MagicMock()
+    def search(index, body, scroll, version):
+        slice_id = body.get('slice', {}).get('id', 0)
+        return {'_scroll_id': 'scroll-%s-0' % slice_id, 'hits': {'hits': [
+            {'_id': 'id-%s-0' % slice_id, '_version': 1, '_source': {'state': 'paid'}},
+        ]}}
+    def scroll(scroll_id, scroll):
+        _, slice_id, page = scroll_id.split('-')
+        if page == '1':
+            return {'_scroll_id': scroll_id, 'hits': {'hits': []}}
+        return {'_scroll_id': 'scroll-%s-1' % slice_id, 'hits': {'hits': [
+            {'_id': 'id-%s-1' % slice_id, '_version': 2, '_source': {'state': 'paid'}},
+        ]}}
+    es.search.side_effect = search
+    es.scroll.side_effect = scroll
+    return es
+
+
+class TestTinaExport(unittest.TestCase):
+    def test_tina_export_in_process(self):
+        es = fake_elasticsearch()
+        with patch.object(FakeOrder, '_es', new=es), \
+                patch.object(FakeOrder, 'get_index_name', new=MagicMock(return_value='order')):
+            documents = list(FakeOrder.where('state', equal='paid').export(slices=2, workers=0, batch_size=1))
+        self.assertEqual(sorted(x._id for x in documents), ['id-0-0', 'id-0-1', 'id-1-0', 'id-1-1'])
+        self.assertEqual(documents[1]._version, 2)
+        self.assertEqual(es.search.call_count, 2)
+        body = es.search.call_args_list[1][1]['body']
+        self.assertEqual(body['slice'], {'id': 1, 'max': 2})
+        self.assertEqual(body['size'], 1)
+        self.assertNotIn('from', body)
+        self.assertIn('query', body)
+        self.assertEqual(es.clear_scroll.call_count, 2)
+        self.assertEqual(es.search.call_args[1]['index'], 'order')
+
+    def test_tina_export_processes(self):
+        es = fake_elasticsearch()
+        with patch.object(FakeOrder, '_es', new=MagicMock()), \
+                patch('tina.export.utils.copy_elasticsearch', new=MagicMock(return_value=es)):
+            documents = list(FakeOrder.all().export(slices=3, workers=2))
+        self.assertEqual(len(documents), 6)
+        self.assertEqual(len({x._id for x in documents}), 6)
+        self.assertIsInstance(documents[0], FakeOrder)
+        self.assertEqual(documents[0].state, 'paid')
+        self.assertFalse(documents[0].is_changed())
+
+    def test_tina_export_processes_references(self):
+        es = MagicMock()
+        es.search.return_value = {'_scroll_id': 'scroll', 'hits': {'hits': [
+            {'_id': 'id-A', '_version': 1, '_source': {'account': 'account-A', 'product': 'product-A'}},
+        ]}}
+        es.scroll.return_value = {'_scroll_id': 'scroll', 'hits': {'hits': []}}
+        es.mget.side_effect = lambda index, body, **kwargs: {'docs': [
+            {'_id': x, '_version': 1, 'found': True, '_source': {'name': index}} for x in body['ids']
+        ]}
+        # idle threads of the executor in this process don't exist in the forked workers
+        list(deep_query._get_executor().map(time.sleep, [0.05] * 4))
+        with patch.object(FakeOrderItem, '_es', new=MagicMock()), \
+                patch('tina.export.utils.copy_elasticsearch', new=MagicMock(return_value=es)), \
+                patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=es)):
+            documents = list(FakeOrderItem.all().export(slices=2, workers=2, fetch_reference=True))
+        self.assertEqual(len(documents), 2)
+        self.assertIsInstance(documents[0].account, FakeAccount)
+        self.assertIsInstance(documents[0].product, FakeProduct)
+        self.assertEqual(documents[0].product._id, 'product-A')
+
+    def test_tina_export_pickle(self):
+        document = FakeOrder._from_storage({'_id': 'id-A', '_version': 2, '_source': {'state': 'paid'}})
+        document = pickle.loads(pickle.dumps(document))
+        self.assertEqual((document._id, document._version, document.state), ('id-A', 2, 'paid'))
+        self.assertFalse(document.is_changed())
+        document.state = 'expired'
+        document = pickle.loads(pickle.dumps(document))
+        self.assertEqual(document.get_dirty_fields(), ['state'])
+
+    def test_tina_export_jsonl(self):
+        es = fake_elasticsearch()
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'orders-{slice}.jsonl')
+        with patch.object(FakeOrder, '_es', new=MagicMock()), \
+                patch('tina.export.utils.copy_elasticsearch', new=MagicMock(return_value=es)):
+            result = FakeOrder.all().export_jsonl(path, slices=2, workers=2)
+            self.assertRaises(ValueError, FakeOrder.all().export_jsonl, os.path.join(directory, 'orders.jsonl'), 2)
+        self.assertEqual(result, [
+            {'slice': 0, 'path': path.format(slice=0), 'documents': 2},
+            {'slice': 1, 'path': path.format(slice=1), 'documents': 2},
+        ])
+        with open(path.format(slice=1)) as f:
+            lines = [json.loads(x) for x in f]
+        self.assertEqual(lines, [
+            {'_id': 'id-1-0', 'state': 'paid'},
+            {'_id': 'id-1-1', 'state': 'paid'},
+        ])
@@ -0,0 +1,114 @@
+import asyncio
+import unittest
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty, ReferenceProperty
+from tina.identity_map import IdentityMap, get_identity_map
+from tina.middleware import IdentityMapMiddleware
+from tina import utils
+
+
+class FakeAccount(Document):
+    _index_name = 'account'
+    name = StringProperty()
+class FakeOrder(Document):
+    _index_name = 'order'
+    account = ReferenceProperty(FakeAccount)
+
+
+class TestTinaIdentityMap(unittest.TestCase):
+    def test_tina_identity_map_scope(self):
+        self.assertIsNone(get_identity_map())
+        with IdentityMap() as identity_map:
+            self.assertIs(get_identity_map(), identity_map)
+            with IdentityMap() as inner_identity_map:
+                self.assertIs(inner_identity_map, identity_map)
+            self.assertIs(get_identity_map(), identity_map)
+        self.assertIsNone(get_identity_map())
+
+    @unittest.skipIf(utils.contextvars is None, 'requires contextvars')
+    def test_tina_identity_map_asyncio_tasks(self):
+        async def scope(started, other_started):
+            with IdentityMap() as identity_map:
+                started.set()
+                await other_started.wait()
+                self.assertIs(get_identity_map(), identity_map)
+            self.assertIsNone(get_identity_map())
+            return identity_map
+        async def main():
+            started_a, started_b = asyncio.Event(), asyncio.Event()
+            return await asyncio.gather(scope(started_a, started_b), scope(started_b, started_a))
+        loop = asyncio.new_event_loop()
+        try:
+            identity_map_a, identity_map_b = loop.run_until_complete(main())
+        finally:
+            loop.close()
+        self.assertIsNot(identity_map_a, identity_map_b)
+
+    def test_tina_identity_map_get(self):
+        fake_es = MagicMock()
+        fake_es.mget.return_value = {'docs': [
+            {'_id': 'id-A', '_version': 1, 'found': True, '_source': {'name': 'A'}},
+            {'_id': 'id-B', 'found': False},
+        ]}
+        fake_es.get.return_value = {'_id': 'id-C', '_version': 1, 'found': True, '_source': {'name': 'C'}}
+        with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            with IdentityMap():
+                accounts = FakeAccount.get(['id-A', 'id-B'])
+                self.assertEqual([x._id for x in accounts], ['id-A'])
+                self.assertIs(FakeAccount.get('id-A'), accounts[0])
+                self.assertIsNone(FakeAccount.get('id-B'))
+                self.assertIs(FakeAccount.get(['id-B', 'id-A'])[0], accounts[0])
+                account = FakeAccount.get('id-C')
+                self.assertIs(FakeAccount.get(['id-C'])[0], account)
+            FakeAccount.get('id-A')
+        self.assertEqual(fake_es.mget.call_count, 1)
+        self.assertEqual(sorted(fake_es.mget.call_args[1]['body']['ids']), ['id-A', 'id-B'])
+        self.assertEqual(fake_es.get.call_count, 2)
+
+    def test_tina_identity_map_fetch_reference(self):
+        fake_es = MagicMock()
+        fake_es.mget.return_value = {'docs': [
+            {'_id': 'id-A', '_version': 1, 'found': True, '_source': {'name': 'A'}},
+        ]}
+        fake_es.search.side_effect = lambda **kwargs: {'hits': {'total': 1, 'hits': [
+            {'_id': 'id-1', '_version': 1, '_source': {'account': 'id-A'}},
+        ]}}
+        with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            with patch('tina.document.Document._es', new=fake_es):
+                with IdentityMap():
+                    orders_a, _ = FakeOrder.all().fetch()
+                    orders_b, _ = FakeOrder.where('account', equal='id-A').fetch()
+        self.assertIs(orders_a[0], orders_b[0])
+        self.assertEqual(orders_a[0].account.name, 'A')
+        self.assertEqual(fake_es.search.call_count, 2)
+        self.assertEqual(fake_es.mget.call_count, 1)
+        self.assertEqual(fake_es.mget.call_args[1]['body'], {'ids': ['id-A']})
+
+    def test_tina_identity_map_save_and_delete(self):
+        fake_es = MagicMock()
+        fake_es.index.return_value = {'_id': 'id-A', '_version': 1}
+        with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            with patch('tina.document.Document._es', new=fake_es):
+                with IdentityMap():
+                    account = FakeAccount(name='A').save()
+                    self.assertIs(FakeAccount.get('id-A'), account)
+                    account.delete()
+                    self.assertIsNone(FakeAccount.get('id-A'))
+        fake_es.get.assert_not_called()
+
+    def test_tina_identity_map_middleware(self):
+        def get_response(request):
+            self.assertIsNotNone(get_identity_map())
+            return 'response'
+        middleware = IdentityMapMiddleware(get_response)
+        self.assertEqual(middleware('request'), 'response')
+        self.assertIsNone(get_identity_map())
+
+    def test_tina_identity_map_middleware_classes(self):
+        middleware = IdentityMapMiddleware()
+        request = MagicMock()
+        middleware.process_request(request)
+        self.assertIsNotNone(get_identity_map())
+        self.assertEqual(middleware.process_response(request, 'response'), 'response')
+        self.assertIsNone(get_identity_map())
@@ -0,0 +1,115 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty, IntegerProperty, BooleanProperty, ListProperty
+from tina.exceptions import TransportError
+
+
+class FakeRecord(Document):
+    _index_name = 'record'
+    name = StringProperty(required=True)
+    count = IntegerProperty()
+    is_vip = BooleanProperty(default=False)
+    tags = ListProperty(item_type=str)
+
+
+def bulk_response(body, statuses=None):
+    """
+    Generate the bulk response of the body. Items succeed if there is no status.
+    """
+    lines = [json.loads(x) for x in body.splitlines() if x]
+    actions = lines[::2]
+    statuses = statuses or {}
+    items = []
+    for index, action in enumerate(actions):
+        status = statuses.get(index, 201)
+        items.append({'index': {
+            '_id': action['index'].get('_id', 'id-%s' % index),
+            '_version': 1,
+            'status': status,
+            'error': None if status < 300 else 'error %s' % status,
+        }})
+    return {'items': items}
+
+
+class TestTinaIngest(unittest.TestCase):
+    def test_tina_ingest_rows(self):
+        fake_es = MagicMock()
+        fake_es.bulk.side_effect = lambda body: bulk_response(body)
+        progress = MagicMock()
+        with patch('tina.document.Document._es', new=fake_es):
+            stats = FakeRecord.ingest([
+                {'_id': 'id-A', 'name': 'kelp', 'count': 1},
+                {'name': 'rinse', 'count': 'many'},
+                {'count': 3},
+                FakeRecord(name='tina', count=4),
+            ], chunk_size=2, workers=2, progress=progress)
+        self.assertEqual(stats.documents, 2)
+        self.assertEqual(stats.failed, 2)
+        self.assertEqual(stats.requests, 1)
+        self.assertGreater(stats.bytes, 0)
+        self.assertEqual([x['status'] for x in stats.failures], [None, None])
+        self.assertEqual(stats.failures[1]['row'], {'count': 3})
+        body = fake_es.bulk.call_args[1]['body'].splitlines()
+        self.assertEqual(json.loads(body[0])['index']['_id'], 'id-A')
+        self.assertEqual(json.loads(body[1]), {'name': 'kelp', 'count': 1, 'is_vip': False, 'tags': None})
+        self.assertNotIn('_id', json.loads(body[2])['index'])
+        progress.assert_called_with(stats)
+
+    def test_tina_ingest_retry_items(self):
+        fake_es = MagicMock()
+        responses = iter([{0: 201, 1: 429, 2: 400}, {}])
+        fake_es.bulk.side_effect = lambda body: bulk_response(body, next(responses))
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch('tina.ingest.time.sleep') as mock_sleep:
+            stats = FakeRecord.ingest([{'name': 'A'}, {'name': 'B'}, {'name': 'C'}], progress=MagicMock())
+        self.assertEqual(fake_es.bulk.call_count, 2)
+        # only the rejected item is sent again
+        self.assertEqual(json.loads(fake_es.bulk.call_args[1]['body'].splitlines()[1]), {
+            'name': 'B', 'count': None, 'is_vip': False, 'tags': None,
+        })
+        self.assertEqual(mock_sleep.call_count, 1)
+        self.assertEqual(stats.documents, 2)
+        self.assertEqual(stats.retries, 1)
+        self.assertEqual(stats.failures, [{'row': {'name': 'C'}, 'status': 400, 'error': 'error 400'}])
+
+    def test_tina_ingest_retry_request(self):
+        fake_es = MagicMock()
+        fake_es.bulk.side_effect = TransportError(503, 'unavailable')
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch('tina.ingest.time.sleep') as mock_sleep:
+            stats = FakeRecord.ingest([{'name': 'A'}], max_retries=2, progress=MagicMock())
+        self.assertEqual(fake_es.bulk.call_count, 3)
+        delays = [x[0][0] for x in mock_sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        self.assertTrue(0.25 <= delays[0] <= 0.5)
+        self.assertTrue(0.5 <= delays[1] <= 1.0)
+        self.assertEqual(stats.failures, [{'row': {'name': 'A'}, 'status': 503, 'error': str(TransportError(503, 'unavailable'))}])
+
+    def test_tina_ingest_files(self):
+        fake_es = MagicMock()
+        fake_es.bulk.side_effect = lambda body: bulk_response(body)
+        directory = tempfile.mkdtemp()
+        jsonl_path = os.path.join(directory, 'records.jsonl')
+        csv_path = os.path.join(directory, 'records.csv')
+        dead_letter_path = os.path.join(directory, 'rejected.jsonl')
+        with open(jsonl_path, 'w') as f:
+            f.write('{"name": "kelp", "count": 1}\n\n{"name": \n')
+        with open(csv_path, 'w') as f:
+            f.write('name,count,is_vip,tags\nrinse,2,false,"[""a""]"\ntina,,yes,\n')
+        with patch('tina.document.Document._es', new=fake_es):
+            jsonl_stats = FakeRecord.ingest(jsonl_path, dead_letter=dead_letter_path, progress=MagicMock())
+            dead_letter = io.StringIO()
+            csv_stats = FakeRecord.ingest(csv_path, dead_letter=dead_letter, progress=MagicMock())
+        self.assertEqual((jsonl_stats.documents, jsonl_stats.failed), (1, 1))
+        with open(dead_letter_path) as f:
+            rejected = [json.loads(x) for x in f]
+        self.assertEqual(rejected[0]['row'], '{"name": ')
+        self.assertEqual((csv_stats.documents, csv_stats.failed), (1, 1))
+        body = fake_es.bulk.call_args[1]['body'].splitlines()
+        self.assertEqual(json.loads(body[1]), {'name': 'rinse', 'count': 2, 'is_vip': False, 'tags': ['a']})
+        self.assertEqual(json.loads(dead_letter.getvalue())['row']['name'], 'tina')
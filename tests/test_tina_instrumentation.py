@@ -0,0 +1,136 @@
+import unittest
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty, ReferenceProperty
+from tina.instrumentation import query_finished, RequestSummary, get_request_summary
+from tina.middleware import RequestSummaryMiddleware
+
+
+class FakeAccount(Document):
+    _index_name = 'account'
+    name = StringProperty()
+class FakeOrder(Document):
+    _index_name = 'order'
+    state = StringProperty()
+    account = ReferenceProperty(FakeAccount)
+
+
+class TestTinaInstrumentation(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        def receiver(sender, **kwargs):
+            self.events.append(kwargs)
+        self.receiver = receiver
+        query_finished.connect(receiver)
+
+    def tearDown(self):
+        query_finished.disconnect(self.receiver)
+
+    def test_tina_instrumentation_fetch(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            'took': 3,
+            'hits': {'total': 1, 'hits': [
+                {'_id': 'id-A', '_version': 1, '_source': {'state': 'paid', 'account': 'id-B'}},
+            ]},
+        }
+        fake_es.mget.return_value = {'docs': [
+            {'_id': 'id-B', '_version': 1, 'found': True, '_source': {'name': 'kelp'}},
+        ]}
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)), \
+                patch.object(FakeOrder, 'get_index_name', new=MagicMock(return_value='order')):
+            FakeOrder.where('state', equal='paid').fetch()
+        self.assertEqual([x['operation'] for x in self.events], ['mget', 'update_reference_properties', 'fetch'])
+        event = self.events[2]
+        self.assertIs(event['document_class'], FakeOrder)
+        self.assertEqual(event['index'], 'order')
+        self.assertEqual(event['took'], 3)
+        self.assertEqual(event['hits'], 1)
+        self.assertGreater(event['body_size'], 0)
+        self.assertTrue(event['round_trip'])
+        self.assertIsNone(event['error'])
+        self.assertGreaterEqual(event['duration'], event['hydration_time'])
+        self.assertEqual(self.events[0]['hits'], 1)
+        self.assertFalse(self.events[1]['round_trip'])
+
+    def test_tina_instrumentation_error(self):
+        fake_es = MagicMock()
+        fake_es.count.side_effect = ValueError()
+        with patch('tina.document.Document._es', new=fake_es):
+            self.assertRaises(ValueError, FakeOrder.all().count)
+        self.assertEqual(self.events[0]['operation'], 'count')
+        self.assertIsInstance(self.events[0]['error'], ValueError)
+
+    def test_tina_instrumentation_slow_query(self):
+        fake_es = MagicMock()
+        fake_es.count.return_value = {'count': 1}
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch.object(FakeOrder, 'get_index_name', new=MagicMock(return_value='order')), \
+                patch('tina.instrumentation.slow_query_logger') as mock_logger:
+            with patch('django.conf.settings.TINA_SLOW_QUERY_THRESHOLD', new=60, create=True):
+                FakeOrder.all().count()
+            mock_logger.warning.assert_not_called()
+            with patch('django.conf.settings.TINA_SLOW_QUERY_THRESHOLD', new=0, create=True):
+                FakeOrder.all().count()
+            self.assertEqual(mock_logger.warning.call_count, 1)
+            self.assertEqual(mock_logger.warning.call_args[0][1:4], ('count', 'FakeOrder', 'order'))
+
+    def test_tina_instrumentation_request_summary(self):
+        fake_es = MagicMock()
+        fake_es.count.return_value = {'count': 1, 'took': 2}
+        fake_es.get.return_value = {'_id': 'id-A', '_version': 1, 'found': True, '_source': {'name': 'kelp'}}
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+            with RequestSummary() as summary:
+                with RequestSummary() as inner_summary:
+                    FakeOrder.all().count()
+                FakeAccount.get('id-A')
+                self.assertIs(inner_summary, summary)
+            FakeOrder.all().count()
+        self.assertIsNone(get_request_summary())
+        self.assertEqual(summary.round_trips, 2)
+        self.assertEqual(summary.took, 2)
+        self.assertEqual(summary.operations, {'count': 1, 'get': 1})
+
+    def test_tina_instrumentation_request_summary_nested(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {'took': 1, 'hits': {'total': 1, 'hits': [
+            {'_id': 'id-1', '_version': 1, '_source': {'state': 'paid', 'account': 'id-A'}},
+        ]}}
+        fake_es.mget.return_value = {'docs': [{'_id': 'id-A', '_version': 1, 'found': True, '_source': {}}]}
+        times = iter([0.0, 1.0, 10.0, 12.0, 13.0, 20.0, 21.0, 22.0, 23.0, 30.0])
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)), \
+                patch('tina.query.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)), \
+                patch('tina.instrumentation.time.perf_counter', new=lambda: next(times)):
+            with RequestSummary() as summary:
+                FakeOrder.all().fetch()
+        self.assertEqual(summary.operations, {'fetch': 1, 'mget': 1})
+        self.assertEqual(summary.round_trips, 2)
+        fetch = [x for x in self.events if x['operation'] == 'fetch'][0]
+        mget = [x for x in self.events if x['operation'] == 'mget'][0]
+        self.assertGreater(fetch['duration'], fetch['hydration_time'])
+        self.assertEqual((fetch['duration'], fetch['hydration_time']), (22.0, 21.0))
+        self.assertEqual((mget['duration'], mget['hydration_time']), (8.0, 7.0))
+        # the fetch request and the mget request, the mget is in the hydration of the fetch
+        self.assertEqual(summary.duration, 2.0)
+
+    def test_tina_instrumentation_middleware(self):
+        def get_response(request):
+            get_request_summary().round_trips += 2
+            return {}
+        request = MagicMock()
+        response = RequestSummaryMiddleware(get_response)(request)
+        self.assertEqual(response['X-Tina-Round-Trips'], '2')
+        self.assertIn('X-Tina-Time', response)
+        self.assertIsNone(get_request_summary())
+
+    def test_tina_instrumentation_middleware_classes(self):
+        middleware = RequestSummaryMiddleware()
+        request = MagicMock()
+        middleware.process_request(request)
+        self.assertIs(get_request_summary(), request.tina_summary)
+        response = middleware.process_response(request, {})
+        self.assertEqual(response['X-Tina-Round-Trips'], '0')
+        self.assertIsNone(get_request_summary())
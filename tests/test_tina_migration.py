@@ -0,0 +1,182 @@
+import json
+import unittest
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty
+from tina.exceptions import NotFoundError, TransportError
+
+
+class FakeProduct(Document):
+    _index_name = 'product'
+    name = StringProperty(analyzer='keyword')
+
+
+def fake_elasticsearch(hits):
+    """
+    The fake client which scrolls one page of hits.
+    """
+    es = MagicMock()
+    es.search.return_value = {'_scroll_id': 'scroll', 'hits': {'hits': hits}}
+    es.scroll.return_value = {'_scroll_id': 'scroll', 'hits': {'hits': []}}
+    def bulk(body):
+        actions = [json.loads(x) for x in body.splitlines()[::2]]
+        return {'items': [{'index': {'_id': x['index']['_id'], 'status': 201}} for x in actions]}
+    es.bulk.side_effect = bulk
+    return es
+
+
+class TestTinaMigration(unittest.TestCase):
+    def setUp(self):
+        index_name_patcher = patch.object(FakeProduct, 'get_index_name', new=MagicMock(return_value='product'))
+        index_name_patcher.start()
+        self.addCleanup(index_name_patcher.stop)
+
+    def test_tina_migration_alias(self):
+        es = fake_elasticsearch([
+            {'_type': 'FakeProduct', '_id': 'id-A', '_version': 3, '_source': {'name': 'kelp'}},
+        ])
+        es.indices.get_alias.return_value = {'product_v1': {'aliases': {'product': {}}}}
+        with patch.object(FakeProduct, '_es', new=es):
+            result = FakeProduct.migrate(delete_old=True)
+        self.assertEqual(result['index'], 'product_v2')
+        self.assertEqual(result['previous'], ['product_v1'])
+        self.assertEqual(result['documents'], 2)
+        es.indices.create.assert_called_once_with(index='product_v2', body={
+            'mappings': {'FakeProduct': {'properties': {'name': {'type': 'string', 'analyzer': 'keyword'}}}},
+        })
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove': {'index': 'product_v1', 'alias': 'product'}},
+            {'add': {'index': 'product_v2', 'alias': 'product'}},
+        ]})
+        # copy and catch up
+        self.assertEqual(es.search.call_count, 2)
+        self.assertEqual(es.search.call_args[1]['index'], 'product_v1')
+        lines = es.bulk.call_args[1]['body'].splitlines()
+        self.assertEqual(json.loads(lines[0]), {'index': {
+            '_index': 'product_v2',
+            '_type': 'FakeProduct',
+            '_id': 'id-A',
+            '_version': 3,
+            '_version_type': 'external',
+        }})
+        self.assertEqual(json.loads(lines[1]), {'name': 'kelp'})
+        es.clear_scroll.assert_called_with(scroll_id='scroll')
+        es.indices.delete.assert_called_once_with(index='product_v1')
+
+    def test_tina_migration_concrete_index(self):
+        es = fake_elasticsearch([])
+        es.indices.get_alias.side_effect = NotFoundError(404, 'missing')
+        es.indices.exists.return_value = True
+        with patch.object(FakeProduct, '_es', new=es):
+            result = FakeProduct.migrate()
+        self.assertEqual(result['index'], 'product_v1')
+        self.assertEqual(result['previous'], ['product'])
+        self.assertEqual(es.search.call_count, 4)
+        es.indices.delete.assert_not_called()
+        es.indices.put_settings.assert_called_once_with(index='product', body={'index.blocks.write': True})
+        es.indices.update_aliases.assert_called_once_with(body={'actions': [
+            {'remove_index': {'index': 'product'}},
+            {'add': {'index': 'product_v1', 'alias': 'product'}},
+        ]})
+
+    def test_tina_migration_concrete_index_writes_during_copying(self):
+        """
+        id-A is updated and id-B is deleted after the first copy. id-C is saved after the first copy.
+        id-D is saved in the gap between blocking writes and swapping the alias, the write fails.
+        """
+        indices = {
+            'product': {'id-A': 1, 'id-B': 1},
+            'product_v1': {},
+        }
+        blocked = set()
+        gap_writes = []
+        es = MagicMock()
+        def write(index, document_id):
+            if index in blocked:
+                return 403
+            indices.setdefault(index, {})[document_id] = 1
+            return 201
+        def search(index, body, scroll, version=False):
+            if blocked and index == 'product_v1':
+                gap_writes.append(write('product', 'id-D'))
+            hits = [{'_type': 'FakeProduct', '_id': x, '_version': v, '_source': {}}
+                    for x, v in sorted(indices[index].items())]
+            return {'_scroll_id': 'scroll', 'hits': {'hits': hits}}
+        def bulk(body):
+            items = []
+            for line in body.splitlines():
+                action = json.loads(line)
+                if 'index' in action:
+                    meta = action['index']
+                    dest = indices[meta['_index']]
+                    if dest.get(meta['_id'], 0) >= meta['_version']:
+                        items.append({'index': {'_id': meta['_id'], 'status': 409, 'error': 'conflict'}})
+                        continue
+                    dest[meta['_id']] = meta['_version']
+                    items.append({'index': {'_id': meta['_id'], 'status': 201}})
+                elif 'delete' in action:
+                    meta = action['delete']
+                    del indices[meta['_index']][meta['_id']]
+                    items.append({'delete': {'_id': meta['_id'], 'status': 200}})
+            if es.bulk.call_count == 1:
+                # writes during the first copy
+                indices['product'] = {'id-A': 2, 'id-C': 1}
+            return {'items': items}
+        def put_settings(index, body):
+            self.assertEqual(body, {'index.blocks.write': True})
+            blocked.add(index)
+        es.search.side_effect = search
+        es.scroll.return_value = {'_scroll_id': 'scroll', 'hits': {'hits': []}}
+        es.bulk.side_effect = bulk
+        es.indices.get_alias.side_effect = NotFoundError(404, 'missing')
+        es.indices.exists.return_value = True
+        es.indices.put_settings.side_effect = put_settings
+        with patch.object(FakeProduct, '_es', new=es):
+            result = FakeProduct.migrate()
+        self.assertEqual(indices['product_v1'], {'id-A': 2, 'id-C': 1})
+        self.assertEqual(gap_writes, [403])
+        self.assertNotIn('id-D', indices['product'])
+        self.assertEqual(result['deleted'], 1)
+        self.assertEqual(result['failures'], [])
+        names = [x[0] for x in es.mock_calls if x[0] in ('indices.put_settings', 'bulk', 'indices.update_aliases')]
+        self.assertEqual(names, ['bulk', 'indices.put_settings', 'bulk', 'bulk', 'indices.update_aliases'])
+        es.indices.delete.assert_not_called()
+
+    def test_tina_migration_concrete_index_failed(self):
+        es = fake_elasticsearch([])
+        es.indices.get_alias.side_effect = NotFoundError(404, 'missing')
+        es.indices.exists.return_value = True
+        es.indices.refresh.side_effect = [None, TransportError(500, 'failed')]
+        with patch.object(FakeProduct, '_es', new=es):
+            self.assertRaises(TransportError, FakeProduct.migrate)
+        self.assertEqual(es.indices.put_settings.call_args_list[-1][1], {
+            'index': 'product', 'body': {'index.blocks.write': False},
+        })
+        es.indices.update_aliases.assert_not_called()
+
+    def test_tina_migration_slices_and_conflicts(self):
+        es = fake_elasticsearch([{'_type': 'FakeProduct', '_id': 'id-A', '_version': 1, '_source': {}}])
+        es.bulk.side_effect = lambda body: {'items': [{'index': {'_id': 'id-A', 'status': 409, 'error': 'conflict'}}]}
+        es.indices.get_alias.return_value = {'product_v1': {}}
+        with patch.object(FakeProduct, '_es', new=es):
+            result = FakeProduct.migrate(slices=2)
+        self.assertEqual(result['documents'], 0)
+        self.assertEqual(result['failures'], [])
+        self.assertEqual(
+            sorted(x[1]['body']['slice']['id'] for x in es.search.call_args_list),
+            [0, 0, 1, 1],
+        )
+
+    def test_tina_migration_reindex(self):
+        es = MagicMock()
+        es.indices.get_alias.return_value = {'product_v1': {}}
+        es.transport.perform_request.return_value = (200, {'created': 5, 'updated': 0, 'failures': []})
+        with patch.object(FakeProduct, '_es', new=es):
+            result = FakeProduct.migrate(use_reindex=True)
+        self.assertEqual(result['documents'], 10)
+        es.transport.perform_request.assert_called_with('POST', '/_reindex', params={'refresh': 'true'}, body={
+            'conflicts': 'proceed',
+            'source': {'index': 'product_v1', 'size': 500},
+            'dest': {'index': 'product_v2', 'version_type': 'external'},
+        })
+        es.search.assert_not_called()
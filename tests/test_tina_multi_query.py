@@ -0,0 +1,95 @@
+import asyncio
+import json
+import unittest
+from mock import MagicMock, patch
+from tina.document import Document
+from tina.properties import StringProperty, IntegerProperty
+from tina.multi_query import multi_query, amulti_query
+from tina.exceptions import TransportError
+
+
+class FakeOrder(Document):
+    _index_name = 'order'
+    state = StringProperty()
+    price = IntegerProperty()
+class FakeAccount(Document):
+    _index_name = 'account'
+    name = StringProperty()
+
+
+class TestTinaMultiQuery(unittest.TestCase):
+    def test_tina_multi_query(self):
+        fake_es = MagicMock()
+        fake_es.msearch.return_value = {'responses': [
+            {'hits': {'total': 1, 'hits': [{'_id': 'id-1', '_version': 1, '_source': {'state': 'paid'}}]}},
+            {'hits': {'total': 3, 'hits': []}},
+            {'error': 'SearchPhaseExecutionException[Failed to execute phase [query]]', 'status': 400},
+            {'hits': {'total': 3, 'hits': []}, 'aggregations': {'group': {'buckets': [{'key': 'A', 'doc_count': 3}]}}},
+        ]}
+        with patch('tina.document.Document._es', new=fake_es), \
+                patch.object(FakeOrder, 'get_index_name', new=MagicMock(return_value='order')), \
+                patch.object(FakeAccount, 'get_index_name', new=MagicMock(return_value='account')):
+            results = multi_query(
+                FakeOrder.where('state', equal='paid').batch().fetch(20, fetch_reference=False),
+                FakeAccount.all().batch().count(),
+                FakeOrder.all().batch().sum('price'),
+                FakeAccount.where('name', contains=[]).batch().count(),
+                FakeAccount.all().batch().group_by('name'),
+            )
+        documents, total = results[0]
+        self.assertEqual(total, 1)
+        self.assertEqual(documents[0].state, 'paid')
+        self.assertEqual(results[1], 3)
+        self.assertIsInstance(results[2], TransportError)
+        self.assertEqual(results[3], 0)
+        self.assertEqual(results[4], [{'key': 'A', 'doc_count': 3}])
+
+        lines = [json.loads(x) for x in fake_es.msearch.call_args[1]['body'].splitlines()]
+        self.assertEqual(len(lines), 8)
+        self.assertEqual(lines[0], {'index': 'order'})
+        self.assertEqual(lines[1]['size'], 20)
+        self.assertTrue(lines[1]['version'])
+        self.assertEqual(lines[2], {'index': 'account'})
+        self.assertEqual(lines[3], {'size': 0})
+        self.assertEqual(lines[6], {'index': 'account'})
+
+    def test_tina_multi_query_first(self):
+        fake_es = MagicMock()
+        fake_es.msearch.return_value = {'responses': [
+            {'hits': {'total': 0, 'hits': []}},
+            {'hits': {'total': 1, 'hits': [{'_id': 'id-A', '_version': 1, '_source': {'name': 'kelp'}}]}},
+        ]}
+        with patch('tina.document.Document._es', new=fake_es):
+            order, account = multi_query(
+                FakeOrder.all().batch().first(),
+                FakeAccount.all().batch().first(fetch_reference=False),
+            )
+        self.assertIsNone(order)
+        self.assertEqual(account.name, 'kelp')
+
+    def test_tina_multi_query_empty(self):
+        fake_es = MagicMock()
+        with patch('tina.document.Document._es', new=fake_es):
+            results = multi_query(FakeAccount.where('name', contains=[]).batch().fetch())
+        self.assertEqual(results, [([], 0)])
+        fake_es.msearch.assert_not_called()
+
+    def test_tina_amulti_query(self):
+        async def msearch(**kwargs):
+            return {'responses': [
+                {'hits': {'total': 1, 'hits': [{'_id': 'id-A', '_version': 1, '_source': {'name': 'kelp'}}]}},
+                {'hits': {'total': 5, 'hits': []}},
+            ]}
+        fake_es = MagicMock()
+        fake_es.msearch = MagicMock(side_effect=msearch)
+        with patch('tina.multi_query.utils.get_async_elasticsearch', new=MagicMock(return_value=fake_es)):
+            loop = asyncio.new_event_loop()
+            results = loop.run_until_complete(amulti_query(
+                FakeAccount.all().batch().fetch(),
+                FakeOrder.all().batch().count(),
+            ))
+            loop.close()
+        self.assertEqual(results[0][0][0].name, 'kelp')
+        self.assertEqual(results[0][1], 1)
+        self.assertEqual(results[1], 5)
+        fake_es.msearch.assert_called_once()
@@ -1,6 +1,34 @@
 import unittest
+from datetime import datetime
 from tina import properties
+from tina.document import Document
 
 
+class FakeDocument(Document):
+    created_at = properties.DateTimeProperty()
 class TestTinaProperties(unittest.TestCase):
-    pass
+    def test_tina_properties_date_time_property_to_python(self):
+        self.assertEqual(
+            properties.DateTimeProperty._to_python('2015-09-01T10:20:30Z'),
+            datetime(2015, 9, 1, 10, 20, 30)
+        )
+        self.assertEqual(
+            properties.DateTimeProperty._to_python('2015-09-01T10:20:30.123+08:00'),
+            datetime(2015, 9, 1, 10, 20, 30)
+        )
+        self.assertEqual(
+            properties.DateTimeProperty._to_python('2015-09-01T10:20:30'),
+            datetime(2015, 9, 1, 10, 20, 30)
+        )
+    def test_tina_properties_date_time_property_to_python_invalid(self):
+        self.assertRaises(ValueError, properties.DateTimeProperty._to_python, '2015-13-01T10:20:30Z')
+        self.assertRaises(ValueError, properties.DateTimeProperty._to_python, 'tina')
+
+    def test_tina_properties_date_time_property_memoize(self):
+        document = FakeDocument(created_at=datetime(2015, 9, 1, 10, 20, 30))
+        self.assertIs(document.created_at, document.created_at)
+        document.created_at = datetime(2016, 1, 1)
+        self.assertEqual(document.created_at, datetime(2016, 1, 1))
+        self.assertEqual(document._document['created_at'], '2016-01-01T00:00:00Z')
+        document.created_at = None
+        self.assertIsNone(document.created_at)
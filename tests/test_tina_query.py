@@ -1,9 +1,10 @@
+import asyncio
 import unittest
 from mock import MagicMock, patch
-from tina.query import QueryOperation, QueryCell, Query
+from tina.query import QueryOperation, QueryCell, Query, QueryParameter, compiled_query_cache
 from tina.document import Document
-from tina.properties import StringProperty, DateTimeProperty
-from tina.exceptions import QuerySyntaxError
+from tina.properties import StringProperty, DateTimeProperty, ReferenceProperty, ListProperty, IntegerProperty
+from tina.exceptions import QuerySyntaxError, PropertyNotExist, PartialDocumentError
 
 
 class TestTinaQueryOperation(unittest.TestCase):
@@ -52,6 +53,20 @@ class FakeDocument(Document):
     name = StringProperty()
     nickname = StringProperty()
     time = DateTimeProperty()
+class FakeSubstringDocument(Document):
+    email = StringProperty(substring_search=True)
+class FakeKeywordDocument(Document):
+    code = StringProperty(analyzer='keyword')
+    tags = ListProperty(str, analyzer='keyword')
+    age = IntegerProperty()
+class FakeCompany(Document):
+    name = StringProperty()
+class FakeAccount(Document):
+    name = StringProperty()
+    company = ReferenceProperty(FakeCompany)
+class FakeOrder(Document):
+    account = ReferenceProperty(FakeAccount)
+    seller = ReferenceProperty(FakeCompany)
 class TesttinaQuery(unittest.TestCase):
     def setUp(self):
         self.query = Query(FakeDocument)
@@ -83,6 +98,172 @@ class TesttinaQuery(unittest.TestCase):
             version=True,
         )
 
+    def test_tina_query_fetch_only(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            'hits': {
+                'hits': [{'_id': 'id-A', '_version': 1, '_source': {'name': 'kelp'}}],
+                'total': 1
+            }
+        }
+        with patch('tina.document.Document._es', new=fake_es):
+            self.query.document_class.get_index_name = MagicMock(return_value='index_name')
+            documents, total = self.query.fetch(only=['name'], fetch_reference=False)
+        fake_es.search.assert_called_once_with(
+            index='index_name',
+            body={'sort': [], '_source': {'include': ['name']}, 'from': 0, 'size': 1000},
+            version=True,
+        )
+        self.assertTrue(documents[0]._partial)
+        self.assertEqual(documents[0].name, 'kelp')
+        self.assertIsNone(documents[0].time)
+        self.assertNotIn('nickname', documents[0]._document)
+        self.assertRaises(PartialDocumentError, documents[0].save)
+
+    def test_tina_query_fetch_exclude_not_property(self):
+        self.assertRaises(PropertyNotExist, self.query.fetch, exclude=['nothing'])
+
+    def test_tina_query_iterate(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            '_scroll_id': 'scroll-A',
+            'hits': {
+                'hits': [{'_id': 'id-A', '_version': 1, '_source': {'name': 'kelp'}}],
+                'total': 1
+            }
+        }
+        fake_es.scroll.return_value = {
+            '_scroll_id': 'scroll-B',
+            'hits': {
+                'hits': [],
+                'total': 1
+            }
+        }
+        with patch('tina.document.Document._es', new=fake_es):
+            self.query.document_class.get_index_name = MagicMock(return_value='index_name')
+            documents = list(self.query.iterate(batch_size=10, fetch_reference=False))
+        self.assertEqual(len(documents), 1)
+        self.assertEqual(documents[0].name, 'kelp')
+        fake_es.search.assert_called_once_with(
+            index='index_name',
+            body={'sort': [], 'fields': ['_source'], 'size': 10},
+            scroll='1m',
+            version=True,
+        )
+        fake_es.scroll.assert_called_once_with(scroll_id='scroll-A', scroll='1m')
+        fake_es.clear_scroll.assert_called_once_with(scroll_id='scroll-B')
+
+    def test_tina_query_iterate_close(self):
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            '_scroll_id': 'scroll-A',
+            'hits': {
+                'hits': [{'_id': 'id-A', '_version': 1, '_source': {}}, {'_id': 'id-B', '_version': 1, '_source': {}}],
+                'total': 2
+            }
+        }
+        with patch('tina.document.Document._es', new=fake_es):
+            self.query.document_class.get_index_name = MagicMock(return_value='index_name')
+            documents = self.query.iterate(fetch_reference=False)
+            next(documents)
+            documents.close()
+        self.assertFalse(fake_es.scroll.called)
+        fake_es.clear_scroll.assert_called_once_with(scroll_id='scroll-A')
+
+    def test_tina_query_prefetch(self):
+        sources = {
+            'FakeAccount': {'id-A': {'name': 'kelp', 'company': 'id-C'}},
+            'FakeCompany': {'id-C': {'name': 'rinse'}, 'id-S': {'name': 'seller'}},
+        }
+        def mget(doc_type, body, **kwargs):
+            return {'docs': [
+                {'_id': x, '_version': 1, 'found': True, '_source': dict(sources[doc_type][x])} for x in body['ids']
+            ]}
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            'hits': {
+                'hits': [{'_id': 'id-1', '_version': 1, '_source': {'account': 'id-A', 'seller': 'id-S'}}],
+                'total': 1
+            }
+        }
+        fake_es.mget = MagicMock(side_effect=mget)
+        with patch('tina.document.Document._es', new=fake_es):
+            with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+                documents, total = Query(FakeOrder).prefetch('account.company').fetch(fetch_reference=False)
+        self.assertEqual(documents[0].account.name, 'kelp')
+        self.assertEqual(documents[0].account.company.name, 'rinse')
+        self.assertEqual(documents[0].seller, 'id-S')
+        self.assertEqual(
+            [(x[1]['doc_type'], x[1]['body']) for x in fake_es.mget.call_args_list],
+            [('FakeAccount', {'ids': ['id-A']}), ('FakeCompany', {'ids': ['id-C']})],
+        )
+
+    def test_tina_query_prefetch_with_references(self):
+        sources = {
+            'FakeAccount': {'id-A': {'name': 'kelp', 'company': 'id-C'}},
+            'FakeCompany': {'id-C': {'name': 'rinse'}, 'id-S': {'name': 'seller'}},
+        }
+        def mget(doc_type, body, **kwargs):
+            return {'docs': [
+                {'_id': x, '_version': 1, 'found': True, '_source': dict(sources[doc_type][x])} for x in body['ids']
+            ]}
+        fake_es = MagicMock()
+        fake_es.search.return_value = {
+            'hits': {
+                'hits': [{'_id': 'id-1', '_version': 1, '_source': {'account': 'id-A', 'seller': 'id-S'}}],
+                'total': 1
+            }
+        }
+        fake_es.mget = MagicMock(side_effect=mget)
+        with patch('tina.document.Document._es', new=fake_es):
+            with patch('tina.document.utils.get_elasticsearch', new=MagicMock(return_value=fake_es)):
+                documents, total = Query(FakeOrder).prefetch('account.company').fetch()
+        self.assertEqual(documents[0].account.company.name, 'rinse')
+        self.assertEqual(documents[0].seller.name, 'seller')
+        # level 1: FakeAccount and FakeCompany at the same time, level 2: FakeCompany
+        self.assertEqual(fake_es.mget.call_count, 3)
+
+    def test_tina_query_prefetch_not_reference(self):
+        self.assertRaises(PropertyNotExist, Query(FakeOrder).prefetch, 'account.name')
+        self.assertRaises(PropertyNotExist, Query(FakeOrder).prefetch, 'nothing')
+
+    def test_tina_query_afetch(self):
+        async def search(**kwargs):
+            return {
+                'hits': {
+                    'hits': [{'_id': 'id-A', '_version': 1, '_source': {'name': 'kelp'}}],
+                    'total': 1
+                }
+            }
+        fake_es = MagicMock()
+        fake_es.search = MagicMock(side_effect=search)
+        with patch('tina.query.utils.get_async_elasticsearch', new=MagicMock(return_value=fake_es)):
+            self.query.document_class.get_index_name = MagicMock(return_value='index_name')
+            loop = asyncio.new_event_loop()
+            documents, total = loop.run_until_complete(self.query.afetch(fetch_reference=False))
+            loop.close()
+        fake_es.search.assert_called_once_with(
+            index='index_name',
+            body={'sort': [], 'fields': ['_source'], 'from': 0, 'size': 1000},
+            version=True,
+        )
+        self.assertEqual(total, 1)
+        self.assertEqual(documents[0]._id, 'id-A')
+        self.assertEqual(documents[0].name, 'kelp')
+
+    def test_tina_query_acount(self):
+        async def count(**kwargs):
+            return {'count': 3}
+        fake_es = MagicMock()
+        fake_es.count = MagicMock(side_effect=count)
+        with patch('tina.query.utils.get_async_elasticsearch', new=MagicMock(return_value=fake_es)):
+            self.query.document_class.get_index_name = MagicMock(return_value='index_name')
+            loop = asyncio.new_event_loop()
+            result = loop.run_until_complete(self.query.acount())
+            loop.close()
+        fake_es.count.assert_called_once_with(index='index_name')
+        self.assertEqual(result, 3)
+
     def test_tina_query_has_any(self):
         fake_es = MagicMock()
         fake_es().search_exists.return_value = {
@@ -100,13 +281,13 @@ class TesttinaQuery(unittest.TestCase):
         self.query.fetch = MagicMock()
         self.query.fetch.return_value = tuple([[], 0])
         item = self.query.first()
-        self.query.fetch.assert_called_once_with(1, 0, fetch_reference=True)
+        self.query.fetch.assert_called_once_with(1, 0, fetch_reference=True, only=None, exclude=None)
         self.assertIsNone(item)
     def test_tina_query_first(self):
         self.query.fetch = MagicMock()
         self.query.fetch.return_value = tuple([[{'_id': '4689f7addaedc3d52a9688722c3e595b', '_rev': '1-4689f7addaedc3d52a9688722c3e595b'}], 1])
         item = self.query.first()
-        self.query.fetch.assert_called_once_with(1, 0, fetch_reference=True)
+        self.query.fetch.assert_called_once_with(1, 0, fetch_reference=True, only=None, exclude=None)
         self.assertDictEqual(item, {
             '_id': '4689f7addaedc3d52a9688722c3e595b',
             '_rev': '1-4689f7addaedc3d52a9688722c3e595b',
@@ -211,6 +392,135 @@ class TesttinaQuery(unittest.TestCase):
         })
         self.assertListEqual(sort_list, [])
 
+    def test_tina_query__compile_queries_cache(self):
+        compiled_query_cache.clear()
+        query_a = Query(FakeDocument).where('name', equal='kelp')
+        query_b = Query(FakeDocument).where('name', equal='tina')
+        es_query_a, _ = query_a._Query__compile_queries(query_a.items)
+        es_query_b, _ = query_b._Query__compile_queries(query_b.items)
+        self.assertDictEqual(compiled_query_cache.stats(), {'hits': 1, 'misses': 1, 'size': 1})
+        self.assertEqual(es_query_a['bool']['should'][0]['bool']['should'][0]['match']['name']['query'], 'kelp')
+        self.assertEqual(es_query_b['bool']['should'][0]['bool']['should'][0]['match']['name']['query'], 'tina')
+        self.assertIsNot(es_query_a, query_a._Query__compile_queries(query_a.items)[0])
+
+    def test_tina_query__compile_queries_cache_size(self):
+        compiled_query_cache.clear()
+        with patch('django.conf.settings.TINA_COMPILED_QUERY_CACHE_SIZE', new=1, create=True):
+            for name in ('name', 'nickname', 'name'):
+                query = Query(FakeDocument).where(name, equal='kelp')
+                query._Query__compile_queries(query.items)
+            self.assertDictEqual(compiled_query_cache.stats(), {'hits': 0, 'misses': 3, 'size': 1})
+        compiled_query_cache.clear()
+        with patch('django.conf.settings.TINA_COMPILED_QUERY_CACHE_SIZE', new=0, create=True):
+            query = Query(FakeDocument).where('name', equal='kelp')
+            es_query, _ = query._Query__compile_queries(query.items)
+            es_query_again, _ = query._Query__compile_queries(query.items)
+            self.assertDictEqual(compiled_query_cache.stats(), {'hits': 0, 'misses': 0, 'size': 0})
+        self.assertEqual(es_query, es_query_again)
+
+    def test_tina_query__compile_queries_changed_query(self):
+        query = Query(FakeDocument).where('name', equal='kelp')
+        query._count_request()
+        query.filter_context()
+        self.assertEqual(
+            query._count_request(),
+            Query(FakeDocument).filter_context().where('name', equal='kelp')._count_request(),
+        )
+        query.items[1].value = 'tina'
+        self.assertEqual(
+            query._count_request(),
+            Query(FakeDocument).filter_context().where('name', equal='tina')._count_request(),
+        )
+
+    def test_tina_query__compile_queries_contains_string(self):
+        query = Query(FakeDocument).where('name', contains='ab')
+        expected_query = Query(FakeDocument).where('name', contains=['a', 'b'])
+        self.assertEqual(query._count_request(), expected_query._count_request())
+        self.assertEqual(
+            query.filter_context()._count_request(),
+            expected_query.filter_context()._count_request(),
+        )
+
+    def test_tina_query_bind(self):
+        template = Query(FakeDocument).where('name', equal=QueryParameter('name'))\
+            .where('nickname', contains=QueryParameter('nicknames'))
+        query = template.bind(name='kelp', nicknames=['tina'])
+        expected_query = Query(FakeDocument).where('name', equal='kelp').where('nickname', contains=['tina'])
+        self.assertEqual(
+            query._Query__compile_queries(query.items),
+            expected_query._Query__compile_queries(expected_query.items),
+        )
+        self.assertEqual(template.items[1].value.name, 'name')
+        self.assertTrue(template.bind(name='kelp', nicknames=[]).contains_empty)
+        self.assertRaises(QuerySyntaxError, template.bind, name='kelp')
+
+    def test_tina_query__compile_queries_filter_context(self):
+        query = self.query.filter_context()\
+            .where('name', equal='kelp')\
+            .where('nickname', contains=['tina'])\
+            .where('time', equal=None)\
+            .where('nickname', like='ti')
+        es_query, sort_list = self.query._Query__compile_queries(query.items)
+        self.assertDictEqual(es_query, {
+            'bool': {
+                'filter': [
+                    {'match': {'name': {'query': 'kelp', 'operator': 'and'}}},
+                    {'bool': {'should': [{'match': {'nickname': {'query': 'tina', 'operator': 'and'}}}]}},
+                ],
+                'must_not': [
+                    {'exists': {'field': 'time'}},
+                ],
+                'must': [{
+                    'bool': {
+                        'should': [
+                            {'match': {'nickname': {'query': 'ti', 'operator': 'and'}}},
+                            {'regexp': {'nickname': '.*ti.*'}},
+                        ]
+                    }
+                }],
+            }
+        })
+        self.assertListEqual(sort_list, [])
+    def test_tina_query__compile_queries_filter_context_union(self):
+        query = self.query.filter_context().where(lambda x:
+                                                  x.where('name', equal='kelp')\
+                                                  .union('nickname', unequal='kelp')
+        )
+        es_query, sort_list = self.query._Query__compile_queries(query.items)
+        self.assertDictEqual(es_query, {
+            'bool': {
+                'filter': [{
+                    'bool': {
+                        'minimum_should_match': 1,
+                        'should': [
+                            {'bool': {'filter': {'match': {'name': {'query': 'kelp', 'operator': 'and'}}}}},
+                            {'bool': {'must_not': {'match': {'nickname': {'query': 'kelp', 'operator': 'and'}}}}},
+                        ]
+                    }
+                }]
+            }
+        })
+
+    def test_tina_query__compile_queries_filter_context_terms(self):
+        query = Query(FakeKeywordDocument).filter_context()\
+            .where('code', equal='A1')\
+            .where('tags', contains=['x', 'y'])\
+            .where('age', unequal=3)\
+            .where('_id', exclude=['id-A'])
+        es_query, _ = query._Query__compile_queries(query.items)
+        self.assertDictEqual(es_query, {
+            'bool': {
+                'filter': [
+                    {'term': {'code': 'A1'}},
+                    {'terms': {'tags': ['x', 'y']}},
+                ],
+                'must_not': [
+                    {'term': {'age': 3}},
+                    {'terms': {'_id': ['id-A']}},
+                ],
+            }
+        })
+
     def test_tina_query__compile_query_like(self):
         query_cell = QueryCell(
             QueryOperation.like,
@@ -272,6 +582,60 @@ class TesttinaQuery(unittest.TestCase):
                     ]
                 }
         })
+    def test_tina_query__compile_query_like_substring_search(self):
+        query_cell = QueryCell(
+            QueryOperation.like,
+            member='email',
+            value='kelp',
+        )
+        result = Query(FakeSubstringDocument)._Query__compile_query(query_cell)
+        self.assertDictEqual(result, {
+            'bool': {
+                'should': [
+                    {'match': {'email': {'query': 'kelp', 'operator': 'and'}}},
+                    {'match_phrase': {'email.substring': {'query': 'kelp'}}},
+                ]
+            }
+        })
+    def test_tina_query__compile_query_unlike_substring_search(self):
+        query_cell = QueryCell(
+            QueryOperation.unlike,
+            member='email',
+            value='kelp',
+        )
+        result = Query(FakeSubstringDocument)._Query__compile_query(query_cell)
+        self.assertDictEqual(result, {
+            'bool': {
+                'minimum_should_match': 2,
+                'should': [
+                    {'bool': {'must_not': {'match': {'email': {'query': 'kelp', 'operator': 'and'}}}}},
+                    {'bool': {'must_not': {'match_phrase': {'email.substring': {'query': 'kelp'}}}}},
+                ]
+            }
+        })
+    def test_tina_query__compile_queries_like_substring_search_short(self):
+        compiled_query_cache.clear()
+        query = Query(FakeSubstringDocument).where('email', like='kelp')
+        short_query = Query(FakeSubstringDocument).where('email', like='ab')
+        es_query, _ = query._Query__compile_queries(query.items)
+        short_es_query, _ = short_query._Query__compile_queries(short_query.items)
+        self.assertEqual(
+            es_query['bool']['should'][0]['bool']['should'][0]['bool']['should'][1],
+            {'match_phrase': {'email.substring': {'query': 'kelp'}}},
+        )
+        # 'ab' doesn't have any 3-gram
+        self.assertEqual(
+            short_es_query['bool']['should'][0]['bool']['should'][0]['bool']['should'][1],
+            {'regexp': {'email': '.*ab.*'}},
+        )
+    def test_tina_query__compile_query_unlike_substring_search_short(self):
+        query_cell = QueryCell(
+            QueryOperation.unlike,
+            member='email',
+            value='ab',
+        )
+        result = Query(FakeSubstringDocument)._Query__compile_query(query_cell)
+        self.assertDictEqual(result['bool']['should'][1], {'bool': {'must_not': {'regexp': {'email': '.*ab.*'}}}})
     def test_tina_query__compile_query_contains(self):
         query_cell = QueryCell(
             QueryOperation.contains,
@@ -1,12 +1,90 @@
+import asyncio
 import unittest
 from mock import patch, MagicMock
 from tina import utils
 
 
 class TestTinaUtils(unittest.TestCase):
+    def setUp(self):
+        utils.reset_elasticsearch()
+
+    def tearDown(self):
+        utils.reset_elasticsearch()
+
     def test_tina_utils_get_elasticsearch(self):
         with patch('django.conf.settings.TINA_ELASTICSEARCH_URL', new='http://es:9200'):
             with patch('elasticsearch.Elasticsearch', new=MagicMock(return_value='es')) as mock_es:
                 es = utils.get_elasticsearch()
                 self.assertEqual(es, 'es')
-            mock_es.assert_called_once_with('http://es:9200')
+            mock_es.assert_called_once_with(
+                'http://es:9200',
+                maxsize=10,
+                timeout=10,
+                max_retries=3,
+                retry_on_timeout=False,
+            )
+
+    def test_tina_utils_get_elasticsearch_shared(self):
+        with patch('elasticsearch.Elasticsearch', new=MagicMock(side_effect=lambda *args, **kwargs: MagicMock())) as mock_es:
+            es_a = utils.get_elasticsearch('http://es:9200')
+            es_b = utils.get_elasticsearch('http://es:9200')
+            es_c = utils.get_elasticsearch('http://es-2:9200')
+        self.assertIs(es_a, es_b)
+        self.assertIsNot(es_a, es_c)
+        self.assertEqual(mock_es.call_count, 2)
+
+    def test_tina_utils_get_elasticsearch_settings(self):
+        with patch('django.conf.settings.TINA_ELASTICSEARCH_MAXSIZE', new=25, create=True), \
+                patch('django.conf.settings.TINA_ELASTICSEARCH_TIMEOUT', new=30, create=True):
+            with patch('elasticsearch.Elasticsearch', new=MagicMock(return_value='es')) as mock_es:
+                utils.get_elasticsearch('http://es:9200')
+        mock_es.assert_called_once_with(
+            'http://es:9200',
+            maxsize=25,
+            timeout=30,
+            max_retries=3,
+            retry_on_timeout=False,
+        )
+
+    def test_tina_utils_get_async_elasticsearch_closed_loop(self):
+        fake_module = MagicMock()
+        fake_module.AsyncElasticsearch.side_effect = lambda *args, **kwargs: MagicMock()
+        loop_a = asyncio.new_event_loop()
+        loop_b = asyncio.new_event_loop()
+        try:
+            with patch.dict('sys.modules', {'elasticsearch_async': fake_module}):
+                asyncio.set_event_loop(loop_a)
+                es_a = utils.get_async_elasticsearch('http://es:9200')
+                self.assertIs(utils.get_async_elasticsearch('http://es:9200'), es_a)
+                loop_a.close()
+                asyncio.set_event_loop(loop_b)
+                es_b = utils.get_async_elasticsearch('http://es:9200')
+            self.assertIsNot(es_a, es_b)
+            self.assertEqual(list(utils._elasticsearch_clients), [('http://es:9200', loop_b)])
+            loop_b.run_until_complete(utils.close_async_elasticsearch())
+            es_b.transport.close.assert_called_once_with()
+            self.assertEqual(utils._elasticsearch_clients, {})
+        finally:
+            asyncio.set_event_loop(None)
+            loop_b.close()
+
+    def test_tina_utils_copy_elasticsearch(self):
+        class FakeElasticsearch(object):
+            def __init__(self, hosts, **kwargs):
+                self.hosts = hosts
+                self.kwargs = kwargs
+                self.transport = MagicMock(
+                    hosts=hosts, connection_class='connection', max_retries=3, retry_on_timeout=False,
+                    kwargs={'maxsize': 10},
+                )
+        es = FakeElasticsearch([{'host': 'es', 'port': 9200}])
+        result = utils.copy_elasticsearch(es)
+        self.assertIsInstance(result, FakeElasticsearch)
+        self.assertIsNot(result, es)
+        self.assertEqual(result.hosts, [{'host': 'es', 'port': 9200}])
+        self.assertEqual(result.kwargs, {
+            'connection_class': 'connection',
+            'max_retries': 3,
+            'retry_on_timeout': False,
+            'maxsize': 10,
+        })
@@ -0,0 +1,312 @@
+from datetime import datetime, timedelta
+from .properties import DateTimeProperty
+from .exceptions import PropertyNotExist, QuerySyntaxError
+
+
+class Aggregation(object):
+    """
+    The base class of aggregations for `Query.aggregate()`.
+    https://www.elastic.co/guide/en/elasticsearch/reference/current/search-aggregations.html
+    """
+    aggregation_type = None
+
+    def __init__(self, member):
+        """
+        :param member: {string} The property name of the document.
+        """
+        self.member = member
+
+    def to_dict(self, document_class):
+        """
+        Generate the elasticsearch aggregation.
+        :param document_class: {type} The document class of the query.
+        :return: {dict}
+        """
+        self._check_member(document_class)
+        return {
+            self.aggregation_type: self._get_options(),
+        }
+
+    def parse(self, result):
+        """
+        Get the typed result from the aggregation response.
+        Subclasses override it, the default result is the response.
+        :param result: {dict} The response of this aggregation.
+        :return: {dict}
+        """
+        return result
+
+    def _get_options(self):
+        return {
+            'field': self.member,
+        }
+
+    def _check_member(self, document_class):
+        if self.member.split('.', 1)[0] not in document_class.get_properties().keys():
+            raise PropertyNotExist('%s not in %s' % (self.member, document_class.__name__))
+
+
+# -----------------------------------------------------
+# Metrics
+# -----------------------------------------------------
+class Sum(Aggregation):
+    """
+    The result is {float}.
+    """
+    aggregation_type = 'sum'
+
+    def parse(self, result):
+        return result['value']
+
+class Avg(Sum):
+    """
+    The result is {float or None}. None: there are no values.
+    """
+    aggregation_type = 'avg'
+
+class Min(Sum):
+    """
+    The result is {float or None}. None: there are no values.
+    """
+    aggregation_type = 'min'
+
+class Max(Sum):
+    """
+    The result is {float or None}. None: there are no values.
+    """
+    aggregation_type = 'max'
+
+class Cardinality(Aggregation):
+    """
+    The approximate count of distinct values.
+    The result is {int}.
+    """
+    aggregation_type = 'cardinality'
+
+    def __init__(self, member, precision_threshold=None):
+        """
+        :param member: {string} The property name of the document.
+        :param precision_threshold: {int} Counts below this value are expected to be close to accurate.
+        """
+        super(Cardinality, self).__init__(member)
+        self.precision_threshold = precision_threshold
+
+    def _get_options(self):
+        result = super(Cardinality, self)._get_options()
+        if self.precision_threshold is not None:
+            result['precision_threshold'] = self.precision_threshold
+        return result
+
+    def parse(self, result):
+        return result['value']
+
+class Stats(Aggregation):
+    """
+    The result is {StatsResult}.
+    """
+    aggregation_type = 'stats'
+
+    def parse(self, result):
+        return StatsResult(
+            count=result['count'],
+            min=result['min'],
+            max=result['max'],
+            avg=result['avg'],
+            sum=result['sum'],
+        )
+
+class Percentiles(Aggregation):
+    """
+    The result is {dict} {percent: value}. {50.0: 12.5, 99.0: 48.0}
+    """
+    aggregation_type = 'percentiles'
+
+    def __init__(self, member, percents=None):
+        """
+        :param member: {string} The property name of the document.
+        :param percents: {list} [{float}] Default is [1, 5, 25, 50, 75, 95, 99].
+        """
+        super(Percentiles, self).__init__(member)
+        self.percents = percents
+
+    def _get_options(self):
+        result = super(Percentiles, self)._get_options()
+        if self.percents:
+            result['percents'] = list(self.percents)
+        return result
+
+    def parse(self, result):
+        values = result['values']
+        if isinstance(values, list):
+            # keyed: false
+            return {float(x['key']): x['value'] for x in values}
+        return {float(key): value for key, value in values.items() if not key.endswith('_as_string')}
+
+
+# -----------------------------------------------------
+# Buckets
+# -----------------------------------------------------
+class BucketAggregation(Aggregation):
+    """
+    The base class of bucket aggregations. Sub aggregations are applied on each bucket.
+    The result is {list} [{Bucket}].
+    """
+    def __init__(self, member, **aggregations):
+        """
+        :param member: {string} The property name of the document.
+        :param aggregations: {dict} {'name': {Aggregation}} Sub aggregations.
+        """
+        super(BucketAggregation, self).__init__(member)
+        self.aggregations = aggregations
+
+    def to_dict(self, document_class):
+        result = super(BucketAggregation, self).to_dict(document_class)
+        if self.aggregations:
+            result['aggs'] = {name: x.to_dict(document_class) for name, x in self.aggregations.items()}
+        return result
+
+    def parse(self, result):
+        return [
+            Bucket(
+                self._parse_key(x),
+                x['doc_count'],
+                {name: aggregation.parse(x[name]) for name, aggregation in self.aggregations.items()},
+            )
+            for x in result['buckets']
+        ]
+
+    def _parse_key(self, bucket):
+        return bucket['key']
+
+class Terms(BucketAggregation):
+    """
+    Group documents by values of the field. Terms can be nested.
+    The result is {list} [{Bucket}].
+    """
+    aggregation_type = 'terms'
+
+    def __init__(self, member, size=10, order='_count', descending=True, **aggregations):
+        """
+        :param member: {string} The property name of the document.
+        :param size: {int} The number of buckets.
+        :param order: {string} '_count', '_term' or the name of a sub metric aggregation.
+        :param descending: {bool} Is sorted by descending?
+        :param aggregations: {dict} {'name': {Aggregation}} Sub aggregations.
+        """
+        super(Terms, self).__init__(member, **aggregations)
+        self.size = size
+        self.order = order
+        self.descending = descending
+
+    def _get_options(self):
+        result = super(Terms, self)._get_options()
+        result['size'] = self.size
+        result['order'] = {
+            self.order: 'desc' if self.descending else 'asc',
+        }
+        return result
+
+class Histogram(BucketAggregation):
+    """
+    Group documents by fixed-size intervals of the number field.
+    The result is {list} [{Bucket}].
+    """
+    aggregation_type = 'histogram'
+
+    def __init__(self, member, interval, min_doc_count=0, **aggregations):
+        """
+        :param member: {string} The property name of the document. The field should be number.
+        :param interval: {int or float} The size of buckets.
+        :param min_doc_count: {int} Empty buckets are returned when it is 0.
+        :param aggregations: {dict} {'name': {Aggregation}} Sub aggregations.
+        """
+        super(Histogram, self).__init__(member, **aggregations)
+        self.interval = interval
+        self.min_doc_count = min_doc_count
+
+    def _get_options(self):
+        result = super(Histogram, self)._get_options()
+        result['interval'] = self.interval
+        result['min_doc_count'] = self.min_doc_count
+        return result
+
+class DateHistogram(Histogram):
+    """
+    Group documents by intervals of the DateTimeProperty.
+    Keys of buckets are {datetime} in UTC.
+    The result is {list} [{Bucket}].
+    """
+    aggregation_type = 'date_histogram'
+
+    def __init__(self, member, interval='day', min_doc_count=0, time_zone=None, **aggregations):
+        """
+        :param member: {string} The property name of the document. It should be DateTimeProperty.
+        :param interval: {string} 'year', 'quarter', 'month', 'week', 'day', 'hour', 'minute', 'second' or '1.5h'.
+        :param min_doc_count: {int} Empty buckets are returned when it is 0.
+        :param time_zone: {string} The time zone of buckets. '+08:00'
+        :param aggregations: {dict} {'name': {Aggregation}} Sub aggregations.
+        """
+        super(DateHistogram, self).__init__(member, interval, min_doc_count, **aggregations)
+        self.time_zone = time_zone
+
+    def _get_options(self):
+        result = super(DateHistogram, self)._get_options()
+        if self.time_zone:
+            result['time_zone'] = self.time_zone
+        return result
+
+    def _check_member(self, document_class):
+        super(DateHistogram, self)._check_member(document_class)
+        if not isinstance(document_class.get_properties()[self.member.split('.', 1)[0]], DateTimeProperty):
+            raise QuerySyntaxError('date_histogram requires DateTimeProperty: %s' % self.member)
+
+    def _parse_key(self, bucket):
+        # the key is milliseconds since the epoch
+        return datetime(1970, 1, 1) + timedelta(milliseconds=bucket['key'])
+
+
+# -----------------------------------------------------
+# Results
+# -----------------------------------------------------
+class StatsResult(object):
+    """
+    The result of Stats.
+    """
+    def __init__(self, count, min, max, avg, sum):
+        self.count = count
+        self.min = min
+        self.max = max
+        self.avg = avg
+        self.sum = sum
+
+    def __eq__(self, other):
+        return isinstance(other, StatsResult) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return 'StatsResult(count=%r, min=%r, max=%r, avg=%r, sum=%r)' % (
+            self.count, self.min, self.max, self.avg, self.sum,
+        )
+
+class Bucket(object):
+    """
+    The bucket of Terms, Histogram and DateHistogram.
+    Results of sub aggregations are got by `bucket['name']`.
+    """
+    def __init__(self, key, doc_count, aggregations=None):
+        """
+        :param key: The term, the number or the datetime.
+        :param doc_count: {int}
+        :param aggregations: {dict} {'name': result} Results of sub aggregations.
+        """
+        self.key = key
+        self.doc_count = doc_count
+        self.aggregations = aggregations or {}
+
+    def __getitem__(self, name):
+        return self.aggregations[name]
+
+    def __eq__(self, other):
+        return isinstance(other, Bucket) and self.__dict__ == other.__dict__
+
+    def __repr__(self):
+        return 'Bucket(key=%r, doc_count=%r, aggregations=%r)' % (self.key, self.doc_count, self.aggregations)
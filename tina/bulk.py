@@ -0,0 +1,73 @@
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+
+def _json_default(value):
+    """
+    Serialize the values which json can't handle. It is the same as elasticsearch-py.
+    """
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError('Unable to serialize %r (type: %s)' % (value, type(value)))
+
+def dumps(data):
+    """
+    Serialize the data to a bulk line.
+    :param data: {dict}
+    :return: {string}
+    """
+    return json.dumps(data, default=_json_default, separators=(',', ':'))
+
+def generate_chunks(actions, chunk_size=500, max_chunk_bytes=10485760):
+    """
+    Split bulk actions into chunks bounded by the number of actions and the body size.
+    :param actions: {iterable} [({object}, {list}[{string}])]
+        The item which the action is for.
+        The bulk lines of the action.
+    :param chunk_size: {int} The max number of actions in one chunk.
+    :param max_chunk_bytes: {int} The max size of one chunk body in bytes.
+    :return: {generator} {tuple} ({list}[{object}], {string}body, {int}size)
+    """
+    items = []
+    lines = []
+    size = 0
+    for item, action_lines in actions:
+        action_size = sum(len(x.encode('utf-8')) + 1 for x in action_lines)
+        if items and (len(items) >= chunk_size or size + action_size > max_chunk_bytes):
+            yield items, '\n'.join(lines) + '\n', size
+            items = []
+            lines = []
+            size = 0
+        items.append(item)
+        lines.extend(action_lines)
+        size += action_size
+    if items:
+        yield items, '\n'.join(lines) + '\n', size
+
+def parse_response(items, response):
+    """
+    Match the bulk response with items.
+    :param items: {list} The items of the chunk.
+    :param response: {dict} The response of the bulk api.
+    :returns: {generator} {tuple} ({object}item, {dict}result, {dict or None}failure)
+        failure: {
+            document: {object} The item,
+            status: {int} The http status code of the action,
+            error: The error message from elasticsearch,
+        }
+    """
+    for item, response_item in zip(items, response['items']):
+        # {'index': {...}} or {'delete': {...}}
+        result = list(response_item.values())[0]
+        status = result.get('status', 200)
+        if status >= 300 or result.get('error'):
+            yield item, result, {
+                'document': item,
+                'status': status,
+                'error': result.get('error'),
+            }
+        else:
+            yield item, result, None
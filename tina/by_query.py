@@ -0,0 +1,186 @@
+import logging
+import time
+from . import utils, cache
+from .exceptions import PropertyNotExist, QuerySyntaxError, TransportError
+from .identity_map import get_identity_map
+from .instrumentation import Operation
+
+
+logger = logging.getLogger('tina.by_query')
+
+
+def delete_by_query(document_class, query, slices=1, requests_per_second=None, conflicts='proceed',
+                    wait=True, poll_interval=1, timeout=None, synchronized=False):
+    """
+    Delete documents by the query on the server with `_delete_by_query` of elasticsearch 5.0+.
+    :param document_class: {type} The document class.
+    :param query: {dict or None} The compiled query. None: all documents.
+    :param slices: {int or string} The number of parallel slices on the server. 'auto' requires elasticsearch 6.1+.
+    :param requests_per_second: {float} Throttle batches of the operation. None: no throttling.
+    :param conflicts: {string} 'proceed': count version conflicts. 'abort': stop at the first conflict.
+    :param wait: {bool} Poll the task until it is completed. False: return the running task.
+    :param poll_interval: {float} Seconds between polling requests.
+    :param timeout: {float} Stop polling after x seconds, the task keeps running. None: no limit.
+    :param synchronized: {bool} Refresh the index after the operation.
+    :return: {dict} See `wait_for_task()`.
+    """
+    return _submit(document_class, 'delete_by_query', {'query': query or {'match_all': {}}},
+                   slices, requests_per_second, conflicts, wait, poll_interval, timeout, synchronized)
+
+def update_by_query(document_class, query, set=None, script=None, params=None, slices=1,
+                    requests_per_second=None, conflicts='proceed', wait=True, poll_interval=1, timeout=None,
+                    synchronized=False):
+    """
+    Update documents by the query on the server with `_update_by_query` of elasticsearch 5.0+.
+    :param document_class: {type} The document class.
+    :param query: {dict or None} The compiled query. None: all documents.
+    :param set: {dict} {'property_name': (value)} Set properties. Values are converted by properties.
+    :param script: {string} The painless script which runs after setting values. 'ctx._source.views += params.count'
+    :param params: {dict} Parameters of the script.
+    The other parameters are the same as `delete_by_query()`.
+    :return: {dict} See `wait_for_task()`.
+    """
+    if not set and not script:
+        raise QuerySyntaxError('set or script is required')
+    params = dict(params or {})
+    sources = []
+    if set:
+        params['tina_set'] = _to_json_values(document_class, set)
+        sources.append('ctx._source.putAll(params.tina_set);')
+    if script:
+        sources.append(script)
+    body = {
+        'query': query or {'match_all': {}},
+        'script': {
+            'inline': ' '.join(sources),
+            'lang': 'painless',
+            'params': params,
+        },
+    }
+    return _submit(document_class, 'update_by_query', body,
+                   slices, requests_per_second, conflicts, wait, poll_interval, timeout, synchronized)
+
+def get_task(document_class, task_id):
+    """
+    Get the status of the by-query task.
+    Caches of the class are invalidated when the task is completed.
+    :param document_class: {type} The document class.
+    :param task_id: {string} The task id. 'node:1234'
+    :return: {dict} See `wait_for_task()`.
+    """
+    request = {'index': document_class.get_index_name()}
+    with Operation('task', document_class, request) as operation:
+        response = utils.perform_request(document_class._es, 'GET', '/_tasks/%s' % task_id)
+        operation.received(response)
+    if response.get('error'):
+        error = response['error']
+        raise TransportError(500, error.get('type', 'task_failed') if isinstance(error, dict) else error, error)
+    if not response.get('completed'):
+        return build_result(task_id, False, response.get('task', {}).get('status', {}))
+    _invalidate(document_class)
+    return build_result(task_id, True, response.get('response', {}))
+
+def wait_for_task(document_class, task_id, poll_interval=1, timeout=None):
+    """
+    Poll the by-query task until it is completed.
+    :param document_class: {type} The document class.
+    :param task_id: {string} The task id. 'node:1234'
+    :param poll_interval: {float} Seconds between polling requests.
+    :param timeout: {float} Stop polling after x seconds, the task keeps running. None: no limit.
+    :returns: {dict}
+        {
+            task: {string} The task id,
+            completed: {bool} False: The task is still running, counts are the progress.
+            total: {int} The number of matched documents,
+            deleted: {int},
+            updated: {int},
+            noops: {int} Documents which the script doesn't change,
+            version_conflicts: {int} Documents which are changed by others during the operation,
+            batches: {int} The number of scroll batches,
+            failures: {list} [{dict}] The failures of bulk requests and search shards,
+        }
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while True:
+        result = get_task(document_class, task_id)
+        if result['completed']:
+            return result
+        if deadline is not None and time.monotonic() + poll_interval > deadline:
+            logger.warning('The task %s of %s is still running: %s', task_id, document_class.__name__, result)
+            return result
+        time.sleep(poll_interval)
+
+def _submit(document_class, api, body, slices, requests_per_second, conflicts, wait, poll_interval, timeout,
+            synchronized):
+    """
+    Start the by-query task and wait for it.
+    The request doesn't wait for completion on the server, a long operation can't be retried by the client
+    after its request timeout.
+    :return: {dict} See `wait_for_task()`.
+    """
+    index = document_class.get_index_name()
+    query_params = {
+        'conflicts': conflicts,
+        'wait_for_completion': 'false',
+    }
+    if slices != 1:
+        query_params['slices'] = slices
+    if requests_per_second is not None:
+        query_params['requests_per_second'] = requests_per_second
+    if synchronized:
+        query_params['refresh'] = 'true'
+    request = {'index': index, 'body': body}
+    with Operation(api, document_class, request) as operation:
+        response = utils.perform_request(document_class._es, 'POST', '/%s/_%s' % (index, api), query_params, body)
+        operation.received(response)
+    task_id = response['task']
+    logger.info('Start %s of %s: %s', api, document_class.__name__, task_id)
+    if not wait:
+        cache.invalidate_aggregations(index)
+        return build_result(task_id, False, {})
+    return wait_for_task(document_class, task_id, poll_interval, timeout)
+
+def build_result(task_id, completed, data):
+    """
+    Build the result of the by-query operation.
+    :param task_id: {string}
+    :param completed: {bool}
+    :param data: {dict} The `response` of the completed task or the `status` of the running task.
+    :return: {dict} See `wait_for_task()`.
+    """
+    return {
+        'task': task_id,
+        'completed': completed,
+        'total': data.get('total', 0),
+        'deleted': data.get('deleted', 0),
+        'updated': data.get('updated', 0),
+        'noops': data.get('noops', 0),
+        'version_conflicts': data.get('version_conflicts', 0),
+        'batches': data.get('batches', 0),
+        'failures': data.get('failures', []),
+    }
+
+def _invalidate(document_class):
+    """
+    Documents which are changed on the server are unknown. Drop all of the class from the identity map
+    and the caches.
+    """
+    identity_map = get_identity_map()
+    if identity_map is not None:
+        identity_map.remove_class(document_class)
+    cache.invalidate_class(document_class)
+    cache.invalidate_aggregations(document_class.get_index_name())
+
+def _to_json_values(document_class, values):
+    """
+    Convert values to json format and validate them by properties.
+    :param document_class: {type} The document class.
+    :param values: {dict} {'property_name': (value)}
+    :return: {dict} {'property_name': (value in json format)}
+    """
+    document = document_class._from_storage({'_id': None, '_source': {}}, True)
+    for property_name, value in values.items():
+        if property_name not in document_class._properties or property_name in ('_id', '_version'):
+            raise PropertyNotExist('%s not in %s' % (property_name, document_class.__name__))
+        setattr(document, property_name, value)
+    return {x: document._document[x] for x in values}
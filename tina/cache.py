@@ -0,0 +1,418 @@
+import copy
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from . import bulk
+
+
+_document_cache = None
+_document_cache_lock = threading.Lock()
+_aggregation_cache = None
+_aggregation_cache_lock = threading.Lock()
+
+
+class LocMemDocumentCache(object):
+    """
+    The in-process document cache with LRU and TTL.
+    Entries are `(version, source)`. The entry of the newer version isn't replaced by the older version,
+    so a slow reader can't put the stale document back after saving.
+    Other backends should implement `get`, `set`, `delete`, `delete_prefix`, `clear` and `stats`.
+    """
+    def __init__(self, max_size=10000, timeout=300):
+        """
+        :param max_size: {int} The max number of entries.
+        :param timeout: {int} Entries are expired after x seconds.
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.__entries = OrderedDict()  # {key: (expire time, version, source)}
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def get(self, key):
+        """
+        Get the entry.
+        :param key: {string}
+        :return: {tuple or None} ({int}version, {string or None}source)
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self.__entries[key]
+                self.__misses += 1
+                return None
+            self.__entries.move_to_end(key)
+            if entry[2] is None:
+                self.__misses += 1
+            else:
+                self.__hits += 1
+            return entry[1], entry[2]
+
+    def set(self, key, version, source):
+        """
+        Set the entry. It is ignored if the cached version is newer.
+        :param key: {string}
+        :param version: {int} The version of the document.
+        :param source: {string or None} The serialized source. None only keeps the version.
+        :return: {bool} Is the entry stored?
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None and entry[0] >= time.time() \
+                    and entry[1] is not None and version is not None and version < entry[1]:
+                return False
+            self.__entries[key] = (time.time() + self.timeout, version, source)
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+            return True
+
+    def delete(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def delete_prefix(self, prefix):
+        """
+        Delete entries of keys which start with the prefix. Metrics are kept.
+        :param prefix: {string}
+        :return: {int} The number of deleted entries.
+        """
+        with self.__lock:
+            keys = [x for x in self.__entries if x.startswith(prefix)]
+            for key in keys:
+                del self.__entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__hits = self.__misses = self.__evictions = 0
+
+    def stats(self):
+        """
+        Get metrics of the cache.
+        :return: {dict} {'hits': {int}, 'misses': {int}, 'evictions': {int}, 'hit_ratio': {float}, 'size': {int}}
+        """
+        with self.__lock:
+            total = self.__hits + self.__misses
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'hit_ratio': self.__hits / total if total else 0.0,
+                'size': len(self.__entries),
+            }
+
+
+class AggregationCache(object):
+    """
+    The in-process cache of aggregation results (count, sum and group_by) with LRU and TTL.
+    Results are keyed on the request: the index name and the compiled body.
+    Writing to the index through tina increases the generation of the index, results of older generations are dropped.
+    """
+    def __init__(self, max_size=1000, timeout=60, stale_timeout=0):
+        """
+        :param max_size: {int} The max number of results.
+        :param timeout: {int} Results are fresh in x seconds.
+        :param stale_timeout: {int} The stale result is returned for x seconds after `timeout`,
+            and it is revalidated in the background.
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.__entries = OrderedDict()  # {key: (created time, index, generation, value)}
+        self.__generations = {}  # {index: {int}}
+        self.__revalidating = set()  # keys which are revalidating
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    @staticmethod
+    def make_key(api, request):
+        """
+        Make the key of the request.
+        :param api: {string} The api of elasticsearch. 'count', 'search'
+        :param request: {dict} The arguments of the request.
+        :return: {string}
+        """
+        return json.dumps([api, request], sort_keys=True, default=bulk._json_default)
+
+    def get_generation(self, index):
+        """
+        Get the generation of the index. Get it before requesting, and set the result with it.
+        :param index: {string}
+        :return: {int}
+        """
+        return self.__generations.get(index, 0)
+
+    def get(self, key):
+        """
+        Get the result.
+        :param key: {string}
+        :return: {tuple or None} ({object}value, {bool}is stale)
+        """
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                created_at, index, generation, value = entry
+                age = time.time() - created_at
+                if generation == self.__generations.get(index, 0) and age < self.timeout + self.stale_timeout:
+                    self.__entries.move_to_end(key)
+                    self.__hits += 1
+                    return copy.deepcopy(value), age >= self.timeout
+                del self.__entries[key]
+            self.__misses += 1
+            return None
+
+    def set(self, key, index, generation, value):
+        """
+        Set the result.
+        :param key: {string}
+        :param index: {string} The index name of the request.
+        :param generation: {int} The generation of the index before requesting.
+        :param value: The result.
+        """
+        with self.__lock:
+            if generation != self.__generations.get(index, 0):
+                # the index was changed during the request
+                return
+            self.__entries[key] = (time.time(), index, generation, copy.deepcopy(value))
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+                self.__evictions += 1
+
+    def invalidate(self, index):
+        """
+        Drop results of the index.
+        :param index: {string}
+        """
+        with self.__lock:
+            self.__generations[index] = self.__generations.get(index, 0) + 1
+
+    def begin_revalidation(self, key):
+        """
+        Mark the stale result is revalidating.
+        :param key: {string}
+        :return: {bool} False: it is revalidating by another caller.
+        """
+        with self.__lock:
+            if key in self.__revalidating:
+                return False
+            self.__revalidating.add(key)
+            return True
+
+    def end_revalidation(self, key):
+        with self.__lock:
+            self.__revalidating.discard(key)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+            self.__hits = self.__misses = self.__evictions = 0
+
+    def stats(self):
+        """
+        Get metrics of the cache.
+        :return: {dict} {'hits': {int}, 'misses': {int}, 'evictions': {int}, 'hit_ratio': {float}, 'size': {int}}
+        """
+        with self.__lock:
+            total = self.__hits + self.__misses
+            return {
+                'hits': self.__hits,
+                'misses': self.__misses,
+                'evictions': self.__evictions,
+                'hit_ratio': self.__hits / total if total else 0.0,
+                'size': len(self.__entries),
+            }
+
+
+def get_document_cache():
+    """
+    Get the document cache of settings.TINA_DOCUMENT_CACHE.
+    TINA_DOCUMENT_CACHE = {
+        'BACKEND': 'tina.cache.LocMemDocumentCache',
+        'OPTIONS': {'max_size': 10000, 'timeout': 300},
+    }
+    :return: {LocMemDocumentCache}
+    """
+    global _document_cache
+    if _document_cache is None:
+        with _document_cache_lock:
+            if _document_cache is None:
+                from django.utils.module_loading import import_string
+
+                config = getattr(settings, 'TINA_DOCUMENT_CACHE', {})
+                backend_class = import_string(config.get('BACKEND', 'tina.cache.LocMemDocumentCache'))
+                _document_cache = backend_class(**config.get('OPTIONS', {}))
+    return _document_cache
+
+def reset_document_cache():
+    """
+    Drop the document cache. The next get_document_cache() call creates a new one.
+    """
+    global _document_cache
+    with _document_cache_lock:
+        _document_cache = None
+
+def get_aggregation_cache():
+    """
+    Get the aggregation cache of settings.TINA_AGGREGATION_CACHE.
+    TINA_AGGREGATION_CACHE = {'max_size': 1000, 'timeout': 60, 'stale_timeout': 0}
+    :return: {AggregationCache}
+    """
+    global _aggregation_cache
+    if _aggregation_cache is None:
+        with _aggregation_cache_lock:
+            if _aggregation_cache is None:
+                _aggregation_cache = AggregationCache(**getattr(settings, 'TINA_AGGREGATION_CACHE', {}))
+    return _aggregation_cache
+
+def reset_aggregation_cache():
+    """
+    Drop the aggregation cache. The next get_aggregation_cache() call creates a new one.
+    """
+    global _aggregation_cache
+    with _aggregation_cache_lock:
+        _aggregation_cache = None
+
+def invalidate_aggregations(index):
+    """
+    Drop cached aggregation results of the index after writing to it.
+    :param index: {string}
+    """
+    if _aggregation_cache is not None:
+        _aggregation_cache.invalidate(index)
+
+def get_cached_result(api, request, load):
+    """
+    Get the aggregation result through the aggregation cache.
+    :param api: {string} The api of elasticsearch. 'count', 'search'
+    :param request: {dict} The arguments of the request.
+    :param load: {function} (request) -> result. It sends the request and gets the result.
+    :return: The result.
+    """
+    aggregation_cache = get_aggregation_cache()
+    key = aggregation_cache.make_key(api, request)
+    entry = aggregation_cache.get(key)
+    if entry is not None:
+        value, is_stale = entry
+        if is_stale and aggregation_cache.begin_revalidation(key):
+            threading.Thread(
+                target=_revalidate,
+                args=(aggregation_cache, key, request, load),
+                daemon=True,
+            ).start()
+        return value
+
+    generation = aggregation_cache.get_generation(request['index'])
+    value = load(request)
+    aggregation_cache.set(key, request['index'], generation, value)
+    return value
+
+async def async_get_cached_result(api, request, load):
+    """
+    Get the aggregation result through the aggregation cache with asyncio.
+    :param api: {string} The api of elasticsearch. 'count', 'search'
+    :param request: {dict} The arguments of the request.
+    :param load: {coroutine function} (request) -> result. It sends the request and gets the result.
+    :return: The result.
+    """
+    import asyncio
+
+    aggregation_cache = get_aggregation_cache()
+    key = aggregation_cache.make_key(api, request)
+    entry = aggregation_cache.get(key)
+    if entry is not None:
+        value, is_stale = entry
+        if is_stale and aggregation_cache.begin_revalidation(key):
+            asyncio.ensure_future(_async_revalidate(aggregation_cache, key, request, load))
+        return value
+
+    generation = aggregation_cache.get_generation(request['index'])
+    value = await load(request)
+    aggregation_cache.set(key, request['index'], generation, value)
+    return value
+
+def _revalidate(aggregation_cache, key, request, load):
+    try:
+        generation = aggregation_cache.get_generation(request['index'])
+        aggregation_cache.set(key, request['index'], generation, load(request))
+    except Exception:
+        logging.exception('Revalidating the aggregation result failed.')
+    finally:
+        aggregation_cache.end_revalidation(key)
+
+async def _async_revalidate(aggregation_cache, key, request, load):
+    try:
+        generation = aggregation_cache.get_generation(request['index'])
+        aggregation_cache.set(key, request['index'], generation, await load(request))
+    except Exception:
+        logging.exception('Revalidating the aggregation result failed.')
+    finally:
+        aggregation_cache.end_revalidation(key)
+
+def is_cached(document_class):
+    """
+    Is the document class cached? Set `_cache = True` on the document class to enable it.
+    :param document_class: {type}
+    :return: {bool}
+    """
+    return getattr(document_class, '_cache', False)
+
+def get_hit(document_class, document_id):
+    """
+    Get the cached document as a hit of mget.
+    :param document_class: {type}
+    :param document_id: {string}
+    :return: {dict or None} {'_id': {string}, '_version': {int}, '_source': {dict}}
+    """
+    entry = get_document_cache().get(_get_key(document_class, document_id))
+    if entry is None or entry[1] is None:
+        return None
+    return {
+        '_id': document_id,
+        '_version': entry[0],
+        '_source': json.loads(entry[1]),
+    }
+
+def put_hit(document_class, hit):
+    """
+    Put the hit of get or mget into the cache. Call it before building the document, it changes `_source`.
+    :param document_class: {type}
+    :param hit: {dict} {'_id': {string}, '_version': {int}, '_source': {dict}}
+    """
+    get_document_cache().set(_get_key(document_class, hit['_id']), hit.get('_version'), bulk.dumps(hit['_source']))
+
+def invalidate(document_class, document_id, version=None):
+    """
+    Invalidate the cached document after saving or deleting.
+    :param document_class: {type}
+    :param document_id: {string}
+    :param version: {int} The version after saving or deleting. The older version can't be cached again.
+    """
+    key = _get_key(document_class, document_id)
+    if version is None:
+        get_document_cache().delete(key)
+    else:
+        get_document_cache().set(key, version, None)
+
+def invalidate_class(document_class):
+    """
+    Invalidate cached documents of the class after changing documents on the server. (delete_by_query)
+    Entries of other classes and metrics of the cache are kept.
+    :param document_class: {type}
+    """
+    if is_cached(document_class):
+        get_document_cache().delete_prefix(_get_key(document_class, ''))
+
+def _get_key(document_class, document_id):
+    return '%s/%s/%s' % (document_class.get_index_name(), document_class.__name__, document_id)
@@ -1,3 +1,4 @@
 from .document import Document
 from .properties import Property, StringProperty, IntegerProperty, FloatProperty,\
     BooleanProperty, DateTimeProperty, ListProperty, DictProperty, ReferenceProperty
+from .multi_query import multi_query, amulti_query
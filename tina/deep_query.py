@@ -1,43 +1,184 @@
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
 from .properties import ReferenceProperty
+from .exceptions import PropertyNotExist
+from .identity_map import get_identity_map, use_identity_map
+from .instrumentation import Operation, get_request_summary, use_request_summary
 
 
-def update_reference_properties(documents):
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def update_reference_properties(documents, prefetch=None, fetch_reference=True):
     """
     Update documents for reference property.
+    References are resolved breadth-first, documents of each level are fetched with one mget per class.
+    Different classes of the same level are fetched at the same time.
     :param documents: {list} [{Document}]
+    :param prefetch: {list} The reference paths. ['account', 'account.company']
+    :param fetch_reference: {bool} Resolve all reference properties of documents.
+        False: only resolve the prefetch paths.
     :return:
     """
     if not len(documents):
         return
+    level = [(documents, build_prefetch_tree(documents[0].__class__, prefetch, fetch_reference))]
+    with Operation('update_reference_properties', documents[0].__class__, round_trip=False) as operation:
+        operation.hits = 0
+        while level:
+            data_table, reference_properties = _scan_reference_ids(level)
+            if not data_table:
+                break
+
+            # fetch documents
+            identity_map = get_identity_map()
+            request_summary = get_request_summary()
+            def fetch(document_class):
+                with use_identity_map(identity_map), use_request_summary(request_summary):
+                    return document_class.get(list(data_table[document_class].keys()), fetch_reference=False)
+            document_classes = list(data_table.keys())
+            if len(document_classes) > 1:
+                results = _get_executor().map(fetch, document_classes)
+            else:
+                results = map(fetch, document_classes)
+            for document_class, reference_documents in zip(document_classes, results):
+                operation.hits += len(reference_documents)
+                for reference_document in reference_documents:
+                    data_table[document_class][reference_document._id] = reference_document
+
+            level = _set_reference_documents(level, data_table, reference_properties)
+
+async def async_update_reference_properties(documents, prefetch=None, fetch_reference=True):
+    """
+    Update documents for reference property with asyncio.
+    All reference classes of each level are fetched at the same time.
+    :param documents: {list} [{Document}]
+    :param prefetch: {list} The reference paths. ['account', 'account.company']
+    :param fetch_reference: {bool} Resolve all reference properties of documents.
+        False: only resolve the prefetch paths.
+    :return:
+    """
+    if not len(documents):
+        return
+    level = [(documents, build_prefetch_tree(documents[0].__class__, prefetch, fetch_reference))]
+    with Operation('update_reference_properties', documents[0].__class__, round_trip=False) as operation:
+        operation.hits = 0
+        while level:
+            data_table, reference_properties = _scan_reference_ids(level)
+            if not data_table:
+                break
+
+            # fetch documents
+            document_classes = list(data_table.keys())
+            results = await asyncio.gather(*[
+                x.aget(list(data_table[x].keys()), fetch_reference=False) for x in document_classes
+            ])
+            for document_class, reference_documents in zip(document_classes, results):
+                operation.hits += len(reference_documents)
+                for reference_document in reference_documents:
+                    data_table[document_class][reference_document._id] = reference_document
+
+            level = _set_reference_documents(level, data_table, reference_properties)
+
+def build_prefetch_tree(document_class, prefetch=None, fetch_reference=True):
+    """
+    Build the tree of reference paths.
+    :param document_class: {type} The document class.
+    :param prefetch: {list} The reference paths. ['account', 'account.company']
+    :param fetch_reference: {bool} Include all reference properties of the document class.
+    :return: {dict} {'account': {'company': {}}}
+    """
+    tree = {}
+    if fetch_reference:
+        for property_name, property in document_class.get_properties().items():
+            if isinstance(property, ReferenceProperty):
+                tree[property_name] = {}
+    for path in prefetch or []:
+        node = tree
+        reference_class = document_class
+        for property_name in path.split('.'):
+            property = reference_class.get_properties().get(property_name)
+            if not isinstance(property, ReferenceProperty):
+                raise PropertyNotExist('%s is not a reference property of %s' % (path, reference_class.__name__))
+            node = node.setdefault(property_name, {})
+            reference_class = property.reference_class
+    return tree
+
+def _get_executor():
+    """
+    Get the thread pool which fetches reference classes at the same time.
+    :return: {ThreadPoolExecutor}
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(getattr(settings, 'TINA_PREFETCH_MAX_WORKERS', 4))
+    return _executor
+
+def reset_executor():
+    """
+    Drop the thread pool without waiting for it. The next _get_executor() call creates a new one.
+    Call it in a forked child process, threads of the parent don't exist in the child.
+    """
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+def _scan_reference_ids(level):
+    """
+    Scan what documents should be fetched for reference properties.
+    :param level: {list} [({list}[{Document}], {dict}prefetch tree)]
+    :returns: {tuple} ({dict}, {list})
+        {document_class: {document_id: None}}
+        [{list}[{ReferenceProperty}]] Reference properties of each item of the level.
+    """
     data_table = {}  # {document_class: {document_id: {Document}}}
-    reference_properties = []  # all reference properties in this Document
-
-    # scan what kind of documents should be fetched
-    for property_name, property in documents[0]._properties.items():
-        if not isinstance(property, ReferenceProperty):
-            continue
-        if property.reference_class not in data_table:
-            data_table[property.reference_class] = {}
-        reference_properties.append(property)
-
-    # scan what id of documents should be fetched
-    for document in documents:
-        for property in reference_properties:  # loop all reference properties in the document
-            document_id = getattr(document, property.name)
-            if document_id:
-                data_table[property.reference_class][document_id] = None
-
-    # fetch documents
-    for document_class, items in data_table.items():
-        for reference_document in document_class.get(list(items.keys()), fetch_reference=False):
-            data_table[document_class][reference_document._id] = reference_document
-
-    # update reference properties of documents
-    for document in documents:
-        for property in reference_properties:  # loop all reference properties in the document
-            reference_document = data_table[property.reference_class].get(getattr(document, property.name))
-            if property.required and reference_document is None:
-                logging.warning("There are a reference class can't mapping")
+    reference_properties = []  # reference properties of each item of the level
+
+    for documents, tree in level:
+        # scan what kind of documents should be fetched
+        properties = []
+        for property_name, property in documents[0]._properties.items():
+            if property_name not in tree or not isinstance(property, ReferenceProperty):
                 continue
-            setattr(document, property.name, reference_document)
+            if property.reference_class not in data_table:
+                data_table[property.reference_class] = {}
+            properties.append(property)
+        reference_properties.append(properties)
+
+        # scan what id of documents should be fetched
+        for document in documents:
+            for property in properties:  # loop reference properties in the document
+                document_id = document._document.get(property.name)
+                if document_id:
+                    data_table[property.reference_class][document_id] = None
+    return data_table, reference_properties
+
+def _set_reference_documents(level, data_table, reference_properties):
+    """
+    Update reference properties of documents with fetched documents.
+    :param level: {list} [({list}[{Document}], {dict}prefetch tree)]
+    :param data_table: {dict} {document_class: {document_id: {Document}}}
+    :param reference_properties: {list} [{list}[{ReferenceProperty}]]
+    :return: {list} The next level. [({list}[{Document}], {dict}prefetch tree)]
+    """
+    next_level = []
+    for (documents, tree), properties in zip(level, reference_properties):
+        for property in properties:
+            reference_documents = {}  # {document_id: {Document}}
+            for document in documents:
+                reference_document = data_table[property.reference_class].get(document._document.get(property.name))
+                if property.required and reference_document is None:
+                    logging.warning("There are a reference class can't mapping")
+                    continue
+                setattr(document, property.name, reference_document)
+                if reference_document is not None:
+                    reference_documents[reference_document._id] = reference_document
+            if tree[property.name] and reference_documents:
+                next_level.append((list(reference_documents.values()), tree[property.name]))
+    return next_level
@@ -1,14 +1,41 @@
+import copy
 import time
 from datetime import datetime
-from . import utils
+from . import utils, bulk
 from .query import Query
 from .properties import Property, BooleanProperty, IntegerProperty, FloatProperty,\
-    DateTimeProperty, StringProperty, ReferenceProperty, ListProperty
-from .exceptions import NotFoundError, TransportError
-from .deep_query import update_reference_properties
+    DateTimeProperty, StringProperty, ReferenceProperty, ListProperty, SUBSTRING_ANALYZER, SUBSTRING_FIELD,\
+    SUBSTRING_GRAM
+from .exceptions import NotFoundError, TransportError, PropertyNotExist, PartialDocumentError, BadValueError
+from .deep_query import update_reference_properties, async_update_reference_properties
+from .identity_map import get_identity_map, load_document
+from .instrumentation import Operation
+from . import cache, ingest, migration
 
 
-class Document(object):
+class DocumentMetaclass(type):
+    """
+    Build the schema of the document class once when the class is defined.
+    Subclasses get their own schema.
+    """
+    def __init__(cls, name, bases, attributes):
+        super(DocumentMetaclass, cls).__init__(name, bases, attributes)
+        properties = {}
+        for attribute_name in dir(cls):
+            if attribute_name.startswith('__'):
+                continue
+            attribute = getattr(cls, attribute_name)
+            if isinstance(attribute, Property):
+                properties[attribute_name] = attribute
+                attribute.__property_config__(cls, attribute_name)
+        cls._properties = properties
+        cls._property_defaults = {x: y.default for x, y in properties.items()}
+        if '_index_name' not in attributes:
+            # don't inherit the index name of the super class
+            cls._index_name = None
+
+
+class Document(object, metaclass=DocumentMetaclass):
     """
     :attribute _index: {string} You can set index name by this attribute.
     :attribute _settings: {dict} You can set index settings by this attribute.
@@ -16,7 +43,12 @@ class Document(object):
     :attribute _version: {int}
     :attribute _document: {dict} {'property_name': (value)}
     :attribute _reference_document: {dict} {'property_name': {Document}}
+    :attribute _decoded_document: {dict} {'property_name': (python value)} The cache of memoized properties.
+    :attribute _partial: {bool} The document is fetched with `only` or `exclude`. It can't be saved.
+    :attribute _dirty: {set} {'property_name'} Properties which are changed after loading or saving.
+        Lists and dicts are dirty when they are read, they can be changed in place.
     :attribute _properties: {dict} {'property_name': {Property}}
+    :attribute _property_defaults: {dict} {'property_name': (default value)}
     :attribute _es: {Elasticsearch}
     :attribute _index_name: {string}
     """
@@ -24,52 +56,98 @@ class Document(object):
     _version = IntegerProperty()
     _es = utils.get_elasticsearch()
 
-    def __new__(cls, *args, **kwargs):
-        cls._properties = cls.__get_properties()
-        cls._properties_in = cls  # memo cls._properties from which class
-        return object.__new__(cls, *args)
-
     def __init__(self, **kwargs):
         super(Document, self).__init__()
         self._document = {}
         self._reference_document = {}
-        for property_name, property in self._properties.items():
-            if property_name in kwargs.keys():
-                setattr(self, property_name, kwargs[property_name])
-            else:
-                setattr(self, property_name, property.default)
+        self._decoded_document = {}
+        self._partial = False
+        self._dirty = set()
+        for property_name, default in self._property_defaults.items():
+            setattr(self, property_name, kwargs.get(property_name, default))
+
+    def __reduce__(self):
+        """
+        Pickle stored values of the document, `export()` sends documents from worker processes.
+        Decoded values are a cache, they aren't pickled.
+        """
+        return _restore_document, (
+            self.__class__, self._document, self._partial,
+            self._reference_document or None, self._dirty or None,
+        )
 
     @classmethod
-    def __get_properties(cls):
+    def _from_storage(cls, hit, partial=False):
         """
-        Get properties of this class.
-        :return: {dict} {'property_name': {Property}}
+        Build the document from elasticsearch data.
+        The `_source` is already in json format, so it is adopted as `_document` without converting values.
+        Don't reuse the `_source` dict after calling this method.
+        :param hit: {dict} The hit of search, get or mget.
+            {
+                _id: {string},
+                _version: {int},
+                _source: {dict},
+            }
+        :param partial: {bool} The `_source` is filtered. Properties which aren't loaded are left unset.
+        :return: {Document}
         """
-        properties = {}
-        for attribute_name in dir(cls):
-            if attribute_name.startswith('__'):
+        document = cls.__new__(cls)
+        source = hit['_source'] if not partial else hit.get('_source') or {}
+        source['_id'] = hit['_id']
+        source['_version'] = hit.get('_version')
+        document._document = source
+        document._reference_document = {}
+        document._decoded_document = {}
+        document._partial = partial
+        document._dirty = set()
+        properties = cls._properties
+        if source.keys() != properties.keys():
+            for property_name in source.keys() - properties.keys():
+                # the field isn't a property of this class
+                del source[property_name]
+            if not partial:
+                for property_name in properties.keys() - source.keys():
+                    setattr(document, property_name, cls._property_defaults[property_name])
+                document._dirty.clear()
+        return document
+
+    @classmethod
+    def _get_source_filter(cls, only=None, exclude=None):
+        """
+        Get the `_source` filtering of properties.
+        https://www.elastic.co/guide/en/elasticsearch/reference/current/search-request-source-filtering.html
+        :param only: {list} Only fetch these properties.
+        :param exclude: {list} Don't fetch these properties.
+        :return: {dict or None} {'include': [], 'exclude': []} None: fetch the whole document.
+        """
+        if not only and not exclude:
+            return None
+        result = {}
+        for key, members in (('include', only), ('exclude', exclude)):
+            if not members:
                 continue
-            attribute = getattr(cls, attribute_name)
-            if isinstance(attribute, Property):
-                properties[attribute_name] = attribute
-                attribute.__property_config__(cls, attribute_name)
-        return properties
+            for member in members:
+                if member.split('.', 1)[0] not in cls._properties:
+                    raise PropertyNotExist('%s not in %s' % (member, cls.__name__))
+            result[key] = list(members)
+        return result
 
     @classmethod
     def get_properties(cls):
         """
-        Some time the class didn't call initial function but need get properties list.
+        Get properties of this class.
         :return: {dict} {'property_name': {Property}}
         """
-        if not hasattr(cls, '_properties_in') or not cls is cls._properties_in\
-                or not hasattr(cls, '_properties'):
-            cls._properties = cls.__get_properties()
-            cls._properties_in = cls
         return cls._properties
 
     @classmethod
     def get_index_name(cls):
-        if not hasattr(cls, '_index_name') or not cls._index_name:
+        """
+        Get the index name. It is the alias of the versioned index after `migrate()`,
+        elasticsearch resolves requests through the alias.
+        :return: {string}
+        """
+        if not cls._index_name:
             if hasattr(cls, '_index') and cls._index:
                 cls._index_name = '%s%s' % (utils.get_index_prefix(), cls._index)
             else:
@@ -78,57 +156,276 @@ class Document(object):
 
     @classmethod
     def get_index_settings(cls):
-        if not hasattr(cls, '_settings') or not cls._settings:
-            return None
-        return cls._settings
+        settings = getattr(cls, '_settings', None) or None
+        if any(isinstance(x, StringProperty) and x.substring_search for x in cls.get_properties().values()):
+            # the analyzer of substring search
+            settings = copy.deepcopy(settings or {})
+            analysis = settings.setdefault('analysis', {})
+            analysis.setdefault('tokenizer', {}).setdefault(SUBSTRING_ANALYZER, {
+                'type': 'nGram',
+                'min_gram': SUBSTRING_GRAM,
+                'max_gram': SUBSTRING_GRAM,
+            })
+            analysis.setdefault('analyzer', {}).setdefault(SUBSTRING_ANALYZER, {
+                'type': 'custom',
+                'tokenizer': SUBSTRING_ANALYZER,
+                'filter': ['lowercase'],
+            })
+        return settings
 
     @classmethod
-    def get(cls, ids, fetch_reference=True):
+    def get_index_mapping(cls):
+        """
+        Get the mapping of the document type from properties.
+        :return: {dict} {'properties': {}}
+        """
+        mapping = {}
+        for name, property in cls.get_properties().items():
+            if name in ['_id', '_version']:
+                continue
+            if property.mapping:
+                mapping[name] = {'properties': property.mapping}
+                continue
+
+            field = {}
+            if isinstance(property, StringProperty):
+                field['type'] = 'string'
+            elif isinstance(property, BooleanProperty):
+                field['type'] = 'boolean'
+            elif isinstance(property, IntegerProperty):
+                field['type'] = 'long'
+            elif isinstance(property, FloatProperty):
+                field['type'] = 'double'
+            elif isinstance(property, DateTimeProperty):
+                field['type'] = 'date'
+                field['format'] = 'dateOptionalTime'
+            elif isinstance(property, ReferenceProperty):
+                field['type'] = 'string'
+                field['analyzer'] = 'keyword'
+            elif isinstance(property, ListProperty):
+                if property.item_type is str:
+                    field['type'] = 'string'
+                elif property.item_type is bool:
+                    field['type'] = 'boolean'
+                elif property.item_type is int:
+                    field['type'] = 'long'
+                elif property.item_type is float:
+                    field['type'] = 'double'
+                elif property.item_type is datetime:
+                    field['type'] = 'date'
+                    field['format'] = 'dateOptionalTime'
+            if property.analyzer:
+                field['analyzer'] = property.analyzer
+            if isinstance(property, StringProperty) and property.substring_search:
+                field['fields'] = {
+                    SUBSTRING_FIELD: {
+                        'type': 'string',
+                        'analyzer': SUBSTRING_ANALYZER,
+                    },
+                }
+
+            if field:
+                mapping[name] = field
+        return {
+            'properties': mapping,
+        }
+
+    @classmethod
+    def get(cls, ids, fetch_reference=True, prefetch=None, only=None, exclude=None):
         """
         Get documents by ids.
+        Documents in the identity map of the current scope aren't fetched again.
         :param ids: {list or string} The documents' id.
+        :param fetch_reference: {bool} Fetch reference documents.
+        :param prefetch: {list} The reference paths which are resolved breadth-first. ['account', 'account.company']
+        :param only: {list} Only fetch these properties. The documents are partial.
+        :param exclude: {list} Don't fetch these properties. The documents are partial.
         :return: {list or Document}
         """
         if ids is None or ids == '':
             return None
         if isinstance(ids, list) and not len(ids):
             return []
+        source_filter = cls._get_source_filter(only, exclude)
         es = utils.get_elasticsearch()
         if isinstance(ids, list):
             # fetch documents
-            if not len(ids):
-                return []
-
-            response = es.mget(
-                index=cls.get_index_name(),
-                doc_type=cls.__name__,
-                body={
-                    'ids': list([x for x in set(ids) if x])
-                },
-            )
-            result_table = {x['_id']: x for x in response['docs'] if x['found']}
-            result = []
-            for document_id in ids:
-                document = result_table.get(document_id)
-                if document:
-                    result.append(cls(_id=document['_id'], _version=document['_version'], **document['_source']))
-            if fetch_reference:
-                update_reference_properties(result)
+            documents, missing_ids = cls.__lookup_documents(ids, source_filter)
+            if missing_ids:
+                request = cls.__mget_request(missing_ids, source_filter)
+                with Operation('mget', cls, request) as operation:
+                    response = es.mget(**request)
+                    operation.received(response)
+                    documents.update(cls.__build_mget_documents(missing_ids, response, source_filter))
+            result = [documents[x] for x in ids if documents.get(x)]
+            if fetch_reference or prefetch:
+                update_reference_properties(result, prefetch, fetch_reference)
             return result
 
         # fetch the document
-        try:
-            response = es.get(
-                index=cls.get_index_name(),
-                doc_type=cls.__name__,
-                id=ids,
-            )
-            result = cls(_id=response['_id'], _version=response['_version'], **response['_source'])
-            if fetch_reference:
-                update_reference_properties([result])
-            return result
-        except NotFoundError:
+        documents, missing_ids = cls.__lookup_documents([ids], source_filter)
+        if missing_ids:
+            request = cls.__get_request(ids, source_filter)
+            with Operation('get', cls, request) as operation:
+                try:
+                    response = es.get(**request)
+                except NotFoundError:
+                    response = {'_id': ids, 'found': False}
+                operation.received(response)
+                documents.update(cls.__build_mget_documents(missing_ids, {'docs': [response]}, source_filter))
+        result = documents[ids]
+        if result and (fetch_reference or prefetch):
+            update_reference_properties([result], prefetch, fetch_reference)
+        return result
+
+    @classmethod
+    async def aget(cls, ids, fetch_reference=True, prefetch=None, only=None, exclude=None):
+        """
+        Get documents by ids with asyncio.
+        Documents in the identity map of the current scope aren't fetched again.
+        :param ids: {list or string} The documents' id.
+        :param fetch_reference: {bool} Fetch reference documents.
+        :param prefetch: {list} The reference paths which are resolved breadth-first. ['account', 'account.company']
+        :param only: {list} Only fetch these properties. The documents are partial.
+        :param exclude: {list} Don't fetch these properties. The documents are partial.
+        :return: {list or Document}
+        """
+        if ids is None or ids == '':
             return None
+        if isinstance(ids, list) and not len(ids):
+            return []
+        source_filter = cls._get_source_filter(only, exclude)
+        es = utils.get_async_elasticsearch()
+        if isinstance(ids, list):
+            # fetch documents
+            documents, missing_ids = cls.__lookup_documents(ids, source_filter)
+            if missing_ids:
+                request = cls.__mget_request(missing_ids, source_filter)
+                with Operation('mget', cls, request) as operation:
+                    response = await es.mget(**request)
+                    operation.received(response)
+                    documents.update(cls.__build_mget_documents(missing_ids, response, source_filter))
+            result = [documents[x] for x in ids if documents.get(x)]
+            if fetch_reference or prefetch:
+                await async_update_reference_properties(result, prefetch, fetch_reference)
+            return result
+
+        # fetch the document
+        documents, missing_ids = cls.__lookup_documents([ids], source_filter)
+        if missing_ids:
+            request = cls.__get_request(ids, source_filter)
+            with Operation('get', cls, request) as operation:
+                try:
+                    response = await es.get(**request)
+                except NotFoundError:
+                    response = {'_id': ids, 'found': False}
+                operation.received(response)
+                documents.update(cls.__build_mget_documents(missing_ids, {'docs': [response]}, source_filter))
+        result = documents[ids]
+        if result and (fetch_reference or prefetch):
+            await async_update_reference_properties([result], prefetch, fetch_reference)
+        return result
+
+    @classmethod
+    def __lookup_documents(cls, ids, source_filter=None):
+        """
+        Look up documents in the identity map of the current scope and the document cache.
+        Partial documents are always fetched.
+        :param ids: {list} The documents' id.
+        :param source_filter: {dict or None} The `_source` filtering.
+        :returns: {tuple} ({dict}, {list})
+            {document_id: {Document or None}} The documents in the identity map or the cache. None is not found.
+            [document_id] The ids which should be fetched.
+        """
+        identity_map = get_identity_map()
+        if identity_map is None or source_filter:
+            documents, missing_ids = {}, list([x for x in set(ids) if x])
+        else:
+            documents, missing_ids = identity_map.lookup(cls, ids)
+        if missing_ids and cache.is_cached(cls) and not source_filter:
+            cached_ids = set()
+            for document_id in missing_ids:
+                hit = cache.get_hit(cls, document_id)
+                if hit is not None:
+                    documents[document_id] = load_document(cls, hit)
+                    cached_ids.add(document_id)
+            missing_ids = [x for x in missing_ids if x not in cached_ids]
+        return documents, missing_ids
+
+    @classmethod
+    def __get_request(cls, document_id, source_filter=None):
+        """
+        Get arguments of the get request.
+        :param document_id: {string} The document's id.
+        :param source_filter: {dict or None} The `_source` filtering.
+        :return: {dict}
+        """
+        result = {
+            'index': cls.get_index_name(),
+            'doc_type': cls.__name__,
+            'id': document_id,
+        }
+        if source_filter:
+            result.update(cls.__source_filter_params(source_filter))
+        return result
+
+    @classmethod
+    def __mget_request(cls, ids, source_filter=None):
+        """
+        Get arguments of the mget request.
+        :param ids: {list} The documents' id.
+        :param source_filter: {dict or None} The `_source` filtering.
+        :return: {dict}
+        """
+        result = {
+            'index': cls.get_index_name(),
+            'doc_type': cls.__name__,
+            'body': {
+                'ids': list([x for x in set(ids) if x])
+            },
+        }
+        if source_filter:
+            result.update(cls.__source_filter_params(source_filter))
+        return result
+
+    @staticmethod
+    def __source_filter_params(source_filter):
+        """
+        Convert the `_source` filtering to parameters of get and mget.
+        :param source_filter: {dict} {'include': [], 'exclude': []}
+        :return: {dict} {'_source_include': [], '_source_exclude': []}
+        """
+        return {'_source_%s' % key: value for key, value in source_filter.items()}
+
+    @classmethod
+    def __build_mget_documents(cls, ids, response, source_filter=None):
+        """
+        Build documents from the mget response and put them into the identity map of the current scope
+        and the document cache. Partial documents aren't put into them.
+        :param ids: {list} The documents' id.
+        :param response: {dict} The mget response.
+        :param source_filter: {dict or None} The `_source` filtering.
+        :return: {dict} {document_id: {Document or None}} None is not found.
+        """
+        if source_filter:
+            result_table = {x['_id']: x for x in response['docs'] if x.get('found')}
+            return {x: cls._from_storage(result_table[x], True) if x in result_table else None for x in ids}
+
+        identity_map = get_identity_map()
+        is_cached = cache.is_cached(cls)
+        result_table = {x['_id']: x for x in response['docs'] if x.get('found')}
+        result = {}
+        for document_id in ids:
+            hit = result_table.get(document_id)
+            if hit:
+                if is_cached:
+                    cache.put_hit(cls, hit)
+                result[document_id] = load_document(cls, hit)
+            else:
+                result[document_id] = None
+                if identity_map is not None:
+                    identity_map.add_not_found(cls, document_id)
+        return result
 
     @classmethod
     def exists(cls, id):
@@ -178,6 +475,7 @@ class Document(object):
         `<http://www.elasticsearch.org/guide/en/elasticsearch/reference/current/indices-refresh.html>`_
         """
         cls._es.indices.refresh(index=cls.get_index_name())
+        cache.invalidate_aggregations(cls.get_index_name())
 
     @classmethod
     def update_mapping(cls):
@@ -205,78 +503,275 @@ class Document(object):
             }, index=cls.get_index_name())
 
         # put mapping
-        mapping = {}
-        for name, property in cls.get_properties().items():
-            if name in ['_id', '_version']:
-                continue
-            if property.mapping:
-                mapping[name] = {'properties': property.mapping}
-                continue
-
-            field = {}
-            if isinstance(property, StringProperty):
-                field['type'] = 'string'
-            elif isinstance(property, BooleanProperty):
-                field['type'] = 'boolean'
-            elif isinstance(property, IntegerProperty):
-                field['type'] = 'long'
-            elif isinstance(property, FloatProperty):
-                field['type'] = 'double'
-            elif isinstance(property, DateTimeProperty):
-                field['type'] = 'date'
-                field['format'] = 'dateOptionalTime'
-            elif isinstance(property, ReferenceProperty):
-                field['type'] = 'string'
-                field['analyzer'] = 'keyword'
-            elif isinstance(property, ListProperty):
-                if property.item_type is str:
-                    field['type'] = 'string'
-                elif property.item_type is bool:
-                    field['type'] = 'boolean'
-                elif property.item_type is int:
-                    field['type'] = 'long'
-                elif property.item_type is float:
-                    field['type'] = 'double'
-                elif property.item_type is datetime:
-                    field['type'] = 'date'
-                    field['format'] = 'dateOptionalTime'
-            if property.analyzer:
-                field['analyzer'] = property.analyzer
-
-            if field:
-                mapping[name] = field
         cls._es.indices.put_mapping(
             cls.__name__,
-            {
-                'properties': mapping,
-            },
+            cls.get_index_mapping(),
             index=cls.get_index_name()
         )
 
         # open index
         cls._es.indices.open(index=cls.get_index_name())
 
-    def save(self, synchronized=False):
+    @classmethod
+    def migrate(cls, slices=1, chunk_size=500, scroll='5m', use_reindex=False, delete_old=False):
         """
-        Save the document.
+        Migrate settings and the mapping without downtime.
+        Documents are copied to the new versioned index, then the alias `get_index_name()` is swapped to it.
+        :param slices: {int} The number of parallel sliced scrolls. > 1 requires elasticsearch 5.0+.
+        :param chunk_size: {int} The number of documents of each scroll page and bulk request.
+        :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+        :param use_reindex: {bool} Copy documents with `_reindex` of elasticsearch 2.3+.
+        :param delete_old: {bool} Delete previous indices after swapping the alias.
+        :return: {dict} {'index': {string}, 'previous': {list}, 'documents': {int}, 'failures': {list}}
         """
-        if self._version is None:
-            self._version = 0
-        for property_name, property in self._properties.items():
-            if isinstance(property, DateTimeProperty) and property.auto_now and not getattr(self, property_name):
-                setattr(self, property_name, datetime.utcnow())
-        document = self._document.copy()
-        del document['_id']
-        del document['_version']
-        result = self._es.index(
-            index=self.get_index_name(),
-            doc_type=self.__class__.__name__,
-            id=self._id,
-            version=self._version,
-            body=document
+        return migration.migrate(cls, slices, chunk_size, scroll, use_reindex, delete_old)
+
+    @classmethod
+    def save_many(cls, documents, synchronized=False, chunk_size=500, max_chunk_bytes=10485760):
+        """
+        Save documents with the bulk api.
+        https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-bulk.html
+        The failed documents don't abort other documents. Documents which aren't changed are skipped.
+        :param documents: {list} [{Document}]
+        :param synchronized: {bool} Refresh the index after saving.
+        :param chunk_size: {int} The max number of documents in one request.
+        :param max_chunk_bytes: {int} The max size of one request body in bytes.
+        :returns: {list}
+            {list}[{dict}] The failed items.
+            {
+                document: {Document},
+                status: {int},
+                error: The error message from elasticsearch,
+            }
+        """
+        for document in documents:
+            if document._partial:
+                raise PartialDocumentError('%s %s is partial, it can\'t be saved' % (document.__class__.__name__, document._id))
+
+        index_names = set()
+        def generate_actions():
+            for document in documents:
+                if not document.is_changed():
+                    # the index is refreshed for synchronized saving like saved documents
+                    index_names.add(document.get_index_name())
+                    continue
+                body = document.__get_saving_body()
+                action = {
+                    '_index': document.get_index_name(),
+                    '_type': document.__class__.__name__,
+                    '_version': document._version,
+                }
+                if document._id:
+                    action['_id'] = document._id
+                yield document, [bulk.dumps({'index': action}), bulk.dumps(body)]
+
+        failures = []
+        for items, body, _ in bulk.generate_chunks(generate_actions(), chunk_size, max_chunk_bytes):
+            with Operation('bulk', cls, {'index': cls.get_index_name(), 'body': body}) as operation:
+                response = cls._es.bulk(body=body)
+                operation.received(response, len(items))
+            for document, result, failure in bulk.parse_response(items, response):
+                if failure:
+                    failures.append(failure)
+                    continue
+                document._id = result.get('_id')
+                document._version = result.get('_version')
+                index_names.add(document.get_index_name())
+                document.__after_saving()
+        if synchronized:
+            for index_name in index_names:
+                cls._es.indices.refresh(index=index_name)
+        return failures
+
+    @classmethod
+    def delete_many(cls, documents, synchronized=False, chunk_size=500, max_chunk_bytes=10485760):
+        """
+        Delete documents with the bulk api.
+        The failed documents don't abort other documents.
+        :param documents: {list} [{Document} or {string}] The documents or documents' id.
+        :param synchronized: {bool} Refresh the index after deleting.
+        :param chunk_size: {int} The max number of documents in one request.
+        :param max_chunk_bytes: {int} The max size of one request body in bytes.
+        :returns: {list}
+            {list}[{dict}] The failed items.
+            {
+                document: {Document or string},
+                status: {int},
+                error: The error message from elasticsearch,
+            }
+        """
+        def generate_actions():
+            for document in documents:
+                if isinstance(document, Document):
+                    if not document._id:
+                        continue
+                    action = {
+                        '_index': document.get_index_name(),
+                        '_type': document.__class__.__name__,
+                        '_id': document._id,
+                    }
+                else:
+                    action = {
+                        '_index': cls.get_index_name(),
+                        '_type': cls.__name__,
+                        '_id': document,
+                    }
+                yield document, [bulk.dumps({'delete': action})]
+
+        failures = []
+        index_names = set()
+        for items, body, _ in bulk.generate_chunks(generate_actions(), chunk_size, max_chunk_bytes):
+            with Operation('bulk', cls, {'index': cls.get_index_name(), 'body': body}) as operation:
+                response = cls._es.bulk(body=body)
+                operation.received(response, len(items))
+            for document, result, failure in bulk.parse_response(items, response):
+                if failure:
+                    failures.append(failure)
+                    continue
+                index_names.add(result.get('_index'))
+                if isinstance(document, Document):
+                    document.__after_deleting(document._id, result.get('_version'))
+                else:
+                    cls.__after_deleting(document, result.get('_version'))
+        if synchronized:
+            for index_name in index_names:
+                cls._es.indices.refresh(index=index_name)
+        return failures
+
+    @classmethod
+    def ingest(cls, source, chunk_size=500, max_chunk_bytes=10485760, workers=4, max_pending=None, max_retries=5,
+               dead_letter=None, progress=None, progress_interval=5, format=None, synchronized=False):
+        """
+        Stream rows into the bulk api with concurrent requests.
+        Rows are validated by properties of the class. Invalid rows and failed items are written to the dead letter
+        output, and items rejected with 429 or 503 are retried with exponential backoff.
+        Documents aren't put into the identity map.
+        ```
+        stats = Order.ingest('orders.jsonl', workers=8, dead_letter='orders.rejected.jsonl')
+        ```
+        :param source: {iterable or string} Rows ({dict} or {Document}) or the path of the JSONL or CSV file.
+            The `_id` of rows is optional.
+        :param chunk_size: {int} The max number of documents in one request.
+        :param max_chunk_bytes: {int} The max size of one request body in bytes.
+        :param workers: {int} The number of threads which send bulk requests.
+        :param max_pending: {int} The max number of chunks in memory. Default is `workers * 2`.
+        :param max_retries: {int} Retry 429 and 503 x times.
+        :param dead_letter: {string or file or function} The output of rejected rows.
+            {string}: The path of the JSONL file.
+            {file}: Rejected rows are written as JSONL. {"row": {}, "status": 400, "error": ""}
+            {function}: (row, status, error)
+            None: Rejected rows are collected in `failures` of the result.
+        :param progress: {function} (tina.ingest.IngestStats) It is called every `progress_interval` seconds.
+            Default is logging docs/s and bytes/s to the `tina.ingest` logger.
+        :param progress_interval: {float} Seconds.
+        :param format: {string} 'jsonl' or 'csv' of the source file. Default is decided by the extension.
+        :param synchronized: {bool} Refresh the index after saving.
+        :return: {tina.ingest.IngestStats}
+        """
+        is_cached = cache.is_cached(cls)
+        def after_chunk(results):
+            if is_cached:
+                for result in results:
+                    cache.invalidate(cls, result.get('_id'), result.get('_version'))
+            cache.invalidate_aggregations(cls.get_index_name())
+        pipeline = ingest.IngestPipeline(
+            cls,
+            workers=workers,
+            max_pending=max_pending,
+            max_retries=max_retries,
+            dead_letter=dead_letter,
+            progress=progress,
+            progress_interval=progress_interval,
+            after_chunk=after_chunk,
         )
+
+        def generate_actions():
+            for row in ingest.read_rows(cls, source, pipeline.reject, format):
+                try:
+                    document = row if isinstance(row, Document) else cls(**row)
+                    body = document.__get_saving_body()
+                except (BadValueError, PartialDocumentError, ValueError, TypeError) as error:
+                    pipeline.reject(row, None, str(error))
+                    continue
+                action = {
+                    '_index': cls.get_index_name(),
+                    '_type': cls.__name__,
+                    '_version': document._version,
+                }
+                if document._id:
+                    action['_id'] = document._id
+                yield row, [bulk.dumps({'index': action}), bulk.dumps(body)]
+
+        stats = pipeline.run(generate_actions(), chunk_size, max_chunk_bytes)
+        if synchronized:
+            cls._es.indices.refresh(index=cls.get_index_name())
+        return stats
+
+    def get_dirty_fields(self):
+        """
+        Get properties which are changed after loading or saving.
+        Lists and dicts which are read are included, they can be changed in place.
+        :return: {list} ['property_name'] It doesn't include `_id` and `_version`.
+        """
+        return sorted(x for x in self._dirty if x not in ('_id', '_version'))
+
+    def is_changed(self):
+        """
+        Is the document new or changed after loading or saving?
+        :return: {bool}
+        """
+        return bool(self._dirty)
+
+    def save(self, synchronized=False):
+        """
+        Save the document. It doesn't send the request when the document isn't changed.
+        :param synchronized: {bool} Refresh the index after saving. It is refreshed even if the document isn't changed.
+        """
+        if not self._partial and not self.is_changed():
+            if synchronized:
+                self._es.indices.refresh(index=self.get_index_name())
+            return self
+        document = self.__get_saving_body()
+        request = {
+            'index': self.get_index_name(),
+            'doc_type': self.__class__.__name__,
+            'id': self._id,
+            'version': self._version,
+            'body': document,
+        }
+        with Operation('save', self.__class__, request) as operation:
+            result = self._es.index(**request)
+            operation.received(result)
         self._id = result.get('_id')
         self._version = result.get('_version')
+        self.__after_saving()
+        if synchronized:
+            self._es.indices.refresh(index=self.get_index_name())
+        return self
+
+    def update(self, fields=None, retry_on_conflict=0, synchronized=False):
+        """
+        Send changed properties with the update api instead of indexing the whole document.
+        https://www.elastic.co/guide/en/elasticsearch/reference/current/docs-update.html
+        Partial documents can be updated. The document without `_id` is saved.
+        :param fields: {list} The properties to send. Default is `get_dirty_fields()`.
+        :param retry_on_conflict: {int} Retry x times when the document is changed by others.
+            0: The request has the version of the document, it raises ConflictError when the version is changed.
+        :param synchronized: {bool} Refresh the index after updating. It is refreshed even if nothing is changed.
+        :return: {Document}
+        """
+        if not self._id:
+            return self.save(synchronized)
+        request = self.__get_update_request(fields, retry_on_conflict)
+        if request is None:
+            if synchronized:
+                self._es.indices.refresh(index=self.get_index_name())
+            return self
+        with Operation('update', self.__class__, request) as operation:
+            result = self._es.update(**request)
+            operation.received(result)
+        self._version = result.get('_version')
+        self.__after_saving(list(request['body']['doc'].keys()))
         if synchronized:
             self._es.indices.refresh(index=self.get_index_name())
         return self
@@ -288,11 +783,190 @@ class Document(object):
         if not self._id:
             return None
 
-        self._es.delete(
-            index=self.get_index_name(),
-            doc_type=self.__class__.__name__,
-            id=self._id,
-        )
+        request = {
+            'index': self.get_index_name(),
+            'doc_type': self.__class__.__name__,
+            'id': self._id,
+        }
+        with Operation('delete', self.__class__, request) as operation:
+            result = self._es.delete(**request)
+            operation.received(result)
+        self.__after_deleting(self._id, result.get('_version'))
         if synchronized:
             self._es.indices.refresh(index=self.get_index_name())
         return self
+
+    async def asave(self, synchronized=False):
+        """
+        Save the document with asyncio. It doesn't send the request when the document isn't changed.
+        :param synchronized: {bool} Refresh the index after saving. It is refreshed even if the document isn't changed.
+        """
+        es = utils.get_async_elasticsearch()
+        if not self._partial and not self.is_changed():
+            if synchronized:
+                await es.indices.refresh(index=self.get_index_name())
+            return self
+        document = self.__get_saving_body()
+        request = {
+            'index': self.get_index_name(),
+            'doc_type': self.__class__.__name__,
+            'id': self._id,
+            'version': self._version,
+            'body': document,
+        }
+        with Operation('save', self.__class__, request) as operation:
+            result = await es.index(**request)
+            operation.received(result)
+        self._id = result.get('_id')
+        self._version = result.get('_version')
+        self.__after_saving()
+        if synchronized:
+            await es.indices.refresh(index=self.get_index_name())
+        return self
+
+    async def aupdate(self, fields=None, retry_on_conflict=0, synchronized=False):
+        """
+        Send changed properties with the update api with asyncio.
+        :param fields: {list} The properties to send. Default is `get_dirty_fields()`.
+        :param retry_on_conflict: {int} Retry x times when the document is changed by others.
+        :param synchronized: {bool} Refresh the index after updating. It is refreshed even if nothing is changed.
+        :return: {Document}
+        """
+        if not self._id:
+            return await self.asave(synchronized)
+        es = utils.get_async_elasticsearch()
+        request = self.__get_update_request(fields, retry_on_conflict)
+        if request is None:
+            if synchronized:
+                await es.indices.refresh(index=self.get_index_name())
+            return self
+        with Operation('update', self.__class__, request) as operation:
+            result = await es.update(**request)
+            operation.received(result)
+        self._version = result.get('_version')
+        self.__after_saving(list(request['body']['doc'].keys()))
+        if synchronized:
+            await es.indices.refresh(index=self.get_index_name())
+        return self
+
+    async def adelete(self, synchronized=False):
+        """
+        Delete the document with asyncio.
+        """
+        if not self._id:
+            return None
+
+        es = utils.get_async_elasticsearch()
+        request = {
+            'index': self.get_index_name(),
+            'doc_type': self.__class__.__name__,
+            'id': self._id,
+        }
+        with Operation('delete', self.__class__, request) as operation:
+            result = await es.delete(**request)
+            operation.received(result)
+        self.__after_deleting(self._id, result.get('_version'))
+        if synchronized:
+            await es.indices.refresh(index=self.get_index_name())
+        return self
+
+    def __after_saving(self, fields=None):
+        """
+        Reset changes of saved properties, then update the identity map and the document cache.
+        :param fields: {list} The updated properties. None: the whole document is saved.
+        """
+        if fields is None:
+            self._dirty.clear()
+        else:
+            self._dirty.difference_update(fields)
+            self._dirty.discard('_version')
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            identity_map.add(self)
+        if cache.is_cached(self.__class__):
+            cache.invalidate(self.__class__, self._id, self._version)
+        cache.invalidate_aggregations(self.get_index_name())
+
+    @classmethod
+    def __after_deleting(cls, document_id, version=None):
+        """
+        Update the identity map and the document cache after deleting.
+        :param document_id: {string}
+        :param version: {int} The version of the delete operation.
+        """
+        identity_map = get_identity_map()
+        if identity_map is not None:
+            identity_map.add_not_found(cls, document_id)
+        if cache.is_cached(cls):
+            cache.invalidate(cls, document_id, version)
+        cache.invalidate_aggregations(cls.get_index_name())
+
+    def __get_saving_body(self):
+        """
+        Apply `auto_now` of properties and get the body for saving.
+        :return: {dict} The document without `_id` and `_version`.
+        """
+        if self._partial:
+            raise PartialDocumentError('%s %s is partial, it can\'t be saved' % (self.__class__.__name__, self._id))
+        if self._version is None:
+            self._version = 0
+        self.__apply_auto_now()
+        document = self._document.copy()
+        del document['_id']
+        del document['_version']
+        return document
+
+    def __get_update_request(self, fields=None, retry_on_conflict=0):
+        """
+        Apply `auto_now` of properties and get arguments of the update request.
+        :param fields: {list} The properties to send. None: changed properties.
+        :param retry_on_conflict: {int}
+        :return: {dict or None} None: there is nothing to update.
+        """
+        if fields is None:
+            if not self._partial:
+                self.__apply_auto_now()
+            fields = self.get_dirty_fields()
+        else:
+            for field in fields:
+                if field not in self._properties or field in ('_id', '_version'):
+                    raise PropertyNotExist('%s not in %s' % (field, self.__class__.__name__))
+                if field not in self._document:
+                    raise PartialDocumentError('%s of %s %s isn\'t loaded' % (field, self.__class__.__name__, self._id))
+        if not fields:
+            return None
+        result = {
+            'index': self.get_index_name(),
+            'doc_type': self.__class__.__name__,
+            'id': self._id,
+            'body': {
+                'doc': {x: self._document.get(x) for x in fields},
+            },
+        }
+        if retry_on_conflict:
+            # elasticsearch doesn't allow the version with retry_on_conflict
+            result['retry_on_conflict'] = retry_on_conflict
+        elif self._version:
+            result['version'] = self._version
+        return result
+
+    def __apply_auto_now(self):
+        """
+        Set `datetime.utcnow()` into empty properties which `auto_now` is True.
+        """
+        for property_name, property in self._properties.items():
+            if isinstance(property, DateTimeProperty) and property.auto_now and not getattr(self, property_name):
+                setattr(self, property_name, datetime.utcnow())
+
+
+def _restore_document(document_class, document, partial, reference_document, dirty):
+    """
+    Restore the pickled document. See `Document.__reduce__()`.
+    """
+    result = document_class.__new__(document_class)
+    result._document = document
+    result._reference_document = reference_document or {}
+    result._decoded_document = {}
+    result._partial = partial
+    result._dirty = dirty or set()
+    return result
@@ -15,6 +15,11 @@ class QuerySyntaxError(Exception):
     exception raised when tina query syntax error
     """
     pass
+class PartialDocumentError(Exception):
+    """
+    exception raised when saving the document which is fetched with `only` or `exclude`
+    """
+    pass
 ConflictError = exceptions.ConflictError
 NotFoundError = exceptions.NotFoundError
 ConnectionError = exceptions.ConnectionError
@@ -0,0 +1,155 @@
+import multiprocessing
+import queue
+from . import utils, bulk, deep_query
+
+
+# The queue of results from worker processes to the parent process. It is inherited by the pool initializer.
+_queue = None
+
+
+def export_hits(document_class, body, slices=1, workers=None, batch_size=1000, scroll='5m', transform=None):
+    """
+    Scan the index of the document class with sliced scrolls in worker processes.
+    Each batch of hits is transformed in the worker process, the results are sent to the parent process.
+    The order of batches isn't kept.
+    :param document_class: {type} The document class. Its index and the client `_es` are used.
+    :param body: {dict} The search body without `from`.
+    :param slices: {int} The number of sliced scrolls. > 1 requires elasticsearch 5.0+.
+    :param workers: {int} The number of processes. Default is the number of slices. 0: scan in this process.
+    :param batch_size: {int} The number of hits of each scroll request.
+    :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+    :param transform: {function} (hits) -> result. It runs in worker processes, so it should be picklable:
+        a module-level function or `functools.partial` of it. `build_documents` builds documents.
+        None: the batch of hits is the result.
+    :return: {generator} The results of batches.
+    """
+    tasks = [(document_class, body, x, slices, batch_size, scroll, transform, None) for x in range(slices)]
+    if workers == 0:
+        for task in tasks:
+            for hits in _scan(document_class._es, *task[:6]):
+                yield hits if transform is None else transform(hits)
+        return
+
+    results_queue = multiprocessing.Queue(maxsize=(workers or slices) * 2)
+    pool = multiprocessing.Pool(workers or slices, initializer=_init_worker, initargs=(results_queue,))
+    try:
+        result = pool.map_async(export_slice, tasks)
+        finished = 0
+        while finished < slices:
+            try:
+                message = results_queue.get(timeout=1)
+            except queue.Empty:
+                if result.ready() and not result.successful():
+                    # raise the error of the worker
+                    result.get()
+                continue
+            if message is None:
+                finished += 1
+            else:
+                yield message
+        result.get()
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def export_files(document_class, body, path, slices=1, workers=None, batch_size=1000, scroll='5m'):
+    """
+    Write hits of sliced scrolls into JSONL files in worker processes.
+    Each line is the source of the document with `_id`.
+    :param document_class: {type} The document class. Its index and the client `_es` are used.
+    :param body: {dict} The search body without `from`.
+    :param path: {string} The path of JSONL files. `{slice}` is replaced with the slice id. 'orders-{slice}.jsonl'
+    :param slices: {int} The number of sliced scrolls. > 1 requires elasticsearch 5.0+.
+    :param workers: {int} The number of processes. Default is the number of slices. 0: scan in this process.
+    :param batch_size: {int} The number of hits of each scroll request.
+    :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+    :return: {list} [{dict}] {'slice': {int}, 'path': {string}, 'documents': {int}}
+    """
+    if slices > 1 and '{slice}' not in path:
+        raise ValueError('The path of %s slices requires {slice}: %s' % (slices, path))
+    tasks = [(document_class, body, x, slices, batch_size, scroll, None, path.format(slice=x)) for x in range(slices)]
+    if workers == 0:
+        return [_write_slice(document_class._es, *x[:6], path=x[7]) for x in tasks]
+    pool = multiprocessing.Pool(workers or slices)
+    try:
+        result = pool.map(export_slice, tasks)
+        pool.close()
+        return result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def export_slice(task):
+    """
+    Export one slice in the worker process.
+    :param task: {tuple} (document class, body, slice id, slices, batch size, scroll, transform, path)
+        path: {string or None} None: results are sent to the parent process.
+    :return: {dict or None} The result of the file.
+    """
+    # don't reuse sockets and threads of the parent process
+    utils.reset_elasticsearch()
+    deep_query.reset_executor()
+    document_class, body, slice_id, slices, batch_size, scroll, transform, path = task
+    es = utils.copy_elasticsearch(document_class._es)
+    if path is not None:
+        return _write_slice(es, *task[:6], path=path)
+    try:
+        for hits in _scan(es, *task[:6]):
+            _queue.put(hits if transform is None else transform(hits))
+    finally:
+        _queue.put(None)
+
+def build_documents(document_class, hits, fetch_reference=False, prefetch=None):
+    """
+    Build documents of the batch. It is the transform of `export_hits()` for `Query.export()`.
+    :param document_class: {type} The document class.
+    :param hits: {list} The hits of the scroll.
+    :param fetch_reference: {bool} Fetch reference documents of the batch.
+    :param prefetch: {list} The reference paths. ['account', 'account.company']
+    :return: {list} [{Document}]
+    """
+    documents = [document_class._from_storage(x) for x in hits]
+    if fetch_reference or prefetch:
+        deep_query.update_reference_properties(documents, prefetch, fetch_reference)
+    return documents
+
+def _init_worker(results_queue):
+    global _queue
+    _queue = results_queue
+
+def _write_slice(es, document_class, body, slice_id, slices, batch_size, scroll, path):
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        for hits in _scan(es, document_class, body, slice_id, slices, batch_size, scroll):
+            for hit in hits:
+                # `_version` isn't written, ingest() would send it as the internal version of bulk actions
+                source = hit['_source']
+                source['_id'] = hit['_id']
+                f.write(bulk.dumps(source) + '\n')
+            count += len(hits)
+    return {
+        'slice': slice_id,
+        'path': path,
+        'documents': count,
+    }
+
+def _scan(es, document_class, body, slice_id, slices, batch_size, scroll):
+    """
+    Scan one slice.
+    :param es: {Elasticsearch} The client of this process.
+    :return: {generator} {list} [{dict}] The batches of hits.
+    """
+    body = dict(body, size=batch_size)
+    if slices > 1:
+        body['slice'] = {'id': slice_id, 'max': slices}
+    search_result = es.search(index=document_class.get_index_name(), body=body, scroll=scroll, version=True)
+    scroll_id = search_result.get('_scroll_id')
+    try:
+        while search_result['hits']['hits']:
+            yield search_result['hits']['hits']
+            search_result = es.scroll(scroll_id=scroll_id, scroll=scroll)
+            scroll_id = search_result.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            es.clear_scroll(scroll_id=scroll_id)
@@ -0,0 +1,139 @@
+from contextlib import contextmanager
+from .utils import ContextLocal
+
+
+_identity_map = ContextLocal('tina_identity_map')
+
+
+class IdentityMap(object):
+    """
+    The identity map of documents.
+    In the scope each `(document class, _id)` is fetched at most once.
+    `Document.get`, `Query.fetch` and reference properties return the same instance for the same document.
+    Documents which are not found are remembered too.
+    The scope is local to the thread and the asyncio task. The inner scope shares the map of the outer scope.
+    ```
+    with IdentityMap():
+        order = Order.get(order_id)
+        orders, total = Order.where('account', equal=order.account._id).fetch()
+    ```
+    :attribute documents: {dict} {(document_class, document_id): {Document or None}}
+    """
+    def __init__(self):
+        self.documents = {}
+        self.__outer = None
+
+    def __enter__(self):
+        self.__outer = get_identity_map()
+        if self.__outer is None:
+            _identity_map.set(self)
+            return self
+        return self.__outer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__outer is None:
+            _identity_map.set(None)
+            self.clear()
+        self.__outer = None
+
+    def lookup(self, document_class, ids):
+        """
+        Look up documents in the identity map.
+        :param document_class: {type} The document class.
+        :param ids: {list} The documents' id.
+        :returns: {tuple} ({dict}, {list})
+            {document_id: {Document or None}} The documents in the identity map. None is not found.
+            [document_id] The ids which should be fetched.
+        """
+        documents = {}
+        missing_ids = []
+        for document_id in ids:
+            if not document_id or document_id in documents:
+                continue
+            key = (document_class, document_id)
+            if key in self.documents:
+                documents[document_id] = self.documents[key]
+            elif document_id not in missing_ids:
+                missing_ids.append(document_id)
+        return documents, missing_ids
+
+    def load(self, document_class, hit):
+        """
+        Get the document of the hit. The hit isn't hydrated if the document is already in the identity map.
+        :param document_class: {type} The document class.
+        :param hit: {dict} The hit of search, get or mget.
+        :return: {Document}
+        """
+        document = self.documents.get((document_class, hit['_id']))
+        if document is None:
+            document = document_class._from_storage(hit)
+            self.documents[(document_class, document._id)] = document
+        return document
+
+    def add(self, document):
+        """
+        Put the document into the identity map.
+        :param document: {Document}
+        """
+        self.documents[(document.__class__, document._id)] = document
+
+    def add_not_found(self, document_class, document_id):
+        """
+        Remember the document isn't found, so it isn't fetched again.
+        :param document_class: {type} The document class.
+        :param document_id: {string}
+        """
+        self.documents[(document_class, document_id)] = None
+
+    def remove(self, document_class, document_id):
+        """
+        Remove the document from the identity map. It will be fetched again.
+        :param document_class: {type} The document class.
+        :param document_id: {string}
+        """
+        self.documents.pop((document_class, document_id), None)
+
+    def remove_class(self, document_class):
+        """
+        Remove all documents of the class from the identity map. They will be fetched again.
+        :param document_class: {type} The document class.
+        """
+        for key in [x for x in self.documents if x[0] is document_class]:
+            del self.documents[key]
+
+    def clear(self):
+        self.documents.clear()
+
+
+def get_identity_map():
+    """
+    Get the identity map of the current scope.
+    :return: {IdentityMap or None}
+    """
+    return _identity_map.get()
+
+@contextmanager
+def use_identity_map(identity_map):
+    """
+    Use the identity map in the current thread or asyncio task. It shares the scope with others.
+    The identity map isn't cleared when it exits.
+    :param identity_map: {IdentityMap or None}
+    """
+    previous = get_identity_map()
+    _identity_map.set(identity_map)
+    try:
+        yield identity_map
+    finally:
+        _identity_map.set(previous)
+
+def load_document(document_class, hit):
+    """
+    Build the document from elasticsearch data through the identity map of the current scope.
+    :param document_class: {type} The document class.
+    :param hit: {dict} The hit of search, get or mget.
+    :return: {Document}
+    """
+    identity_map = get_identity_map()
+    if identity_map is None:
+        return document_class._from_storage(hit)
+    return identity_map.load(document_class, hit)
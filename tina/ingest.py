@@ -0,0 +1,282 @@
+import csv
+import json
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import bulk
+from .properties import BooleanProperty, ListProperty, DictProperty
+from .exceptions import TransportError, ConnectionError
+from .instrumentation import Operation
+
+
+logger = logging.getLogger('tina.ingest')
+# The status codes of bulk requests and items which are retried.
+RETRY_STATUSES = (429, 503)
+
+
+class IngestStats(object):
+    """
+    The progress of `Document.ingest()`.
+    :attribute documents: {int} The number of saved documents.
+    :attribute failed: {int} The number of rejected rows.
+    :attribute bytes: {int} The size of bulk bodies which are accepted.
+    :attribute requests: {int} The number of bulk requests.
+    :attribute retries: {int} The number of retried bulk requests.
+    :attribute failures: {list} [{dict}] The rejected rows when there is no dead letter output.
+        {
+            row: The row of the source,
+            status: {int or None} The http status code. None: it is rejected by properties.
+            error: The error message,
+        }
+    """
+    def __init__(self):
+        self.documents = 0
+        self.failed = 0
+        self.bytes = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = []
+        self.started_at = time.time()
+        self.finished_at = None
+
+    @property
+    def elapsed(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    @property
+    def documents_per_second(self):
+        return self.documents / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return 'IngestStats(documents=%d, failed=%d, %.0f docs/s, %.0f bytes/s, requests=%d, retries=%d)' % (
+            self.documents, self.failed, self.documents_per_second, self.bytes_per_second, self.requests, self.retries,
+        )
+
+
+class IngestPipeline(object):
+    """
+    Send bulk chunks with a bounded pool of threads.
+    The producer waits when `max_pending` chunks are waiting or sending, so the memory is bounded.
+    Items which are rejected with 429 or 503 are retried with exponential backoff,
+    other failures are written to the dead letter output.
+    """
+    def __init__(self, document_class, workers=4, max_pending=None, max_retries=5, backoff=0.5, max_backoff=30,
+                 dead_letter=None, progress=None, progress_interval=5, after_chunk=None):
+        """
+        :param document_class: {type} The document class.
+        :param workers: {int} The number of threads which send bulk requests.
+        :param max_pending: {int} The max number of chunks in memory. Default is `workers * 2`.
+        :param max_retries: {int} Retry 429 and 503 x times.
+        :param backoff: {float} The first delay of retrying in seconds. It is doubled for each retry.
+        :param max_backoff: {float} The max delay of retrying in seconds.
+        :param dead_letter: {string or file or function} The output of rejected rows.
+            {string}: The path of the JSONL file.
+            {file}: Rejected rows are written as JSONL.
+            {function}: (row, status, error)
+            None: Rejected rows are collected in `IngestStats.failures`.
+        :param progress: {function} (IngestStats) It is called every `progress_interval` seconds and at the end.
+            Default is logging to `tina.ingest`.
+        :param progress_interval: {float} Seconds.
+        :param after_chunk: {function} ([{dict}]) It is called with results of saved items of each chunk.
+        """
+        self.document_class = document_class
+        self.workers = workers
+        self.max_pending = max_pending or workers * 2
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.progress = progress or _log_progress
+        self.progress_interval = progress_interval
+        self.after_chunk = after_chunk
+        self.stats = IngestStats()
+        self.__dead_letter = dead_letter
+        self.__dead_letter_file = None
+        self.__lock = threading.Lock()
+        self.__reported_at = time.time()
+
+    def run(self, actions, chunk_size=500, max_chunk_bytes=10485760):
+        """
+        Send actions.
+        :param actions: {iterable} [({object}row, {list}[{string}] bulk lines)]
+        :param chunk_size: {int} The max number of actions in one request.
+        :param max_chunk_bytes: {int} The max size of one request body in bytes.
+        :return: {IngestStats}
+        """
+        if isinstance(self.__dead_letter, str):
+            self.__dead_letter_file = open(self.__dead_letter, 'a', encoding='utf-8')
+        pending = threading.BoundedSemaphore(self.max_pending)
+        futures = []
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                # items of chunks are (row, bulk lines), failed items are sent again
+                chunks = bulk.generate_chunks(((x, x[1]) for x in actions), chunk_size, max_chunk_bytes)
+                for items, body, _ in chunks:
+                    # backpressure: wait for the sending chunk
+                    pending.acquire()
+                    future = executor.submit(self.__send, items, body)
+                    future.add_done_callback(lambda x: pending.release())
+                    futures.append(future)
+                    futures = [x for x in futures if not x.done() or x.exception()]
+                    for x in futures:
+                        if x.done():
+                            # stop at the unexpected error of the worker
+                            x.result()
+                    self.__report()
+            for future in futures:
+                future.result()
+        finally:
+            self.stats.finished_at = time.time()
+            if self.__dead_letter_file is not None:
+                self.__dead_letter_file.close()
+                self.__dead_letter_file = None
+        self.progress(self.stats)
+        return self.stats
+
+    def reject(self, row, status, error):
+        """
+        Write the row to the dead letter output.
+        :param row: The row of the source.
+        :param status: {int or None} The http status code. None: it is rejected before sending.
+        :param error: The error message.
+        """
+        with self.__lock:
+            self.stats.failed += 1
+            if self.__dead_letter is None:
+                self.stats.failures.append({'row': row, 'status': status, 'error': error})
+            elif callable(self.__dead_letter):
+                self.__dead_letter(row, status, error)
+            else:
+                output = self.__dead_letter_file or self.__dead_letter
+                output.write(bulk.dumps({'row': _serialize_row(row), 'status': status, 'error': error}) + '\n')
+
+    def __send(self, items, body):
+        """
+        Send the chunk and retry rejected items.
+        :param items: {list} [({object}row, {list}[{string}] bulk lines)]
+        :param body: {string} The bulk body.
+        """
+        es = self.document_class._es
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.__lock:
+                    self.stats.retries += 1
+                time.sleep(self.__get_delay(attempt))
+                body = '\n'.join(line for _, lines in items for line in lines) + '\n'
+            with self.__lock:
+                self.stats.requests += 1
+            try:
+                with Operation('bulk', self.document_class, {'body': body}) as operation:
+                    response = es.bulk(body=body)
+                    operation.received(response, len(items))
+            except TransportError as error:
+                status = error.status_code if isinstance(error.status_code, int) else None
+                if (status in RETRY_STATUSES or isinstance(error, ConnectionError)) and attempt < self.max_retries:
+                    continue
+                for row, _ in items:
+                    self.reject(row, status, str(error))
+                return
+
+            retry_items = []
+            saved = []
+            saved_bytes = 0
+            for item, result, failure in bulk.parse_response(items, response):
+                if failure is None:
+                    saved.append(result)
+                    saved_bytes += sum(len(x.encode('utf-8')) + 1 for x in item[1])
+                elif failure['status'] in RETRY_STATUSES and attempt < self.max_retries:
+                    retry_items.append(item)
+                else:
+                    self.reject(item[0], failure['status'], failure['error'])
+            with self.__lock:
+                self.stats.documents += len(saved)
+                self.stats.bytes += saved_bytes
+            if saved and self.after_chunk:
+                self.after_chunk(saved)
+            if not retry_items:
+                return
+            items = retry_items
+
+    def __get_delay(self, attempt):
+        """
+        The exponential backoff with jitter.
+        :param attempt: {int} 1, 2, 3...
+        :return: {float} Seconds.
+        """
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def __report(self):
+        now = time.time()
+        if now - self.__reported_at >= self.progress_interval:
+            self.__reported_at = now
+            self.progress(self.stats)
+
+
+def read_rows(document_class, source, reject, format=None):
+    """
+    Read rows from the source.
+    :param document_class: {type} The document class. CSV values are converted for its properties.
+    :param source: {iterable or string} Rows ({dict} or {Document}) or the path of the JSONL or CSV file.
+    :param reject: {function} (row, status, error) It is called for the invalid line.
+    :param format: {string} 'jsonl' or 'csv'. Default is decided by the extension of the path.
+    :return: {generator} The rows.
+    """
+    if not isinstance(source, str):
+        yield from source
+        return
+    if format is None:
+        format = 'csv' if source.lower().endswith('.csv') else 'jsonl'
+    with open(source, encoding='utf-8', newline='' if format == 'csv' else None) as f:
+        if format == 'csv':
+            for row in csv.DictReader(f):
+                try:
+                    yield _convert_csv_row(document_class, row)
+                except ValueError as error:
+                    reject(row, None, str(error))
+            return
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError as error:
+                reject(line.rstrip('\n'), None, str(error))
+
+def _convert_csv_row(document_class, row):
+    """
+    Convert CSV values which properties can't convert from strings.
+    Empty values are None, booleans are 'true', 'false', '1' or '0', lists and dicts are json.
+    :param document_class: {type}
+    :param row: {dict}
+    :return: {dict}
+    """
+    properties = document_class._properties
+    result = {}
+    for key, value in row.items():
+        if value == '':
+            value = None
+        elif isinstance(properties.get(key), BooleanProperty):
+            if value.lower() not in ('true', 'false', '1', '0'):
+                raise ValueError('%s should be boolean: %r' % (key, value))
+            value = value.lower() in ('true', '1')
+        elif isinstance(properties.get(key), (ListProperty, DictProperty)):
+            value = json.loads(value)
+        result[key] = value
+    return result
+
+def _serialize_row(row):
+    if hasattr(row, '_document'):
+        return row._document
+    return row
+
+def _log_progress(stats):
+    logger.info(
+        '%d documents, %d failed, %.0f docs/s, %.0f bytes/s',
+        stats.documents, stats.failed, stats.documents_per_second, stats.bytes_per_second,
+    )
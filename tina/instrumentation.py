@@ -0,0 +1,205 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.dispatch import Signal
+from . import bulk
+from .utils import ContextLocal
+
+
+_request_summary = ContextLocal('tina_request_summary')
+slow_query_logger = logging.getLogger('tina.slow_query')
+
+# Sent after each instrumented operation. The sender is the document class.
+# operation: {string} 'get', 'mget', 'save', 'delete', 'fetch', 'count', 'sum', 'group_by', 'aggregate', ...
+# document_class: {type}
+# index: {string}
+# body_size: {int} The size of the compiled body in bytes.
+# took: {int or None} The `took` of the response in milliseconds.
+# duration: {float} The client wall time in seconds, it includes hydration.
+# hydration_time: {float} Seconds of building documents (and references) from the response.
+# hits: {int or None} The number of returned hits.
+# round_trip: {bool} False: the operation doesn't send a request itself. (update_reference_properties)
+# error: {Exception or None}
+query_finished = Signal(providing_args=[
+    'operation', 'document_class', 'index', 'body_size', 'took', 'duration', 'hydration_time', 'hits',
+    'round_trip', 'error',
+])
+
+
+class Operation(object):
+    """
+    Measure one operation and send `query_finished` when it finishes.
+    ```
+    with Operation('fetch', Order, request) as operation:
+        response = es.search(**request)
+        operation.received(response)
+        documents = build_documents(response)
+    ```
+    """
+    def __init__(self, operation, document_class, request=None, round_trip=True):
+        """
+        :param operation: {string} The operation name.
+        :param document_class: {type} The document class.
+        :param request: {dict} The arguments of the elasticsearch request.
+        :param round_trip: {bool} Does the operation send a request to elasticsearch?
+        """
+        self.operation = operation
+        self.document_class = document_class
+        self.request = request or {}
+        self.round_trip = round_trip
+        self.took = None
+        self.hits = None
+        self.duration = 0.0
+        self.request_duration = 0.0
+        self.hydration_time = 0.0
+        self.error = None
+        self.__started_at = None
+        self.__received_at = None
+
+    def __enter__(self):
+        self.__started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finished_at = time.perf_counter()
+        self.duration = finished_at - self.__started_at
+        self.request_duration = self.duration
+        if self.__received_at is not None:
+            self.hydration_time = finished_at - self.__received_at
+            self.request_duration = self.__received_at - self.__started_at
+        self.error = exc_value
+        self.__finish()
+
+    def received(self, response=None, hits=None):
+        """
+        Mark the response is received. The rest of the operation is hydration.
+        :param response: {dict} The response of elasticsearch.
+        :param hits: {int} The number of hits. Default is the length of `hits.hits` or `docs` of the response.
+        """
+        self.__received_at = time.perf_counter()
+        if isinstance(response, dict):
+            self.took = response.get('took')
+            if hits is None:
+                if 'hits' in response:
+                    hits = len(response['hits'].get('hits', []))
+                elif 'docs' in response:
+                    hits = len([x for x in response['docs'] if x.get('found')])
+                elif 'found' in response:
+                    hits = 1 if response['found'] else 0
+        self.hits = hits
+
+    @property
+    def index(self):
+        return self.request.get('index') or self.document_class.get_index_name()
+
+    @property
+    def body_size(self):
+        body = self.request.get('body')
+        if body is None:
+            return 0
+        if isinstance(body, str):
+            return len(body.encode('utf-8'))
+        return len(bulk.dumps(body).encode('utf-8'))
+
+    def __finish(self):
+        summary = get_request_summary()
+        if summary is not None:
+            summary.add(self)
+        threshold = getattr(settings, 'TINA_SLOW_QUERY_THRESHOLD', None)
+        is_slow = threshold is not None and self.round_trip and self.duration >= threshold
+        if not is_slow and not query_finished.has_listeners():
+            return
+
+        index = self.index
+        body_size = self.body_size
+        if is_slow:
+            slow_query_logger.warning(
+                'Slow query: %s %s on %s took %.1f ms (server %s ms, hydration %.1f ms, %s hits, %d bytes): %s',
+                self.operation, self.document_class.__name__, index, self.duration * 1000, self.took,
+                self.hydration_time * 1000, self.hits, body_size, self.request.get('body'),
+            )
+        query_finished.send(
+            sender=self.document_class,
+            operation=self.operation,
+            document_class=self.document_class,
+            index=index,
+            body_size=body_size,
+            took=self.took,
+            duration=self.duration,
+            hydration_time=self.hydration_time,
+            hits=self.hits,
+            round_trip=self.round_trip,
+            error=self.error,
+        )
+
+
+class RequestSummary(object):
+    """
+    Collect round trips of tina in the scope.
+    The scope is local to the thread and the asyncio task. The inner scope shares the summary of the outer scope.
+    ```
+    with RequestSummary() as summary:
+        Order.where('state', equal='paid').fetch()
+    summary.round_trips, summary.duration
+    ```
+    :attribute round_trips: {int} The number of requests to elasticsearch.
+    :attribute duration: {float} The client wall time of requests in seconds.
+        Hydration isn't included, requests of reference documents during hydration are counted by themselves.
+    :attribute took: {int} The sum of `took` of responses in milliseconds.
+    :attribute operations: {dict} {'operation name': {int}count}
+    """
+    def __init__(self):
+        self.round_trips = 0
+        self.duration = 0.0
+        self.took = 0
+        self.operations = {}
+        self.__lock = threading.Lock()
+        self.__outer = None
+
+    def __enter__(self):
+        self.__outer = get_request_summary()
+        if self.__outer is None:
+            _request_summary.set(self)
+            return self
+        return self.__outer
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.__outer is None:
+            _request_summary.set(None)
+        self.__outer = None
+
+    def add(self, operation):
+        """
+        Record the finished operation.
+        :param operation: {Operation}
+        """
+        if not operation.round_trip:
+            return
+        with self.__lock:
+            self.round_trips += 1
+            self.duration += operation.request_duration
+            self.took += operation.took or 0
+            self.operations[operation.operation] = self.operations.get(operation.operation, 0) + 1
+
+
+def get_request_summary():
+    """
+    Get the request summary of the current scope.
+    :return: {RequestSummary or None}
+    """
+    return _request_summary.get()
+
+@contextmanager
+def use_request_summary(summary):
+    """
+    Use the request summary in other threads. The summary isn't closed at exit.
+    :param summary: {RequestSummary or None}
+    """
+    previous = get_request_summary()
+    _request_summary.set(summary)
+    try:
+        yield summary
+    finally:
+        _request_summary.set(previous)
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.module_loading import import_string
+
+
+class Command(BaseCommand):
+    """
+    Migrate indices of document classes without downtime.
+    Add 'tina' into INSTALLED_APPS to use it.
+    $ python manage.py tina_migrate app.models.Order app.models.Account --slices 4 --delete-old
+    """
+    help = 'Copy documents to new versioned indices and swap aliases.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_classes', nargs='+', help='The import paths of document classes.')
+        parser.add_argument('--slices', type=int, default=1, help='Parallel sliced scrolls (elasticsearch 5.0+).')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Documents of each scroll page and bulk.')
+        parser.add_argument('--scroll', default='5m', help='How long the scroll context is kept.')
+        parser.add_argument('--reindex', action='store_true', help='Use _reindex of elasticsearch 2.3+.')
+        parser.add_argument('--delete-old', action='store_true', help='Delete previous indices.')
+
+    def handle(self, *args, **options):
+        for path in options['document_classes']:
+            try:
+                document_class = import_string(path)
+            except ImportError as error:
+                raise CommandError(str(error))
+            result = document_class.migrate(
+                slices=options['slices'],
+                chunk_size=options['chunk_size'],
+                scroll=options['scroll'],
+                use_reindex=options['reindex'],
+                delete_old=options['delete_old'],
+            )
+            self.stdout.write('%s: %s -> %s, %d documents, %d failures' % (
+                path, ', '.join(result['previous']) or '(empty)', result['index'],
+                result['documents'], len(result['failures']),
+            ))
+            for failure in result['failures']:
+                self.stderr.write('  %s' % failure)
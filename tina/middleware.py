@@ -0,0 +1,77 @@
+from .identity_map import IdentityMap
+from .instrumentation import RequestSummary
+
+
+class IdentityMapMiddleware(object):
+    """
+    Open the identity map for each request. Documents are fetched at most once in the request.
+    It supports both `MIDDLEWARE` and `MIDDLEWARE_CLASSES` of Django.
+    MIDDLEWARE = [
+        'tina.middleware.IdentityMapMiddleware',
+        ...
+    ]
+    """
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with IdentityMap():
+            return self.get_response(request)
+
+    def process_request(self, request):
+        identity_map = IdentityMap()
+        identity_map.__enter__()
+        request.tina_identity_map = identity_map
+
+    def process_response(self, request, response):
+        identity_map = getattr(request, 'tina_identity_map', None)
+        if identity_map is not None:
+            identity_map.__exit__(None, None, None)
+            del request.tina_identity_map
+        return response
+
+
+class RequestSummaryMiddleware(object):
+    """
+    Collect round trips of tina for each request and attach the summary to the response.
+    X-Tina-Round-Trips: {int} The number of requests to elasticsearch.
+    X-Tina-Time: {float} The client wall time of requests in milliseconds, hydration is excluded.
+    The summary is `request.tina_summary` in views.
+    MIDDLEWARE = [
+        'tina.middleware.RequestSummaryMiddleware',
+        ...
+    ]
+    """
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with RequestSummary() as summary:
+            request.tina_summary = summary
+            response = self.get_response(request)
+        return self.attach(summary, response)
+
+    def process_request(self, request):
+        summary = RequestSummary()
+        request.tina_summary = summary.__enter__()
+        request.tina_summary_scope = summary
+
+    def process_response(self, request, response):
+        scope = getattr(request, 'tina_summary_scope', None)
+        if scope is None:
+            return response
+        scope.__exit__(None, None, None)
+        del request.tina_summary_scope
+        return self.attach(request.tina_summary, response)
+
+    @staticmethod
+    def attach(summary, response):
+        """
+        Attach the summary to headers of the response.
+        :param summary: {RequestSummary}
+        :param response: {HttpResponse}
+        :return: {HttpResponse}
+        """
+        response['X-Tina-Round-Trips'] = str(summary.round_trips)
+        response['X-Tina-Time'] = '%.3f' % (summary.duration * 1000)
+        return response
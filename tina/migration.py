@@ -0,0 +1,222 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from . import bulk, cache, utils
+from .exceptions import NotFoundError
+
+
+logger = logging.getLogger('tina.migration')
+
+
+def migrate(document_class, slices=1, chunk_size=500, scroll='5m', use_reindex=False, delete_old=False):
+    """
+    Migrate the index of the document class to the new versioned index without downtime.
+    1. Create `<index name>_v<n>` with the current settings and mapping of the class.
+    2. Copy documents from the indices of the alias with scroll and bulk (or the server-side `_reindex`).
+       Versions of documents are kept with the external version type.
+    3. Swap the alias `<index name>` to the new index atomically.
+    4. Copy documents again. Documents which are saved during step 2 are copied, newer documents are skipped.
+    `get_index_name()` is the alias, so all requests resolve through it after migrating.
+    If `<index name>` is a concrete index (it is created by `update_mapping()`), writes of it are blocked
+    before step 3, documents which are saved or deleted during step 2 are synchronized, then the index is replaced
+    with the alias atomically by `remove_index` of elasticsearch 6.0+. Writes fail in this short gap, reads don't.
+    Documents of the alias which are deleted during step 2 are copied back in step 4.
+    :param document_class: {type} The document class.
+    :param slices: {int} The number of parallel sliced scrolls. > 1 requires elasticsearch 5.0+.
+    :param chunk_size: {int} The number of documents of each scroll page and bulk request.
+    :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+    :param use_reindex: {bool} Copy documents with `_reindex` of elasticsearch 2.3+.
+    :param delete_old: {bool} Delete previous indices after swapping the alias.
+    :returns: {dict}
+        {
+            index: {string} The new index,
+            previous: {list} [{string}] The previous indices,
+            documents: {int} The number of copied documents,
+            deleted: {int} The number of documents which are deleted from the concrete index during copying,
+            failures: {list} [{dict}] The failed items of bulk requests,
+        }
+    """
+    es = document_class._es
+    alias = document_class.get_index_name()
+    previous_indices = get_alias_indices(document_class)
+    is_concrete = not previous_indices and es.indices.exists(index=alias)
+    sources = previous_indices or ([alias] if is_concrete else [])
+    index = '%s_v%d' % (alias, max([_parse_version(alias, x) for x in previous_indices] or [0]) + 1)
+    result = {
+        'index': index,
+        'previous': sources,
+        'documents': 0,
+        'deleted': 0,
+        'failures': [],
+    }
+
+    # create the versioned index
+    body = {
+        'mappings': {
+            document_class.__name__: document_class.get_index_mapping(),
+        },
+    }
+    if document_class.get_index_settings():
+        body['settings'] = {
+            'index': document_class.get_index_settings(),
+        }
+    logger.info('Create %s', index)
+    es.indices.create(index=index, body=body)
+
+    for source in sources:
+        logger.info('Copy %s to %s', source, index)
+        _copy(document_class, source, index, slices, chunk_size, scroll, use_reindex, result)
+
+    if is_concrete:
+        # synchronize documents which are saved or deleted during copying while writes are blocked
+        logger.info('Block writes of %s', alias)
+        es.indices.put_settings(index=alias, body={'index.blocks.write': True})
+        try:
+            _copy(document_class, alias, index, slices, chunk_size, scroll, use_reindex, result)
+            _delete_missing(document_class, alias, index, chunk_size, scroll, result)
+        except Exception:
+            es.indices.put_settings(index=alias, body={'index.blocks.write': False})
+            raise
+
+    logger.info('Swap the alias %s to %s', alias, index)
+    if is_concrete:
+        # the concrete index is replaced with the alias in the same request, no request can create it again
+        actions = [{'remove_index': {'index': alias}}]
+    else:
+        actions = [{'remove': {'index': x, 'alias': alias}} for x in previous_indices]
+    actions.append({'add': {'index': index, 'alias': alias}})
+    es.indices.update_aliases(body={'actions': actions})
+    cache.invalidate_aggregations(alias)
+
+    for source in previous_indices:
+        # copy documents which are saved during copying
+        _copy(document_class, source, index, slices, chunk_size, scroll, use_reindex, result)
+        if delete_old:
+            logger.info('Delete the index %s', source)
+            es.indices.delete(index=source)
+    return result
+
+def get_alias_indices(document_class):
+    """
+    Get indices of the alias of the document class.
+    :param document_class: {type} The document class.
+    :return: {list} [{string}] [] The alias doesn't exist.
+    """
+    try:
+        response = document_class._es.indices.get_alias(name=document_class.get_index_name())
+    except NotFoundError:
+        return []
+    return sorted(response.keys())
+
+def _parse_version(alias, index):
+    match = re.match(r'^%s_v(\d+)$' % re.escape(alias), index)
+    return int(match.group(1)) if match else 0
+
+def _scan_ids(es, index, chunk_size, scroll):
+    """
+    Scroll ids of all documents in the index.
+    :return: {generator} (_type, _id)
+    """
+    search_result = es.search(index=index, body={
+        'query': {'match_all': {}},
+        'size': chunk_size,
+        '_source': False,
+    }, scroll=scroll)
+    scroll_id = search_result.get('_scroll_id')
+    try:
+        while search_result['hits']['hits']:
+            for hit in search_result['hits']['hits']:
+                yield hit['_type'], hit['_id']
+            search_result = es.scroll(scroll_id=scroll_id, scroll=scroll)
+            scroll_id = search_result.get('_scroll_id', scroll_id)
+    finally:
+        if scroll_id:
+            es.clear_scroll(scroll_id=scroll_id)
+
+def _delete_missing(document_class, source, dest, chunk_size, scroll, result):
+    """
+    Delete documents of the dest index which aren't in the source index any more.
+    Writes of the source index should be blocked.
+    :param result: {dict} The result of migrate(). The count and failures are added to it.
+    """
+    es = document_class._es
+    source_ids = set(_scan_ids(es, source, chunk_size, scroll))
+    missing = [x for x in _scan_ids(es, dest, chunk_size, scroll) if x not in source_ids]
+    for offset in range(0, len(missing), chunk_size):
+        chunk = missing[offset:offset + chunk_size]
+        body = '\n'.join(bulk.dumps({'delete': {'_index': dest, '_type': x[0], '_id': x[1]}}) for x in chunk)
+        response = es.bulk(body=body + '\n')
+        for _, item, failure in bulk.parse_response(chunk, response):
+            if failure is None:
+                result['deleted'] += 1
+            elif failure['status'] != 404:
+                result['failures'].append({'id': item.get('_id'), 'status': failure['status'], 'error': failure['error']})
+    if missing:
+        es.indices.refresh(index=dest)
+
+def _copy(document_class, source, dest, slices, chunk_size, scroll, use_reindex, result):
+    """
+    Copy documents from the source index to the dest index. Newer documents of the dest index are kept.
+    :param result: {dict} The result of migrate(). The count and failures are added to it.
+    """
+    es = document_class._es
+    if use_reindex:
+        params = {'refresh': 'true'}
+        if slices > 1:
+            params['slices'] = slices
+        response = utils.perform_request(es, 'POST', '/_reindex', params=params, body={
+            'conflicts': 'proceed',
+            'source': {'index': source, 'size': chunk_size},
+            'dest': {'index': dest, 'version_type': 'external'},
+        })
+        result['documents'] += response.get('created', 0) + response.get('updated', 0)
+        result['failures'].extend(response.get('failures', []))
+        return
+
+    def copy_slice(slice_id):
+        body = {
+            'query': {'match_all': {}},
+            'size': chunk_size,
+        }
+        if slices > 1:
+            body['slice'] = {'id': slice_id, 'max': slices}
+        count = 0
+        failures = []
+        search_result = es.search(index=source, body=body, scroll=scroll, version=True)
+        scroll_id = search_result.get('_scroll_id')
+        try:
+            while search_result['hits']['hits']:
+                hits = search_result['hits']['hits']
+                lines = []
+                for hit in hits:
+                    lines.append(bulk.dumps({'index': {
+                        '_index': dest,
+                        '_type': hit['_type'],
+                        '_id': hit['_id'],
+                        '_version': hit['_version'],
+                        '_version_type': 'external',
+                    }}))
+                    lines.append(bulk.dumps(hit['_source']))
+                response = es.bulk(body='\n'.join(lines) + '\n')
+                for _, item, failure in bulk.parse_response(hits, response):
+                    if failure is None:
+                        count += 1
+                    elif failure['status'] != 409:
+                        # 409: the document of the dest index is newer
+                        failures.append({'id': item.get('_id'), 'status': failure['status'], 'error': failure['error']})
+                search_result = es.scroll(scroll_id=scroll_id, scroll=scroll)
+                scroll_id = search_result.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                es.clear_scroll(scroll_id=scroll_id)
+        return count, failures
+
+    if slices > 1:
+        with ThreadPoolExecutor(max_workers=slices) as executor:
+            results = list(executor.map(copy_slice, range(slices)))
+    else:
+        results = [copy_slice(0)]
+    for count, failures in results:
+        result['documents'] += count
+        result['failures'].extend(failures)
+    es.indices.refresh(index=dest)
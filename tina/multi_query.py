@@ -0,0 +1,248 @@
+from . import utils, bulk
+from .exceptions import TransportError
+from .instrumentation import Operation
+
+
+class BatchItem(object):
+    """
+    The request and the result builder of one query in the multi query.
+    """
+    def __init__(self, query, header=None, body=None, build=None, async_build=None, result=None):
+        """
+        :param query: {tina.query.Query}
+        :param header: {dict} The header line of msearch. None: the result is known without the request.
+        :param body: {dict} The search body.
+        :param build: {function} (response) -> result.
+        :param async_build: {coroutine function} (response) -> result. Default is `build`.
+        :param result: The result when there is no request.
+        """
+        self.query = query
+        self.header = header
+        self.body = body
+        self.build = build
+        self.async_build = async_build
+        self.result = result
+
+
+class BatchQuery(object):
+    """
+    Collect requests of the query for `multi_query()`.
+    The methods are the same as `Query`, and they return `BatchItem`s.
+    """
+    def __init__(self, query):
+        self.query = query
+
+    def fetch(self, limit=1000, skip=0, fetch_reference=True, only=None, exclude=None):
+        """
+        Fetch documents by the query.
+        The result is ({list}[{Document}], {int}total).
+        :return: {BatchItem}
+        """
+        query = self.query
+        if query.contains_empty:
+            return BatchItem(query, result=([], 0))
+        partial = bool(only or exclude)
+        def build(response):
+            return query._fetch_result(response, fetch_reference, partial)
+        async def async_build(response):
+            return await query._async_fetch_result(response, fetch_reference, partial)
+        request = query._fetch_request(limit, skip, only, exclude)
+        body = dict(request['body'])
+        body['version'] = request['version']
+        return BatchItem(query, {'index': request['index']}, body, build, async_build)
+
+    def first(self, fetch_reference=True, only=None, exclude=None):
+        """
+        Fetch the first document.
+        The result is {Document or None}.
+        :return: {BatchItem}
+        """
+        item = self.fetch(1, 0, fetch_reference, only, exclude)
+        if item.header is None:
+            item.result = None
+            return item
+        build, async_build = item.build, item.async_build
+        def first(result):
+            documents, total = result
+            return documents[0] if documents else None
+        item.build = lambda response: first(build(response))
+        async def async_first(response):
+            return first(await async_build(response))
+        item.async_build = async_first
+        return item
+
+    def fetch_with_facets(self, aggregations, limit=1000, skip=0, fetch_reference=True, only=None, exclude=None):
+        """
+        Fetch documents, the total and aggregations of the query.
+        The result is ({list}[{Document}], {int}total, {dict}{'name': result}).
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :return: {BatchItem}
+        """
+        query = self.query
+        partial = bool(only or exclude)
+        def build(response):
+            documents, total = query._fetch_result(response, fetch_reference, partial)
+            return documents, total, query._aggregate_result(aggregations, response)
+        async def async_build(response):
+            documents, total = await query._async_fetch_result(response, fetch_reference, partial)
+            return documents, total, query._aggregate_result(aggregations, response)
+        request = query._fetch_with_facets_request(aggregations, limit, skip, only, exclude)
+        body = dict(request['body'])
+        body['version'] = request['version']
+        return BatchItem(query, {'index': request['index']}, body, build, async_build)
+
+    def count(self):
+        """
+        Count documents by the query.
+        The result is {int}.
+        :return: {BatchItem}
+        """
+        query = self.query
+        if query.contains_empty:
+            return BatchItem(query, result=0)
+        request = query._count_request()
+        body = dict(request.get('body', {}))
+        body['size'] = 0
+        return BatchItem(query, {'index': request['index']}, body, lambda response: response['hits']['total'])
+
+    def sum(self, member):
+        """
+        Sum the field of documents by the query.
+        The result is {int}.
+        :param member: {string} The property name of the document.
+        :return: {BatchItem}
+        """
+        query = self.query
+        request = query._sum_request(member)
+        if query.contains_empty:
+            return BatchItem(query, result=0)
+        return BatchItem(
+            query,
+            {'index': request['index']},
+            request['body'],
+            lambda response: response['aggregations']['intraday_return']['value'],
+        )
+
+    def group_by(self, member, limit=10, descending=True):
+        """
+        Aggregations
+        The result is {list}[{dict}] [{doc_count: {int}, key: 'term'}].
+        :param member: {string} The property name of the document.
+        :param limit: {int} The number of returns.
+        :param descending: {bool} Is sorted by descending?
+        :return: {BatchItem}
+        """
+        query = self.query
+        request = query._group_by_request(member, limit, descending)
+        return BatchItem(
+            query,
+            {'index': request['index']},
+            request['body'],
+            lambda response: response['aggregations']['group']['buckets'],
+        )
+
+    def aggregate(self, **aggregations):
+        """
+        Run aggregations.
+        The result is {dict} {'name': result}.
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :return: {BatchItem}
+        """
+        query = self.query
+        request = query._aggregate_request(aggregations)
+        if query.contains_empty:
+            request['body']['query'] = {'bool': {'must_not': {'match_all': {}}}}
+        return BatchItem(
+            query,
+            {'index': request['index']},
+            request['body'],
+            lambda response: query._aggregate_result(aggregations, response),
+        )
+
+
+def multi_query(*items):
+    """
+    Send queries with one msearch request.
+    https://www.elastic.co/guide/en/elasticsearch/reference/current/search-multi-search.html
+    The failed query doesn't fail other queries, its result is the exception.
+    ```
+    (orders, total), account_count = multi_query(
+        Order.where('state', equal='paid').batch().fetch(20),
+        Account.all().batch().count(),
+    )
+    ```
+    :param items: {list} [{BatchItem}]
+    :return: {list} The results in order of items.
+    """
+    requests = [x for x in items if x.header is not None]
+    responses = []
+    if requests:
+        es = requests[0].query.document_class._es
+        with Operation('msearch', requests[0].query.document_class, {'body': _generate_msearch_body(requests)}) as operation:
+            responses = es.msearch(body=operation.request['body'])['responses']
+            operation.received(hits=sum(len(x.get('hits', {}).get('hits', [])) for x in responses))
+
+    results = []
+    responses = iter(responses)
+    for item in items:
+        if item.header is None:
+            results.append(item.result)
+            continue
+        try:
+            results.append(item.build(_check_response(next(responses))))
+        except Exception as error:
+            results.append(error)
+    return results
+
+async def amulti_query(*items):
+    """
+    Send queries with one msearch request with asyncio.
+    The failed query doesn't fail other queries, its result is the exception.
+    :param items: {list} [{BatchItem}]
+    :return: {list} The results in order of items.
+    """
+    requests = [x for x in items if x.header is not None]
+    responses = []
+    if requests:
+        es = utils.get_async_elasticsearch()
+        with Operation('msearch', requests[0].query.document_class, {'body': _generate_msearch_body(requests)}) as operation:
+            responses = (await es.msearch(body=operation.request['body']))['responses']
+            operation.received(hits=sum(len(x.get('hits', {}).get('hits', [])) for x in responses))
+
+    results = []
+    responses = iter(responses)
+    for item in items:
+        if item.header is None:
+            results.append(item.result)
+            continue
+        try:
+            response = _check_response(next(responses))
+            if item.async_build is None:
+                results.append(item.build(response))
+            else:
+                results.append(await item.async_build(response))
+        except Exception as error:
+            results.append(error)
+    return results
+
+def _generate_msearch_body(items):
+    """
+    Generate the body of msearch.
+    :param items: {list} [{BatchItem}]
+    :return: {string}
+    """
+    lines = []
+    for item in items:
+        lines.append(bulk.dumps(item.header))
+        lines.append(bulk.dumps(item.body))
+    return '\n'.join(lines) + '\n'
+
+def _check_response(response):
+    """
+    Raise the error of the query in the msearch response.
+    :param response: {dict} The response of one query.
+    :return: {dict}
+    """
+    if 'error' in response:
+        raise TransportError(response.get('status', 500), response['error'])
+    return response
@@ -2,7 +2,17 @@ from datetime import datetime
 from .exceptions import BadValueError
 
 
+# the analyzer and the subfield of StringProperty(substring_search=True)
+SUBSTRING_ANALYZER = 'tina_substring'
+SUBSTRING_FIELD = 'substring'
+# the size of n-grams, shorter values of `like` and `unlike` don't have any n-gram
+SUBSTRING_GRAM = 3
+
+
 class Property(object):
+    # Cache the python value of each document. Set it for properties which `_to_python` is expensive.
+    memoize = False
+
     def __init__(self, default=None, required=False, analyzer=None, mapping=None):
         """
         Init the Property.
@@ -27,18 +37,27 @@ class Property(object):
         if document_instance is None:
             return self
 
+        if self.memoize:
+            try:
+                return document_instance._decoded_document[self.name]
+            except KeyError:
+                pass
         value = document_instance._document.get(self.name)
-        if value is None:
-            return None
-        return self._to_python(value)
+        if value is not None:
+            value = self._to_python(value)
+        if self.memoize:
+            document_instance._decoded_document[self.name] = value
+        return value
 
     def __set__(self, document_instance, value):
+        if self.memoize:
+            document_instance._decoded_document.pop(self.name, None)
         if value is None:
             if self.required:
                 raise BadValueError('%s is required' % self.name)
-            document_instance._document[self.name] = None
+            self._set_value(document_instance, None)
         else:
-            document_instance._document[self.name] = self._to_json(value)
+            self._set_value(document_instance, self._to_json(value))
 
     def __property_config__(self, document_class, property_name):
         """
@@ -51,6 +70,30 @@ class Property(object):
         if self.name is None:
             self.name = property_name
 
+    def _set_value(self, document_instance, value):
+        """
+        Set the json value into the document. The property is marked dirty when the value is changed.
+        :param document_instance: {Document}
+        :param value: The value in json format.
+        """
+        document = document_instance._document
+        if self.name not in document or document[self.name] != value:
+            document_instance._dirty.add(self.name)
+        document[self.name] = value
+
+    def _track_mutable(self, document_instance, value):
+        """
+        Mark the list or dict value dirty when it is read, it can be changed in place.
+        The value isn't copied, so reading it doesn't cost more for hydrated documents,
+        but `update()` and `save()` send it even if it isn't changed.
+        :param document_instance: {Document}
+        :param value: {list or dict}
+        :return: The value.
+        """
+        if value is not None:
+            document_instance._dirty.add(self.name)
+        return value
+
     def _to_python(self, value):
         """
         Convert the value to Python format.
@@ -70,6 +113,20 @@ class StringProperty(Property):
     _to_python = str
     _to_json = str
 
+    def __init__(self, *args, substring_search=False, **kwargs):
+        """
+        Init string property.
+        :param substring_search: {bool} Index the n-gram subfield `<name>.substring`.
+            `like` and `unlike` queries use it instead of the leading-wildcard regexp.
+            `update_mapping()` adds the subfield, but existing documents aren't indexed into it until they are saved
+            again, so reindex them with `migrate()` after enabling it. Otherwise they don't match `like`.
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        super(StringProperty, self).__init__(*args, **kwargs)
+        self.substring_search = substring_search
+
 class IntegerProperty(Property):
     _to_python = int
     _to_json = int
@@ -83,6 +140,8 @@ class BooleanProperty(Property):
     _to_json = bool
 
 class DateTimeProperty(Property):
+    memoize = True
+
     def __init__(self, auto_now=False, *args, **kwargs):
         super(DateTimeProperty, self).__init__(*args, **kwargs)
         self.auto_now = auto_now
@@ -95,6 +154,16 @@ class DateTimeProperty(Property):
         :return: {datetime}
         """
         if isinstance(value, str):
+            if len(value) >= 19 and value[4] == '-' and value[7] == '-' and value[10] == 'T'\
+                    and value[13] == ':' and value[16] == ':':
+                # the fast path for the format of `_to_json`: "2015-09-01T10:20:30Z"
+                try:
+                    return datetime(
+                        int(value[0:4]), int(value[5:7]), int(value[8:10]),
+                        int(value[11:13]), int(value[14:16]), int(value[17:19]),
+                    )
+                except ValueError:
+                    pass
             try:
                 value = value.split('.', 1)[0] # strip out microseconds
                 value = value[0:19] # remove timezone
@@ -130,23 +199,21 @@ class ListProperty(Property):
     def __get__(self, document_instance, document_class):
         if document_instance is None:
             return self
-        if document_instance._document.get(self.name) is None:
-            return None
-        return document_instance._document.get(self.name)
+        return self._track_mutable(document_instance, document_instance._document.get(self.name))
 
     def __set__(self, document_instance, value):
         if value is None:
             if self.required:
                 raise BadValueError('%s is required' % self.name)
-            document_instance._document[self.name] = None
+            self._set_value(document_instance, None)
             return
 
         if not isinstance(value, list):
             raise BadValueError('%s should be list' % self.name)
         if self.item_type:
-            document_instance._document[self.name] = [None if x is None else self.item_type(x) for x in value]
+            self._set_value(document_instance, [None if x is None else self.item_type(x) for x in value])
         else:
-            document_instance._document[self.name] = value
+            self._set_value(document_instance, value)
 
 class DictProperty(Property):
     """
@@ -165,10 +232,10 @@ class DictProperty(Property):
     def __get__(self, document_instance, document_class):
         if document_instance is None:
             return self
-        return document_instance._document[self.name]
+        return self._track_mutable(document_instance, document_instance._document.get(self.name))
 
     def __set__(self, document_instance, value):
-        document_instance._document[self.name] = value
+        self._set_value(document_instance, value)
 
 class ReferenceProperty(Property):
     def __init__(self, reference_class, *args, **kwargs):
@@ -188,13 +255,13 @@ class ReferenceProperty(Property):
         if value is None:
             if self.required:
                 raise BadValueError('%s is required' % self.name)
-            document_instance._document[self.name] = None
+            self._set_value(document_instance, None)
             document_instance._reference_document[self.name] = None
         elif isinstance(value, str):
             # set reference id
-            document_instance._document[self.name] = value
+            self._set_value(document_instance, value)
         else:
             if not isinstance(value, self.reference_class):
                 raise ValueError('Value should be %s' % self.document_class)
-            document_instance._document[self.name] = value._id
+            self._set_value(document_instance, value._id)
             document_instance._reference_document[self.name] = value
@@ -1,6 +1,16 @@
+import functools
+import itertools
 import re
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from .deep_query import update_reference_properties
+from django.conf import settings
+from . import utils, cache, export, by_query
+from .deep_query import update_reference_properties, async_update_reference_properties, build_prefetch_tree
+from .identity_map import load_document
+from .instrumentation import Operation
+from .multi_query import BatchQuery
+from .properties import StringProperty, ListProperty, SUBSTRING_FIELD, SUBSTRING_GRAM
 from .exceptions import NotFoundError, PropertyNotExist, QuerySyntaxError
 
 
@@ -36,6 +46,112 @@ class QueryCell(object):
         self.sub_queries = sub_queries
 
 
+class QueryParameter(object):
+    """
+    The named parameter of the query template.
+    Declare the query once and bind values with `Query.bind(name=value)`.
+    """
+    def __init__(self, name):
+        self.name = name
+
+
+class CompiledQuerySlot(object):
+    """
+    The placeholder of a value in the compiled query template.
+    """
+    def __init__(self, index, template=None, length=None):
+        """
+        :param index: {int} The index of the value in the values of the query.
+        :param template: {string} The format of the value. ex: '.*%s.*'
+        :param length: {int} The length of the string value. The substring query of `like` depends on it,
+            so it is a part of the cache key.
+        """
+        self.index = index
+        self.template = template
+        self.length = length
+
+    def bind(self, values):
+        value = values[self.index]
+        if self.template is None:
+            return value
+        return self.template % value
+
+
+class CompiledQueryCache(object):
+    """
+    The LRU cache of compiled query templates.
+    The key is the structure of the query (operations, members and nesting), values are bound at execution time.
+    """
+    def __init__(self, max_size=None):
+        """
+        :param max_size: {int} The max number of templates. Default is settings.TINA_COMPILED_QUERY_CACHE_SIZE or 1024.
+            0: the cache is disabled, each query is compiled.
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.__items = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get_max_size(self):
+        """
+        :return: {int} The max number of templates. 0: the cache is disabled.
+        """
+        if self.max_size is not None:
+            return self.max_size
+        return getattr(settings, 'TINA_COMPILED_QUERY_CACHE_SIZE', 1024)
+
+    def get(self, key):
+        if not self.get_max_size():
+            return None
+        template = self.__items.get(key)
+        if template is None:
+            self.misses += 1
+            return None
+        try:
+            self.__items.move_to_end(key)
+        except KeyError:
+            # it was evicted by another thread
+            pass
+        self.hits += 1
+        return template
+
+    def set(self, key, template):
+        max_size = self.get_max_size()
+        with self.__lock:
+            if max_size <= 0:
+                # the setting is changed to disable the cache
+                self.__items.clear()
+                return
+            self.__items[key] = template
+            while len(self.__items) > max_size:
+                self.__items.popitem(last=False)
+
+    def clear(self):
+        with self.__lock:
+            self.__items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        :return: {dict}
+            {
+                hits: {int},
+                misses: {int},
+                size: {int} The number of cached templates.
+            }
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.__items),
+        }
+
+
+compiled_query_cache = CompiledQueryCache()
+
+
 class Query(object):
     """
     A tina query object.
@@ -46,6 +162,13 @@ class Query(object):
         self.items = [
             QueryCell(QueryOperation.all)
         ]
+        # compile exact-match, range and missing checks as non-scoring filters
+        self.uses_filter_context = getattr(document_class, '_filter_context', False)
+        self.prefetch_paths = []  # the reference paths which are resolved with documents
+        # cache results of count, sum and group_by
+        self.uses_aggregation_cache = getattr(document_class, '_aggregation_cache', False)
+        self.template = None  # (the template {Query}, {dict} parameters) of the bound query
+        self.__template_cells = None  # (the number of items, [(operation, value)]) of the query template
 
 
     # -----------------------------------------------------
@@ -161,14 +284,102 @@ class Query(object):
         return self
 
 
+    def filter_context(self, enabled=True):
+        """
+        Compile the query in the filter context. It requires elasticsearch 2.0+ for `bool.filter`.
+        Exact-match, range, contains, exclude and missing checks are compiled to non-scoring
+        `bool.filter` and `bool.must_not` clauses, so elasticsearch can cache them.
+        They are `term` and `terms` queries, except analyzed string properties keep the `match` query,
+        so results are the same as the scoring query. Only `like` is still scored.
+        The default is the `_filter_context` attribute of the document class.
+        :param enabled: {bool}
+        :return: {tina.query.Query}
+        """
+        self.uses_filter_context = enabled
+        return self
+
+    def batch(self):
+        """
+        Collect the request of this query for `tina.multi_query.multi_query()`.
+        ```
+        orders, order_count = multi_query(
+            Order.where('state', equal='paid').batch().fetch(20),
+            Order.all().batch().count(),
+        )
+        ```
+        :return: {tina.multi_query.BatchQuery}
+        """
+        return BatchQuery(self)
+
+    def cache_aggregations(self, enabled=True):
+        """
+        Cache results of count, sum and group_by in the aggregation cache.
+        Results are dropped when tina saves or deletes documents of the index, or refreshes it.
+        :param enabled: {bool}
+        :return: {tina.query.Query}
+        """
+        self.uses_aggregation_cache = enabled
+        return self
+
+    def prefetch(self, *paths):
+        """
+        Resolve reference chains of fetched documents breadth-first.
+        Documents of each level are fetched with one mget per class, different classes are fetched at the same time.
+        :param paths: {list} The reference paths. 'account', 'account.company'
+        :return: {tina.query.Query}
+        """
+        build_prefetch_tree(self.document_class, paths, False)
+        self.prefetch_paths.extend(paths)
+        return self
+
+    def bind(self, **parameters):
+        """
+        Bind values to `QueryParameter`s of the query template.
+        :param parameters: {dict} {'parameter name': value}
+        :return: {tina.query.Query} The new query. The template isn't changed.
+        """
+        query = Query(self.document_class)
+        query.contains_empty = self.contains_empty
+        query.uses_filter_context = self.uses_filter_context
+        query.prefetch_paths = list(self.prefetch_paths)
+        query.uses_aggregation_cache = self.uses_aggregation_cache
+        query.items = self.__bind_parameters(query, self.items, parameters, True)
+        query.template = (self, parameters)
+        return query
+
+
     # -----------------------------------------------------
     # The methods for fetch documents by the query.
     # -----------------------------------------------------
-    def fetch(self, limit=1000, skip=0, fetch_reference=True):
+    def fetch(self, limit=1000, skip=0, fetch_reference=True, only=None, exclude=None):
         """
         Fetch documents by the query.
         :param limit: {int} The size of the pagination. (The limit of the result items.)
         :param skip: {int} The offset of the pagination. (Skip x items.)
+        :param only: {list} Only fetch these properties. The documents are partial, they can't be saved.
+        :param exclude: {list} Don't fetch these properties. The documents are partial, they can't be saved.
+        :returns: {tuple}
+            ({list}[{Document}], {int}total)
+            The documents.
+            The total items.
+        """
+        if self.contains_empty:
+            return [], 0
+
+        request = self._fetch_request(limit, skip, only, exclude)
+        es = self.document_class._es
+        with Operation('fetch', self.document_class, request) as operation:
+            search_result = es.search(**request)
+            operation.received(search_result)
+            return self._fetch_result(search_result, fetch_reference, bool(only or exclude))
+
+    async def afetch(self, limit=1000, skip=0, fetch_reference=True, only=None, exclude=None):
+        """
+        Fetch documents by the query with asyncio.
+        :param limit: {int} The size of the pagination. (The limit of the result items.)
+        :param skip: {int} The offset of the pagination. (Skip x items.)
+        :param only: {list} Only fetch these properties. The documents are partial, they can't be saved.
+        :param exclude: {list} Don't fetch these properties. The documents are partial, they can't be saved.
         :returns: {tuple}
             ({list}[{Document}], {int}total)
             The documents.
@@ -177,19 +388,191 @@ class Query(object):
         if self.contains_empty:
             return [], 0
 
+        request = self._fetch_request(limit, skip, only, exclude)
+        es = utils.get_async_elasticsearch()
+        with Operation('fetch', self.document_class, request) as operation:
+            search_result = await es.search(**request)
+            operation.received(search_result)
+            return await self._async_fetch_result(search_result, fetch_reference, bool(only or exclude))
+
+    def iterate(self, batch_size=1000, fetch_reference=True, scroll='1m'):
+        """
+        Iterate all documents by the query with the scroll api.
+        https://www.elastic.co/guide/en/elasticsearch/reference/current/search-request-scroll.html
+        Only one batch of documents is kept in memory. The scroll context is cleared when the iteration stops.
+        :param batch_size: {int} The number of documents of each request.
+        :param fetch_reference: {bool} Fetch reference documents of each batch.
+        :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+        :return: {generator} {Document}
+        """
+        if self.contains_empty:
+            return
+
         es = self.document_class._es
+        body = self.__generate_elasticsearch_search_body(self.items, batch_size)
+        del body['from']
         search_result = es.search(
             index=self.document_class.get_index_name(),
-            body=self.__generate_elasticsearch_search_body(self.items, limit, skip),
-            version=True
+            body=body,
+            scroll=scroll,
+            version=True,
         )
+        scroll_id = search_result.get('_scroll_id')
+        try:
+            while search_result['hits']['hits']:
+                documents = self.__build_documents(search_result['hits']['hits'], fetch_reference, False)
+                for document in documents:
+                    yield document
+                search_result = es.scroll(scroll_id=scroll_id, scroll=scroll)
+                scroll_id = search_result.get('_scroll_id', scroll_id)
+        finally:
+            if scroll_id:
+                es.clear_scroll(scroll_id=scroll_id)
 
-        result = []
-        for hits in search_result['hits']['hits']:
-            result.append(self.document_class(_id=hits['_id'], _version=hits['_version'], **hits['_source']))
-        if fetch_reference:
-            update_reference_properties(result)
-        return result, search_result['hits']['total']
+    def export(self, slices=1, workers=None, batch_size=1000, fetch_reference=False, scroll='5m'):
+        """
+        Export all documents by the query with sliced scrolls in worker processes.
+        Each slice is scanned and its documents are built in the worker process, then they are sent to this process.
+        The document class should be importable by worker processes, documents are pickled.
+        The order of documents isn't kept. Documents aren't put into the identity map.
+        ```
+        for order in Order.where('state', equal='paid').export(slices=8):
+            ...
+        ```
+        :param slices: {int} The number of sliced scrolls. > 1 requires elasticsearch 5.0+.
+        :param workers: {int} The number of processes. Default is the number of slices. 0: scan in this process.
+        :param batch_size: {int} The number of documents of each scroll request.
+        :param fetch_reference: {bool} Fetch reference documents of each batch.
+        :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+        :return: {generator} {Document}
+        """
+        if self.contains_empty:
+            return
+        transform = functools.partial(
+            export.build_documents, self.document_class,
+            fetch_reference=fetch_reference, prefetch=list(self.prefetch_paths),
+        )
+        for documents in export.export_hits(self.document_class, self.__export_body(), slices, workers,
+                                            batch_size, scroll, transform):
+            for document in documents:
+                yield document
+
+    def export_jsonl(self, path, slices=1, workers=None, batch_size=1000, scroll='5m'):
+        """
+        Export all documents by the query into JSONL files with sliced scrolls in worker processes.
+        Each line is the source of the document with `_id`, `Document.ingest()` can read it.
+        :param path: {string} The path of files. `{slice}` is replaced with the slice id. 'orders-{slice}.jsonl'
+        :param slices: {int} The number of sliced scrolls and files. > 1 requires elasticsearch 5.0+.
+        :param workers: {int} The number of processes. Default is the number of slices. 0: scan in this process.
+        :param batch_size: {int} The number of documents of each scroll request.
+        :param scroll: {string} How long elasticsearch keeps the scroll context between requests.
+        :return: {list} [{dict}] {'slice': {int}, 'path': {string}, 'documents': {int}}
+        """
+        if self.contains_empty:
+            return []
+        return export.export_files(self.document_class, self.__export_body(), path, slices, workers, batch_size,
+                                   scroll)
+
+    def delete(self, slices=1, requests_per_second=None, conflicts='proceed', wait=True, poll_interval=1,
+               timeout=None, synchronized=False):
+        """
+        Delete documents by the query on the server with one `_delete_by_query` request. (elasticsearch 5.0+)
+        The request starts the task, then it is polled until it is completed.
+        ```
+        result = Order.where('state', equal='expired').delete(slices=4, requests_per_second=500)
+        ```
+        :param slices: {int or string} The number of parallel slices on the server.
+        :param requests_per_second: {float} Throttle batches of the operation. None: no throttling.
+        :param conflicts: {string} 'proceed': count version conflicts. 'abort': stop at the first conflict.
+        :param wait: {bool} Poll the task until it is completed. False: return the running task,
+            `tina.by_query.wait_for_task()` and `get_task()` poll it later.
+        :param poll_interval: {float} Seconds between polling requests.
+        :param timeout: {float} Stop polling after x seconds, the task keeps running. None: no limit.
+        :param synchronized: {bool} Refresh the index after deleting.
+        :return: {dict} {'task', 'completed', 'total', 'deleted', 'version_conflicts', 'failures', ...}
+        """
+        if self.contains_empty:
+            return by_query.build_result(None, True, {})
+        query, _ = self.__compile_queries(self.items)
+        return by_query.delete_by_query(
+            self.document_class, query, slices, requests_per_second, conflicts,
+            wait, poll_interval, timeout, synchronized,
+        )
+
+    def update(self, set=None, script=None, params=None, slices=1, requests_per_second=None, conflicts='proceed',
+               wait=True, poll_interval=1, timeout=None, synchronized=False):
+        """
+        Update documents by the query on the server with one `_update_by_query` request. (elasticsearch 5.0+)
+        ```
+        Order.where('state', equal='pending').update(set={'state': 'expired', 'expired_at': datetime.utcnow()})
+        Account.where('is_vip', equal=True).update(script='ctx._source.quota += params.quota', params={'quota': 10})
+        ```
+        :param set: {dict} {'property_name': (value)} Set properties. Values are converted by properties.
+        :param script: {string} The painless script which runs after setting values.
+        :param params: {dict} Parameters of the script.
+        :param slices: {int or string} The number of parallel slices on the server.
+        :param requests_per_second: {float} Throttle batches of the operation. None: no throttling.
+        :param conflicts: {string} 'proceed': count version conflicts. 'abort': stop at the first conflict.
+        :param wait: {bool} Poll the task until it is completed. False: return the running task.
+        :param poll_interval: {float} Seconds between polling requests.
+        :param timeout: {float} Stop polling after x seconds, the task keeps running. None: no limit.
+        :param synchronized: {bool} Refresh the index after updating.
+        :return: {dict} {'task', 'completed', 'total', 'updated', 'noops', 'version_conflicts', 'failures', ...}
+        """
+        if self.contains_empty:
+            return by_query.build_result(None, True, {})
+        query, _ = self.__compile_queries(self.items)
+        return by_query.update_by_query(
+            self.document_class, query, set, script, params, slices, requests_per_second, conflicts,
+            wait, poll_interval, timeout, synchronized,
+        )
+
+    def fetch_with_facets(self, aggregations, limit=1000, skip=0, fetch_reference=True, only=None, exclude=None):
+        """
+        Fetch documents, the total and aggregations of the query with one search request.
+        ```
+        from tina.aggregations import Terms
+        documents, total, facets = Order.where('state', equal='paid').fetch_with_facets(
+            {'countries': Terms('country'), 'sellers': Terms('seller')},
+            limit=20,
+        )
+        ```
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :param limit: {int} The size of the pagination. (The limit of the result items.)
+        :param skip: {int} The offset of the pagination. (Skip x items.)
+        :param only: {list} Only fetch these properties. The documents are partial, they can't be saved.
+        :param exclude: {list} Don't fetch these properties. The documents are partial, they can't be saved.
+        :returns: {tuple}
+            ({list}[{Document}], {int}total, {dict}{'name': result})
+            The documents.
+            The total items.
+            The results of aggregations.
+        """
+        request = self._fetch_with_facets_request(aggregations, limit, skip, only, exclude)
+        es = self.document_class._es
+        with Operation('fetch_with_facets', self.document_class, request) as operation:
+            search_result = es.search(**request)
+            operation.received(search_result)
+            documents, total = self._fetch_result(search_result, fetch_reference, bool(only or exclude))
+            return documents, total, self._aggregate_result(aggregations, search_result)
+
+    async def afetch_with_facets(self, aggregations, limit=1000, skip=0, fetch_reference=True, only=None, exclude=None):
+        """
+        Fetch documents, the total and aggregations of the query with one search request with asyncio.
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :param limit: {int} The size of the pagination. (The limit of the result items.)
+        :param skip: {int} The offset of the pagination. (Skip x items.)
+        :param only: {list} Only fetch these properties. The documents are partial, they can't be saved.
+        :param exclude: {list} Don't fetch these properties. The documents are partial, they can't be saved.
+        :returns: {tuple} ({list}[{Document}], {int}total, {dict}{'name': result})
+        """
+        request = self._fetch_with_facets_request(aggregations, limit, skip, only, exclude)
+        es = utils.get_async_elasticsearch()
+        with Operation('fetch_with_facets', self.document_class, request) as operation:
+            search_result = await es.search(**request)
+            operation.received(search_result)
+            documents, total = await self._async_fetch_result(search_result, fetch_reference, bool(only or exclude))
+            return documents, total, self._aggregate_result(aggregations, search_result)
 
     def has_any(self):
         if self.contains_empty:
@@ -204,12 +587,14 @@ class Query(object):
             body={'query': query},
         )
 
-    def first(self, fetch_reference=True):
+    def first(self, fetch_reference=True, only=None, exclude=None):
         """
         Fetch the first document.
+        :param only: {list} Only fetch these properties. The document is partial, it can't be saved.
+        :param exclude: {list} Don't fetch these properties. The document is partial, it can't be saved.
         :return: {tina.document.Document or None}
         """
-        documents, total = self.fetch(1, 0, fetch_reference=fetch_reference)
+        documents, total = self.fetch(1, 0, fetch_reference=fetch_reference, only=only, exclude=exclude)
         if total == 0:
             return None
         else:
@@ -223,18 +608,29 @@ class Query(object):
         if self.contains_empty:
             return 0
 
-        query, _ = self.__compile_queries(self.items)
         es = self.document_class._es
-        if query is None:
-            count_result = es.count(self.document_class.get_index_name())
-        else:
-            count_result = es.count(
-                index=self.document_class.get_index_name(),
-                body={
-                    'query': query
-                },
-            )
-        return count_result['count']
+        def load(request):
+            with Operation('count', self.document_class, request) as operation:
+                response = es.count(**request)
+                operation.received(response)
+            return response['count']
+        return self.__get_result('count', self._count_request(), load)
+
+    async def acount(self):
+        """
+        Count documents by the query with asyncio.
+        :return: {int}
+        """
+        if self.contains_empty:
+            return 0
+
+        es = utils.get_async_elasticsearch()
+        async def load(request):
+            with Operation('count', self.document_class, request) as operation:
+                response = await es.count(**request)
+                operation.received(response)
+            return response['count']
+        return await self.__async_get_result('count', self._count_request(), load)
 
     def sum(self, member):
         """
@@ -243,21 +639,185 @@ class Query(object):
         :param member: {string} The property name of the document.
         :return: {int}
         """
-        if member.split('.', 1)[0] not in self.document_class.get_properties().keys():
-            raise PropertyNotExist('%s not in %s' % (member, self.document_class.__name__))
+        request = self._sum_request(member)
         if self.contains_empty:
             return 0
 
-        query, _ = self.__compile_queries(self.items)
         es = self.document_class._es
+        def load(request):
+            with Operation('sum', self.document_class, request) as operation:
+                response = es.search(**request)
+                operation.received(response)
+            return response['aggregations']['intraday_return']['value']
+        return self.__get_result('search', request, load)
+
+    async def asum(self, member):
+        """
+        Sum the field of documents by the query with asyncio.
+        :param member: {string} The property name of the document.
+        :return: {int}
+        """
+        request = self._sum_request(member)
+        if self.contains_empty:
+            return 0
+
+        es = utils.get_async_elasticsearch()
+        async def load(request):
+            with Operation('sum', self.document_class, request) as operation:
+                response = await es.search(**request)
+                operation.received(response)
+            return response['aggregations']['intraday_return']['value']
+        return await self.__async_get_result('search', request, load)
+
+    def group_by(self, member, limit=10, descending=True):
+        """
+        Aggregations
+        http://www.elasticsearch.org/guide/en/elasticsearch/reference/current/search-aggregations.html
+        :param member: {string} The property name of the document.
+        :param limit: {int} The number of returns.
+        :param descending: {bool} Is sorted by descending?
+        :returns: {list}
+            {list}[{dict}]
+            {
+                doc_count: {int},
+                key: 'term'
+            }
+        """
+        request = self._group_by_request(member, limit, descending)
+        es = self.document_class._es
+        def load(request):
+            with Operation('group_by', self.document_class, request) as operation:
+                response = es.search(**request)
+                operation.received(response)
+            return response['aggregations']['group']['buckets']
+        return self.__get_result('search', request, load)
+
+    async def agroup_by(self, member, limit=10, descending=True):
+        """
+        Aggregations with asyncio.
+        :param member: {string} The property name of the document.
+        :param limit: {int} The number of returns.
+        :param descending: {bool} Is sorted by descending?
+        :returns: {list}
+            {list}[{dict}]
+            {
+                doc_count: {int},
+                key: 'term'
+            }
+        """
+        request = self._group_by_request(member, limit, descending)
+        es = utils.get_async_elasticsearch()
+        async def load(request):
+            with Operation('group_by', self.document_class, request) as operation:
+                response = await es.search(**request)
+                operation.received(response)
+            return response['aggregations']['group']['buckets']
+        return await self.__async_get_result('search', request, load)
+
+
+    def aggregate(self, **aggregations):
+        """
+        Run aggregations in one search request.
+        ```
+        from tina.aggregations import Sum, Avg, Terms, DateHistogram
+        result = Order.where('state', equal='paid').aggregate(
+            total=Sum('price'),
+            average=Avg('price'),
+            states=Terms('state', total=Sum('price')),
+            days=DateHistogram('created_at', 'day'),
+        )
+        result['total']  # 120.0
+        result['states'][0].key, result['states'][0].doc_count, result['states'][0]['total']
+        ```
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :return: {dict} {'name': result} The result type is decided by the aggregation.
+        """
+        request = self._aggregate_request(aggregations)
+        if self.contains_empty:
+            request['body']['query'] = {'bool': {'must_not': {'match_all': {}}}}
+        es = self.document_class._es
+        def load(request):
+            with Operation('aggregate', self.document_class, request) as operation:
+                response = es.search(**request)
+                operation.received(response)
+                return self._aggregate_result(aggregations, response)
+        return self.__get_result('search', request, load)
+
+    async def aaggregate(self, **aggregations):
+        """
+        Run aggregations in one search request with asyncio.
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :return: {dict} {'name': result} The result type is decided by the aggregation.
+        """
+        request = self._aggregate_request(aggregations)
+        if self.contains_empty:
+            request['body']['query'] = {'bool': {'must_not': {'match_all': {}}}}
+        es = utils.get_async_elasticsearch()
+        async def load(request):
+            with Operation('aggregate', self.document_class, request) as operation:
+                response = await es.search(**request)
+                operation.received(response)
+                return self._aggregate_result(aggregations, response)
+        return await self.__async_get_result('search', request, load)
+
+
+    # -----------------------------------------------------
+    # The methods for generating requests.
+    # They are shared by the sync and asyncio methods.
+    # -----------------------------------------------------
+    def _fetch_request(self, limit=1000, skip=0, only=None, exclude=None):
+        """
+        Get arguments of the search request for fetch().
+        :param limit: {int} The limit of the result items.
+        :param skip: {int} Skip x items.
+        :param only: {list} Only fetch these properties.
+        :param exclude: {list} Don't fetch these properties.
+        :return: {dict}
+        """
+        body = self.__generate_elasticsearch_search_body(self.items, limit, skip)
+        source_filter = self.document_class._get_source_filter(only, exclude)
+        if source_filter:
+            del body['fields']
+            body['_source'] = source_filter
+        return {
+            'index': self.document_class.get_index_name(),
+            'body': body,
+            'version': True,
+        }
+
+    def _count_request(self):
+        """
+        Get arguments of the count request for count().
+        :return: {dict}
+        """
+        query, _ = self.__compile_queries(self.items)
+        if query is None:
+            return {
+                'index': self.document_class.get_index_name(),
+            }
+        return {
+            'index': self.document_class.get_index_name(),
+            'body': {
+                'query': query
+            },
+        }
+
+    def _sum_request(self, member):
+        """
+        Get arguments of the search request for sum().
+        :param member: {string} The property name of the document.
+        :return: {dict}
+        """
+        if member.split('.', 1)[0] not in self.document_class.get_properties().keys():
+            raise PropertyNotExist('%s not in %s' % (member, self.document_class.__name__))
+        query, _ = self.__compile_queries(self.items)
         if query is None:
             query = {
                 'match_all': {}
             }
-
-        sum_result = es.search(
-            index=self.document_class.get_index_name(),
-            body={
+        return {
+            'index': self.document_class.get_index_name(),
+            'body': {
                 'query': query,
                 'size': 0,
                 'aggs': {
@@ -268,26 +828,18 @@ class Query(object):
                     }
                 }
             },
-        )
-        return sum_result['aggregations']['intraday_return']['value']
+        }
 
-    def group_by(self, member, limit=10, descending=True):
+    def _group_by_request(self, member, limit=10, descending=True):
         """
-        Aggregations
-        http://www.elasticsearch.org/guide/en/elasticsearch/reference/current/search-aggregations.html
+        Get arguments of the search request for group_by().
         :param member: {string} The property name of the document.
         :param limit: {int} The number of returns.
         :param descending: {bool} Is sorted by descending?
-        :returns: {list}
-            {list}[{dict}]
-            {
-                doc_count: {int},
-                key: 'term'
-            }
+        :return: {dict}
         """
         if member.split('.', 1)[0] not in self.document_class.get_properties().keys():
             raise PropertyNotExist('%s not in %s' % (member, self.document_class.__name__))
-        es = self.document_class._es
         es_query, sort_items = self.__compile_queries(self.items)
         query_body = {
             'size': 0,
@@ -305,18 +857,149 @@ class Query(object):
         }
         if es_query:
             query_body['query'] = es_query
+        return {
+            'index': self.document_class.get_index_name(),
+            'body': query_body,
+        }
 
-        search_result = es.search(
-            index=self.document_class.get_index_name(),
-            body=query_body,
-        )
 
-        return search_result['aggregations']['group']['buckets']
+    def _aggregate_request(self, aggregations):
+        """
+        Get arguments of the search request for aggregate().
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :return: {dict}
+        """
+        es_query, _ = self.__compile_queries(self.items)
+        query_body = {
+            'size': 0,
+            'aggs': self.__compile_aggregations(aggregations),
+        }
+        if es_query:
+            query_body['query'] = es_query
+        return {
+            'index': self.document_class.get_index_name(),
+            'body': query_body,
+        }
+
+
+    def _fetch_with_facets_request(self, aggregations, limit=1000, skip=0, only=None, exclude=None):
+        """
+        Get arguments of the search request for fetch_with_facets().
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :param limit: {int} The limit of the result items.
+        :param skip: {int} Skip x items.
+        :param only: {list} Only fetch these properties.
+        :param exclude: {list} Don't fetch these properties.
+        :return: {dict}
+        """
+        request = self._fetch_request(limit, skip, only, exclude)
+        request['body']['aggs'] = self.__compile_aggregations(aggregations)
+        if self.contains_empty:
+            request['body']['query'] = {'bool': {'must_not': {'match_all': {}}}}
+        return request
+
+
+    # -----------------------------------------------------
+    # The methods for building results from responses.
+    # They are shared by the single query and the multi query.
+    # -----------------------------------------------------
+    def _fetch_result(self, search_result, fetch_reference=True, partial=False):
+        """
+        Build the result of fetch() from the search response.
+        :param search_result: {dict} The search response.
+        :param fetch_reference: {bool} Fetch reference documents.
+        :param partial: {bool} The `_source` is filtered.
+        :return: {tuple} ({list}[{Document}], {int}total)
+        """
+        result = self.__build_documents(search_result['hits']['hits'], fetch_reference, partial=partial)
+        return result, search_result['hits']['total']
+
+    @staticmethod
+    def _aggregate_result(aggregations, search_result):
+        """
+        Build the result of aggregate() from the search response.
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :param search_result: {dict} The search response.
+        :return: {dict} {'name': result}
+        """
+        return {name: x.parse(search_result['aggregations'][name]) for name, x in aggregations.items()}
+
+    async def _async_fetch_result(self, search_result, fetch_reference=True, partial=False):
+        """
+        Build the result of afetch() from the search response with asyncio.
+        :param search_result: {dict} The search response.
+        :param fetch_reference: {bool} Fetch reference documents.
+        :param partial: {bool} The `_source` is filtered.
+        :return: {tuple} ({list}[{Document}], {int}total)
+        """
+        result = self.__build_documents(search_result['hits']['hits'], fetch_reference=False, partial=partial)
+        if fetch_reference or self.prefetch_paths:
+            await async_update_reference_properties(result, self.prefetch_paths, fetch_reference)
+        return result, search_result['hits']['total']
 
 
     # -----------------------------------------------------
     # Private methods.
     # -----------------------------------------------------
+    def __get_result(self, api, request, load):
+        """
+        Get the result of the aggregation request through the aggregation cache if the query uses it.
+        :param api: {string} The api of elasticsearch. 'count', 'search'
+        :param request: {dict} The arguments of the request.
+        :param load: {function} (request) -> result.
+        :return: The result.
+        """
+        if not self.uses_aggregation_cache:
+            return load(request)
+        return cache.get_cached_result(api, request, load)
+    async def __async_get_result(self, api, request, load):
+        """
+        Get the result of the aggregation request through the aggregation cache with asyncio.
+        :param api: {string} The api of elasticsearch. 'count', 'search'
+        :param request: {dict} The arguments of the request.
+        :param load: {coroutine function} (request) -> result.
+        :return: The result.
+        """
+        if not self.uses_aggregation_cache:
+            return await load(request)
+        return await cache.async_get_cached_result(api, request, load)
+    def __export_body(self):
+        """
+        Generate the search body of export() without `from` and `size`.
+        :return: {dict}
+        """
+        body = self.__generate_elasticsearch_search_body(self.items)
+        body.pop('from', None)
+        body.pop('size', None)
+        return body
+    def __compile_aggregations(self, aggregations):
+        """
+        Compile aggregations of aggregate() and fetch_with_facets().
+        :param aggregations: {dict} {'name': {tina.aggregations.Aggregation}}
+        :return: {dict} The `aggs` of the search body.
+        """
+        if not aggregations:
+            raise QuerySyntaxError('aggregations are required')
+        return {name: x.to_dict(self.document_class) for name, x in aggregations.items()}
+    def __build_documents(self, hits, fetch_reference=True, use_identity_map=True, partial=False):
+        """
+        Build documents from search hits.
+        :param hits: {list} The hits of the search result.
+        :param fetch_reference: {bool} Fetch reference documents.
+        :param use_identity_map: {bool} Share documents with the identity map of the current scope.
+            `iterate` doesn't use it, the identity map would keep all documents of the scroll in memory.
+        :param partial: {bool} The `_source` is filtered. Partial documents don't use the identity map.
+        :return: {list} [{Document}]
+        """
+        if partial:
+            result = [self.document_class._from_storage(x, True) for x in hits]
+        elif use_identity_map:
+            result = [load_document(self.document_class, x) for x in hits]
+        else:
+            result = [self.document_class._from_storage(x) for x in hits]
+        if fetch_reference or self.prefetch_paths:
+            update_reference_properties(result, self.prefetch_paths, fetch_reference)
+        return result
     def __generate_elasticsearch_search_body(self, queries, limit=None, skip=None):
         """
         Generate the elastic search search body.
@@ -336,7 +1019,186 @@ class Query(object):
             result['query'] = es_query
         return result
 
+    def __bind_parameters(self, query, queries, parameters, is_intersection):
+        """
+        Copy query cells with values of parameters.
+        :param query: {Query} The new query.
+        :param queries: {list} The tina query cells.
+        :param parameters: {dict} {'parameter name': value}
+        :param is_intersection: {bool} Are cells intersected with the root query?
+        :return: {list} The new tina query cells.
+        """
+        result = []
+        for cell in queries:
+            if cell.sub_queries:
+                result.append(QueryCell(
+                    cell.operation,
+                    sub_queries=self.__bind_parameters(
+                        query,
+                        cell.sub_queries,
+                        parameters,
+                        is_intersection and cell.operation & QueryOperation.intersection == QueryOperation.intersection,
+                    ),
+                ))
+                continue
+            value = cell.value
+            if isinstance(value, QueryParameter):
+                if value.name not in parameters:
+                    raise QuerySyntaxError('%s is not bound' % value.name)
+                value = parameters[value.name]
+                if is_intersection and not value\
+                        and cell.operation & QueryOperation.contains == QueryOperation.contains:
+                    # it is the same as .where('member', contains=[])
+                    query.contains_empty = True
+            result.append(QueryCell(cell.operation, member=cell.member, value=value))
+        return result
+
     def __compile_queries(self, queries):
+        """
+        Compile tina query cells to the elastic search query.
+        The compiled template is cached by the structure of query cells.
+        :param queries: {list} The tina query cells.
+        :returns: {tuple} ({dict or None}, {list})
+            The elastic search query dict.
+            The elastic search sort list.
+        """
+        if self.template is not None and queries is self.items and len(queries) == len(self.template[0].items):
+            template, parameters = self.template
+            return template.__compile_bound_queries(parameters, queries, self.uses_filter_context)
+
+        values = []
+        key = (self.document_class, self.uses_filter_context, self.__parameterize_queries(queries, values))
+        template = compiled_query_cache.get(key)
+        if template is None:
+            template_queries = self.__build_template_queries(queries, itertools.count())
+            if self.uses_filter_context:
+                template = self.__compile_filter_queries(template_queries)[:2]
+            else:
+                template = self.__compile_template_queries(template_queries)
+            compiled_query_cache.set(key, template)
+        return _bind_template(template, values)
+
+    def __compile_bound_queries(self, parameters, queries, filter_context):
+        """
+        Compile query cells which are bound from this query template.
+        It skips scanning the structure of query cells, the key is the template and shapes of parameters.
+        :param parameters: {dict} {'parameter name': value}
+        :param queries: {list} The bound tina query cells.
+        :param filter_context: {bool} Compile in the filter context.
+        :returns: {tuple} ({dict or None}, {list})
+            The elastic search query dict.
+            The elastic search sort list.
+        """
+        if self.__template_cells is None or self.__template_cells[0] != len(self.items):
+            cells = []
+            self.__collect_template_cells(self.items, cells)
+            self.__template_cells = (len(self.items), cells)
+
+        values = []
+        shapes = []
+        for operation, value in self.__template_cells[1]:
+            if isinstance(value, QueryParameter):
+                value = self.__get_query_values(operation, parameters[value.name])
+                shapes.append(None if value is None else _get_shape(operation, value))
+            if value:
+                values.extend(value)
+        key = (self, filter_context, self.__template_cells[0], tuple(shapes))
+        template = compiled_query_cache.get(key)
+        if template is None:
+            template_queries = self.__build_template_queries(queries, itertools.count())
+            if filter_context:
+                template = self.__compile_filter_queries(template_queries)[:2]
+            else:
+                template = self.__compile_template_queries(template_queries)
+            compiled_query_cache.set(key, template)
+        return _bind_template(template, values)
+
+    def __collect_template_cells(self, queries, cells):
+        """
+        Collect values of the query template in order.
+        :param queries: {list} The tina query cells.
+        :param cells: {list} [({int} operation, {list or None or QueryParameter} values)]
+        """
+        for query in queries:
+            if query.sub_queries:
+                self.__collect_template_cells(query.sub_queries, cells)
+            elif isinstance(query.value, QueryParameter):
+                cells.append((query.operation, query.value))
+            else:
+                cells.append((query.operation, self.__get_query_values(query.operation, query.value)))
+
+    def __parameterize_queries(self, queries, values):
+        """
+        Get the structure of tina query cells and collect their values.
+        :param queries: {list} The tina query cells.
+        :param values: {list} The values of query cells are appended to it.
+        :return: {tuple} The structure of query cells.
+        """
+        result = []
+        for query in queries:
+            if query.sub_queries:
+                result.append((query.operation, self.__parameterize_queries(query.sub_queries, values)))
+            elif query.value is None:
+                result.append((query.operation, query.member, None))
+            else:
+                query_values = self.__get_query_values(query.operation, query.value)
+                result.append((query.operation, query.member, _get_shape(query.operation, query_values)))
+                values.extend(query_values)
+        return tuple(result)
+
+    def __build_template_queries(self, queries, counter):
+        """
+        Copy tina query cells with `CompiledQuerySlot` values.
+        :param queries: {list} The tina query cells.
+        :param counter: {iterator} The index generator of slots.
+        :return: {list} The tina query cells.
+        """
+        result = []
+        for query in queries:
+            if query.sub_queries:
+                result.append(QueryCell(
+                    query.operation,
+                    sub_queries=self.__build_template_queries(query.sub_queries, counter),
+                ))
+                continue
+            query_values = self.__get_query_values(query.operation, query.value)
+            if query_values is None:
+                value = query.value
+            elif isinstance(query.value, (list, tuple, set, frozenset)) \
+                    or query.operation & QueryOperation.exclude == QueryOperation.exclude:
+                # the value of contains and exclude is iterated
+                value = [CompiledQuerySlot(next(counter), length=_get_length(x)) for x in query_values]
+            else:
+                value = CompiledQuerySlot(next(counter), length=_get_length(query_values[0]))
+            result.append(QueryCell(query.operation, member=query.member, value=value))
+        return result
+
+    def __get_query_values(self, operation, value):
+        """
+        Get values of the tina query cell for the elastic search query.
+        :param operation: {int} The operation of the tina query cell.
+        :param value: The value of the tina query cell.
+        :return: {list or None} None if the cell doesn't have any value.
+        """
+        if value is None:
+            return None
+        if isinstance(value, QueryParameter):
+            raise QuerySyntaxError('%s is not bound' % value.name)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            return list(value)
+        if isinstance(value, str):
+            if '<' in value or '>' in value:
+                value = re.sub(r'[<>]', '', value)
+            if operation & QueryOperation.exclude == QueryOperation.exclude:
+                # contains and exclude iterate characters of the string
+                return list(value)
+            return [value]
+        operation &= QueryOperation.normal_operation_mask
+        if isinstance(value, datetime) and QueryOperation.less <= operation <= QueryOperation.greater_equal:
+            return [self.__convert_datetime_for_query(value)]
+        return [value]
+
+    def __compile_template_queries(self, queries):
         """
         Compile tina query cells to the elastic search query.
         :param queries: {list} The tina query cells.
@@ -351,14 +1213,12 @@ class Query(object):
         for query in queries:
             if query.sub_queries:
                 # compile sub queries
-                sub_query, sub_sort_items = self.__compile_queries(query.sub_queries)
+                sub_query, sub_sort_items = self.__compile_template_queries(query.sub_queries)
                 if sub_query and query.operation & QueryOperation.intersection == QueryOperation.intersection:
                     # intersect
                     necessary_items.append(sub_query)
                     last_item_is_necessary = True
             else:
-                if isinstance(query.value, str):
-                    query.value = re.sub(r'[<>]', '', query.value)
                 if query.operation & QueryOperation.intersection == QueryOperation.intersection:
                     # intersect
                     query_item = self.__compile_query(query)
@@ -410,6 +1270,134 @@ class Query(object):
         else:
             query = None
         return query, sort_items
+    def __compile_filter_queries(self, queries):
+        """
+        Compile tina query cells to the elastic search query in the filter context.
+        The boolean logic is the same as __compile_template_queries.
+        :param queries: {list} The tina query cells.
+        :returns: {tuple} ({dict or None}, {list}, {bool})
+            The elastic search query dict.
+            The elastic search sort list.
+            Is there any scoring clause in the query?
+        """
+        sort_items = []
+        necessary_items = []  # [({string} occurrence, {dict} clause)]
+        optional_items = []
+        is_scoring = False
+        last_item_is_necessary = False
+        for query in queries:
+            if query.sub_queries:
+                # compile sub queries
+                sub_query, sub_sort_items, sub_is_scoring = self.__compile_filter_queries(query.sub_queries)
+                if sub_query and query.operation & QueryOperation.intersection == QueryOperation.intersection:
+                    # intersect
+                    necessary_items.append(('must' if sub_is_scoring else 'filter', sub_query))
+                    is_scoring = is_scoring or sub_is_scoring
+                    last_item_is_necessary = True
+            elif query.operation & QueryOperation.intersection == QueryOperation.intersection:
+                # intersect
+                necessary_items.append(self.__compile_filter_query(query))
+                last_item_is_necessary = True
+            elif query.operation & QueryOperation.union == QueryOperation.union:
+                # union
+                occurrence, clause = self.__compile_filter_query(query)
+                if last_item_is_necessary:
+                    necessary_occurrence, necessary_clause = necessary_items.pop()
+                    is_scoring = is_scoring or necessary_occurrence == 'must'
+                    optional_items.append(_wrap_clause(necessary_occurrence, necessary_clause))
+                optional_items.append(_wrap_clause(occurrence, clause))
+                is_scoring = is_scoring or occurrence == 'must'
+                last_item_is_necessary = False
+            elif query.operation & QueryOperation.order_asc == QueryOperation.order_asc:
+                # order asc
+                sort_items.append({
+                    query.member: {
+                        'order': 'asc',
+                        'ignore_unmapped': True,
+                        'missing': '_first',
+                    }
+                })
+            elif query.operation & QueryOperation.order_desc == QueryOperation.order_desc:
+                # order desc
+                sort_items.append({
+                    query.member: {
+                        'order': 'desc',
+                        'ignore_unmapped': True,
+                        'missing': '_last',
+                    }
+                })
+
+        is_scoring = is_scoring or any(x[0] == 'must' for x in necessary_items)
+        necessary_query = None
+        if len(necessary_items):
+            necessary_query = {'bool': {}}
+            for occurrence, clause in necessary_items:
+                necessary_query['bool'].setdefault(occurrence, []).append(clause)
+        if len(optional_items):
+            if necessary_query:
+                optional_items.append(necessary_query)
+            query = {
+                'bool': {
+                    'should': optional_items,
+                    'minimum_should_match': 1,
+                }
+            }
+        else:
+            query = necessary_query
+        return query, sort_items, is_scoring
+    def __compile_filter_query(self, query):
+        """
+        Parse the tina query cell to elastic search clause in the filter context.
+        :param query: The tina query cell.
+        :returns: {tuple} ({string}, {dict})
+            The occurrence of the clause. 'filter', 'must_not' or 'must'.
+            The elastic search clause.
+        """
+        operation = query.operation & QueryOperation.normal_operation_mask
+        if operation & QueryOperation.like == QueryOperation.like:
+            # the relevance is needed
+            return 'must', self.__compile_query(query)
+        elif operation & QueryOperation.unlike == QueryOperation.unlike:
+            return 'filter', self.__compile_query(query)
+        elif query.value is not None and operation in (QueryOperation.equal, QueryOperation.unequal,
+                                                       QueryOperation.contains, QueryOperation.exclude)\
+                and self.__is_analyzed(query.member):
+            # equal, unequal, contains and exclude of analyzed strings, `term` doesn't analyze the value
+            if operation == QueryOperation.unequal:
+                return 'must_not', self.__compile_query(QueryCell(QueryOperation.equal, query.member, query.value))
+            return 'filter', self.__compile_query(query)
+        elif operation & QueryOperation.contains == QueryOperation.contains:
+            return 'filter', {'terms': {query.member: list(query.value)}}
+        elif operation & QueryOperation.exclude == QueryOperation.exclude:
+            return 'must_not', {'terms': {query.member: list(query.value)}}
+        elif operation >= QueryOperation.less:
+            # range
+            return 'filter', self.__compile_query(query)
+        elif operation & QueryOperation.equal == QueryOperation.equal:
+            if query.value is None:
+                return 'must_not', {'exists': {'field': query.member}}
+            return 'filter', {'term': {query.member: query.value}}
+        else:
+            # unequal
+            if query.value is None:
+                return 'filter', {'exists': {'field': query.member}}
+            return 'must_not', {'term': {query.member: query.value}}
+
+    def __is_analyzed(self, member):
+        """
+        Is the member an analyzed string field? Members of sub-documents are treated as analyzed.
+        :param member: {string} The member of the query.
+        :return: {bool}
+        """
+        if member == '_id':
+            return False
+        property = self.document_class.get_properties().get(member)
+        if property is None:
+            return True
+        if isinstance(property, ListProperty):
+            return property.item_type in (None, str) and property.analyzer != 'keyword'
+        return isinstance(property, StringProperty) and property.analyzer != 'keyword'
+
     def __compile_query(self, query):
         """
         Parse the tina query cell to elastic search query.
@@ -429,11 +1417,7 @@ class Query(object):
                                 }
                             }
                         },
-                        {
-                            'regexp': {
-                                query.member: '.*%s.*' % query.value
-                            }
-                        },
+                        self.__compile_substring_query(query),
                     ]
                 }
             }
@@ -456,11 +1440,7 @@ class Query(object):
                         },
                         {
                             'bool': {
-                                'must_not': {
-                                    'regexp': {
-                                        query.member: '.*%s.*' % query.value
-                                    }
-                                }
+                                'must_not': self.__compile_substring_query(query)
                             }
                         },
                     ]
@@ -576,6 +1556,32 @@ class Query(object):
                     }
                 }
 
+    def __compile_substring_query(self, query):
+        """
+        Compile the substring part of `like` and `unlike`.
+        It uses the n-gram subfield of StringProperty(substring_search=True),
+        other properties and values which are shorter than n-grams fall back to the regexp.
+        The n-gram tokenizer puts each gram at the next position, so the phrase requires grams of the value
+        to be adjacent and in order like the substring.
+        :param query: The tina query cell.
+        :return: {dict} The elastic search query.
+        """
+        property = self.document_class.get_properties().get(query.member)
+        if isinstance(property, StringProperty) and property.substring_search\
+                and _get_length(query.value) >= SUBSTRING_GRAM:
+            return {
+                'match_phrase': {
+                    '%s.%s' % (query.member, SUBSTRING_FIELD): {
+                        'query': query.value,
+                    }
+                }
+            }
+        return {
+            'regexp': {
+                query.member: _format_value('.*%s.*', query.value)
+            }
+        }
+
     def __convert_datetime_for_query(self, date_time):
         """
         Convert datetime data for query.
@@ -610,3 +1616,63 @@ class Query(object):
         except KeyError:
             raise QuerySyntaxError
         return operation, kwargs[key]
+
+
+def _wrap_clause(occurrence, clause):
+    """
+    Wrap the clause of the filter context as a `bool.should` item.
+    :param occurrence: {string} 'filter', 'must_not' or 'must'.
+    :param clause: {dict} The elastic search clause.
+    :return: {dict}
+    """
+    if occurrence == 'must':
+        return clause
+    return {'bool': {occurrence: clause}}
+
+def _get_length(value):
+    """
+    Get the length of the value of the query.
+    :param value: The value or {CompiledQuerySlot}.
+    :return: {int}
+    """
+    if isinstance(value, CompiledQuerySlot):
+        return value.length
+    return len(value) if isinstance(value, str) else len(str(value))
+
+def _get_shape(operation, values):
+    """
+    Get the shape of values of the tina query cell for the key of the compiled query cache.
+    :param operation: {int} The operation of the tina query cell.
+    :param values: {list} The values of the tina query cell.
+    :return: {int or tuple} The number of values.
+        `like` and `unlike`: (1, {bool}) Is the value shorter than n-grams of substring search?
+    """
+    if operation & QueryOperation.unlike == QueryOperation.unlike:
+        return len(values), _get_length(values[0]) < SUBSTRING_GRAM
+    return len(values)
+
+def _format_value(template, value):
+    """
+    Format the value of the query. The slot is formatted when it is bound.
+    :param template: {string} ex: '.*%s.*'
+    :param value: The value or {CompiledQuerySlot}.
+    :return: {string or CompiledQuerySlot}
+    """
+    if isinstance(value, CompiledQuerySlot):
+        return CompiledQuerySlot(value.index, template)
+    return template % value
+
+def _bind_template(item, values):
+    """
+    Build the query from the compiled query template. Slots are replaced with values.
+    :param item: The compiled query template or its member.
+    :param values: {list} The values of the query.
+    :return: The copy of the item with values.
+    """
+    if isinstance(item, CompiledQuerySlot):
+        return item.bind(values)
+    if isinstance(item, dict):
+        return {x: _bind_template(y, values) for x, y in item.items()}
+    if isinstance(item, (list, tuple)):
+        return type(item)(_bind_template(x, values) for x in item)
+    return item
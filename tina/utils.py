@@ -1,22 +1,172 @@
+import asyncio
+import inspect
+import threading
 from django.conf import settings
 import elasticsearch
+try:
+    import contextvars
+except ImportError:
+    # python < 3.7
+    contextvars = None
 
 
-def get_elasticsearch():
+_elasticsearch_clients = {}  # {url or (url, event_loop): {Elasticsearch or AsyncElasticsearch}}
+_elasticsearch_clients_lock = threading.Lock()
+
+
+def get_elasticsearch(url=None):
     """
     Get the connection for ElasticSearch.
+    The client is created once per url and shared by the whole process.
+    Its urllib3 connection pool is thread-safe and keeps connections alive between requests.
+    :param url: {string} The elasticsearch url. Default is settings.TINA_ELASTICSEARCH_URL.
+    :return: {Elasticsearch}
+    """
+    if url is None:
+        url = getattr(settings, 'TINA_ELASTICSEARCH_URL', 'http://localhost:9200')
+    client = _elasticsearch_clients.get(url)
+    if client is not None:
+        return client
+
+    with _elasticsearch_clients_lock:
+        client = _elasticsearch_clients.get(url)
+        if client is None:
+            client = _create_elasticsearch(url)
+            _elasticsearch_clients[url] = client
+    return client
+
+def get_async_elasticsearch(url=None):
+    """
+    Get the asyncio connection for ElasticSearch. It requires elasticsearch-async.
+    The client is created once per url and event loop, it has its own aiohttp connection pool.
+    Clients of closed event loops are dropped. Await `close_async_elasticsearch()` before closing the loop
+    to close their connections.
+    :param url: {string} The elasticsearch url. Default is settings.TINA_ELASTICSEARCH_URL.
+    :return: {AsyncElasticsearch}
+    """
+    if url is None:
+        url = getattr(settings, 'TINA_ELASTICSEARCH_URL', 'http://localhost:9200')
+    key = (url, asyncio.get_event_loop())
+    client = _elasticsearch_clients.get(key)
+    if client is not None:
+        return client
+
+    with _elasticsearch_clients_lock:
+        for closed_key in [x for x in _elasticsearch_clients if isinstance(x, tuple) and x[1].is_closed()]:
+            del _elasticsearch_clients[closed_key]
+        client = _elasticsearch_clients.get(key)
+        if client is None:
+            from elasticsearch_async import AsyncElasticsearch
+            client = _create_elasticsearch(url, AsyncElasticsearch)
+            _elasticsearch_clients[key] = client
+    return client
+
+async def close_async_elasticsearch():
+    """
+    Close and drop asyncio clients of the current event loop.
+    """
+    loop = asyncio.get_event_loop()
+    with _elasticsearch_clients_lock:
+        keys = [x for x in _elasticsearch_clients if isinstance(x, tuple) and x[1] is loop]
+        clients = [_elasticsearch_clients.pop(x) for x in keys]
+    for client in clients:
+        result = client.transport.close()
+        if inspect.isawaitable(result):
+            await result
+
+def reset_elasticsearch():
+    """
+    Drop all shared clients. The next get_elasticsearch() call creates new ones.
+    Call it in a forked child process, it should not reuse sockets of the parent.
+    """
+    with _elasticsearch_clients_lock:
+        _elasticsearch_clients.clear()
+
+def copy_elasticsearch(es):
+    """
+    Create a new client with the hosts and the settings of the client.
+    A forked process uses it instead of the client of the parent process, they would share sockets.
+    :param es: {Elasticsearch}
     :return: {Elasticsearch}
     """
-    url = getattr(settings, 'TINA_ELASTICSEARCH_URL', 'http://localhost:9200')
+    transport = es.transport
+    return type(es)(
+        transport.hosts,
+        connection_class=transport.connection_class,
+        max_retries=transport.max_retries,
+        retry_on_timeout=transport.retry_on_timeout,
+        **transport.kwargs
+    )
+
+def _create_elasticsearch(url, client_class=None):
+    """
+    Create the connection for ElasticSearch with the connection settings.
+    :param url: {string} The elasticsearch url.
+    :param client_class: {type} Elasticsearch or AsyncElasticsearch. Default is Elasticsearch.
+    :return: {Elasticsearch or AsyncElasticsearch}
+    """
+    if client_class is None:
+        client_class = elasticsearch.Elasticsearch
+    kwargs = {
+        # the number of connections in the pool of each node
+        'maxsize': getattr(settings, 'TINA_ELASTICSEARCH_MAXSIZE', 10),
+        # the timeout of the request in seconds
+        'timeout': getattr(settings, 'TINA_ELASTICSEARCH_TIMEOUT', 10),
+        'max_retries': getattr(settings, 'TINA_ELASTICSEARCH_MAX_RETRIES', 3),
+        'retry_on_timeout': getattr(settings, 'TINA_ELASTICSEARCH_RETRY_ON_TIMEOUT', False),
+    }
     if url.startswith('https://'):
         import certifi
-        return elasticsearch.Elasticsearch(
-            url,
-            verify_certs=True,
-            ca_certs=certifi.where(),
-        )
-    else:
-        return elasticsearch.Elasticsearch(url)
+        kwargs['verify_certs'] = True
+        kwargs['ca_certs'] = certifi.where()
+    return client_class(url, **kwargs)
+
+def perform_request(es, method, url, params=None, body=None):
+    """
+    Send the request of the api which the client doesn't have. (_reindex, _delete_by_query, _tasks)
+    :param es: {Elasticsearch}
+    :param method: {string} 'GET', 'POST'
+    :param url: {string} '/_reindex'
+    :param params: {dict} The query string.
+    :param body: {dict}
+    :return: {dict} The response data.
+    """
+    response = es.transport.perform_request(method, url, params=params, body=body)
+    if isinstance(response, tuple):
+        # elasticsearch-py < 6 returns (status, data)
+        response = response[1]
+    return response
+
+class ContextLocal(object):
+    """
+    The value which is local to the current context.
+    Each thread and each asyncio task has its own value with contextvars of python 3.7+.
+    Coroutines in the same thread share the value on older versions.
+    """
+    def __init__(self, name):
+        if contextvars is None:
+            self.__local = threading.local()
+            self.__var = None
+        else:
+            self.__local = None
+            self.__var = contextvars.ContextVar(name, default=None)
+
+    def get(self):
+        """
+        :return: The value of the current context. None: the value isn't set.
+        """
+        if self.__var is None:
+            return getattr(self.__local, 'value', None)
+        return self.__var.get()
+
+    def set(self, value):
+        """
+        :param value: The value of the current context.
+        """
+        if self.__var is None:
+            self.__local.value = value
+        else:
+            self.__var.set(value)
 
 def get_index_prefix():
     """